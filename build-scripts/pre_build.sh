@@ -35,6 +35,10 @@ check_python_code() {
       pylint ${function_directory}
       echo "  Testing ${function_directory}"
       python -m pytest .
+      if [ -f "tools/cold_start.py" ]; then
+        echo "  Checking cold start import budget of ${function_directory}"
+        python -m tools.cold_start
+      fi
     fi
   done
 }
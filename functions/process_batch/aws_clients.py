@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+import os
+import threading
+
+## services shared through the registry
+S3 = "s3"
+EVENTS = "events"
+STEP_FUNCTIONS = "stepfunctions"
+SNS = "sns"
+DYNAMODB = "dynamodb"
+SSM = "ssm"
+
+## botocore settings, overridable through the environment
+DEFAULT_MAX_POOL_CONNECTIONS = 50
+DEFAULT_RETRY_MODE = "adaptive"
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 60
+
+## clients of this process; boto3 is imported on first use to keep it off the handlers' import path
+_clients = {}
+_session = None
+_pid = None
+_lock = threading.Lock()
+
+
+def client_config(configuration=None):
+    """botocore Config shared by every client
+
+    Args:
+        configuration (dict, optional): settings, os.environ by default
+            (AWS_MAX_POOL_CONNECTIONS, AWS_RETRY_MODE, AWS_MAX_ATTEMPTS,
+            AWS_CONNECT_TIMEOUT, AWS_READ_TIMEOUT)
+
+    Returns:
+        botocore.config.Config
+    """
+    from botocore.config import Config
+
+    configuration = os.environ if configuration is None else configuration
+
+    def setting(key, default):
+        return type(default)(configuration.get(key, "") or default)
+
+    return Config(
+        max_pool_connections=setting("AWS_MAX_POOL_CONNECTIONS", DEFAULT_MAX_POOL_CONNECTIONS),
+        connect_timeout=setting("AWS_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT),
+        read_timeout=setting("AWS_READ_TIMEOUT", DEFAULT_READ_TIMEOUT),
+        retries={
+            'mode': setting("AWS_RETRY_MODE", DEFAULT_RETRY_MODE),
+            'max_attempts': setting("AWS_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS),
+        })
+
+
+def get_client(service):
+    """Shared boto3 client of a service, created on first use
+
+    Clients are thread safe and kept for the life of the process, so warm
+    invocations and every module reuse their connection pools. A forked
+    process builds its own clients rather than sharing sockets with its parent.
+
+    Args:
+        service (str): boto3 service name, e.g. S3
+
+    Returns:
+        botocore client
+    """
+    global _session, _pid
+
+    client = _clients.get(service) if _pid == os.getpid() else None
+    if client is not None:
+        return client
+
+    with _lock:
+        if _pid != os.getpid():
+            _clients.clear()
+            _session = None
+            _pid = os.getpid()
+
+        if service not in _clients:
+            if _session is None:
+                import boto3.session
+                _session = boto3.session.Session()
+            _clients[service] = _session.client(service, config=client_config())
+        return _clients[service]
+
+
+def reset():
+    """Drop every cached client, e.g. after changing credentials or in tests"""
+    global _session
+    with _lock:
+        _clients.clear()
+        _session = None
+
+
+def s3():
+    return get_client(S3)
+
+
+def events():
+    return get_client(EVENTS)
+
+
+def stepfunctions():
+    return get_client(STEP_FUNCTIONS)
+
+
+def sns():
+    return get_client(SNS)
+
+
+def dynamodb():
+    return get_client(DYNAMODB)
+
+
+def ssm():
+    return get_client(SSM)
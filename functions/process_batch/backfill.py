@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+import re
+import logging
+from datetime import datetime, timedelta
+
+import compression
+
+## `YYYY-MM-DD` of backfill ranges and partition dates
+DATE_FORMAT = "%Y-%m-%d"
+
+## executions started at once by a backfill, and the most days enriched by one execution
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_MAX_DAYS_PER_EXECUTION = 7
+
+## how far before the first day to look for the metadata snapshot it is enriched against
+DEFAULT_METADATA_LOOKBACK_DAYS = 31
+
+## executions started by backfills are named <prefix><snapshot>-<first day>-<last day>
+EXECUTION_NAME_PREFIX = "process-batch-backfill-"
+
+logger = logging.getLogger(__name__)
+
+
+def parse_date(value):
+    return datetime.strptime(value, DATE_FORMAT).date()
+
+
+def date_range(start, end):
+    """Every day from start to end, both included"""
+    if end < start:
+        raise ValueError(f"backfill range ends ({end}) before it starts ({start})")
+    return [start + timedelta(days=n) for n in range((end - start).days + 1)]
+
+
+def day_prefix(prefix, day):
+    return "{}/{:04d}/{:02d}/{:02d}".format(prefix.strip("/"), day.year, day.month, day.day)
+
+
+def month_prefix(prefix, year, month):
+    return "{}/{:04d}/{:02d}/".format(prefix.strip("/"), year, month)
+
+
+def partition_date_of(key, prefix):
+    """Day of a key under `<prefix>/YYYY/MM/DD/`
+
+    Returns:
+        date: or None for keys outside the prefix
+    """
+    if not prefix:
+        return None
+    match = re.match(re.escape(prefix.strip("/")) + r"/(\d{4})/(\d{2})/(\d{2})/", key.lstrip("/"))
+    if match is None:
+        return None
+    try:
+        return datetime(*map(int, match.groups())).date()
+    except ValueError:
+        return None
+
+
+def discover_delta_partitions(discovery, bucket_name, delta_prefix, days):
+    """Delta file of every day that has one
+
+    Returns:
+        dict: day -> key of its delta .csv file (or compressed .csv.gz, ...)
+    """
+    suffixes = compression.suffixes(".csv")
+    listings = discovery.list_many([(bucket_name, day_prefix(delta_prefix, day) + "/", suffixes) for day in days])
+    partitions = {}
+    for day, keys in zip(days, listings):
+        if keys:
+            ## like validate_get_paths, the last listed csv is the day's delta
+            partitions[day] = keys[-1]
+    return partitions
+
+
+def discover_metadata_snapshots(discovery, bucket_name, metadata_prefix, first_day, last_day, number_of_files,
+                                lookback_days=DEFAULT_METADATA_LOOKBACK_DAYS):
+    """Days from `lookback_days` before first_day to last_day with a complete metadata snapshot
+
+    A snapshot is complete when its partition holds `number_of_files` .txt
+    files, compressed or not. Each month is listed once.
+
+    Returns:
+        list: sorted days
+    """
+    months = []
+    day = first_day - timedelta(days=lookback_days)
+    while day <= last_day:
+        if (day.year, day.month) not in months:
+            months.append((day.year, day.month))
+        day += timedelta(days=1)
+
+    suffixes = compression.suffixes(".txt")
+    listings = discovery.list_many([(bucket_name, month_prefix(metadata_prefix, year, month), suffixes)
+                                    for year, month in months])
+    files = {}
+    for keys in listings:
+        for key in keys:
+            day = partition_date_of(key, metadata_prefix)
+            if day is not None:
+                files[day] = files.get(day, 0) + 1
+
+    return sorted(day for day, count in files.items() if count == int(number_of_files) and day <= last_day)
+
+
+def group_by_snapshot(partitions, snapshots, max_days=DEFAULT_MAX_DAYS_PER_EXECUTION):
+    """Group delta partitions by the metadata snapshot they are enriched against
+
+    Each day uses the latest snapshot on or before it, so consecutive days
+    between two metadata drops share one snapshot and one execution; groups
+    are split after `max_days` days to keep execution inputs small.
+
+    Args:
+        partitions (dict): day -> delta file key
+        snapshots (list): sorted days with a complete metadata snapshot
+        max_days (int): most days in a group
+
+    Returns:
+        tuple: groups ({'snapshot', 'days', 'delta_keys'}, in day order) and
+            the days without any earlier snapshot
+    """
+    groups = []
+    unmatched = []
+    for day in sorted(partitions):
+        earlier = [snapshot for snapshot in snapshots if snapshot <= day]
+        if not earlier:
+            unmatched.append(day)
+            continue
+
+        snapshot = earlier[-1]
+        if not groups or groups[-1]['snapshot'] != snapshot or len(groups[-1]['days']) >= max_days:
+            groups.append({'snapshot': snapshot, 'days': [], 'delta_keys': []})
+        groups[-1]['days'].append(day)
+        groups[-1]['delta_keys'].append(partitions[day])
+
+    return (groups, unmatched)
+
+
+def execution_name(group):
+    return "{}{}-{}-{}".format(EXECUTION_NAME_PREFIX, group['snapshot'].strftime(DATE_FORMAT),
+                               group['days'][0].strftime(DATE_FORMAT), group['days'][-1].strftime(DATE_FORMAT))
+
+
+def backfill_executions(stepfunctions, state_machine_arn):
+    """Status of every backfill execution of a state machine, whatever its status
+
+    Returns:
+        dict: execution name -> status (RUNNING, SUCCEEDED, FAILED, TIMED_OUT or ABORTED)
+    """
+    executions = {}
+    kwargs = {'stateMachineArn': state_machine_arn}
+    while True:
+        response = stepfunctions.list_executions(**kwargs)
+        executions.update((execution['name'], execution['status']) for execution in response.get('executions', [])
+                          if execution['name'].startswith(EXECUTION_NAME_PREFIX))
+        if not response.get('nextToken'):
+            break
+        kwargs['nextToken'] = response['nextToken']
+    return executions
+
+
+def schedule(groups, executions, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """Split groups into those to start now, those left pending and those already started
+
+    At most `max_concurrency` backfill executions run at once. Groups with
+    an execution are never started again: execution names are unique per
+    state machine, so a finished group would only come back as a duplicate.
+    Only running executions take a slot.
+
+    Args:
+        groups (list): groups from group_by_snapshot
+        executions (dict): status of the backfill executions by name, from backfill_executions
+
+    Returns:
+        tuple: (groups to start, pending groups, groups already started)
+    """
+    started = [group for group in groups if execution_name(group) in executions]
+    waiting = [group for group in groups if execution_name(group) not in executions]
+
+    running = sum(1 for status in executions.values() if status == 'RUNNING')
+    slots = max(int(max_concurrency) - running, 0)
+    return (waiting[:slots], waiting[slots:], started)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+import json
+import gzip
+import hashlib
+import logging
+
+import utils
+import aws_clients
+import compression
+import fda_records
+
+## EventBridge rejects entries larger than 256 KB; leave headroom for the envelope
+DEFAULT_THRESHOLD_BYTES = 200 * 1024
+
+## fields copied from the full payload into the slim event
+KEY_FIELDS = ['s3_raw', 'last_updated', 'source_url', 'file_name', 'data_source', 'drug_name']
+FDA_KEY_FIELDS = ['application_no', 'submission_no', 'submission_type_id']
+
+
+def serialized_size(payload):
+    """Size in bytes of the payload serialized as it is sent in the event detail
+
+    Args:
+        payload (dict): enrichment payload
+    """
+    return len(fda_records.event_detail(payload).encode('utf-8'))
+
+
+class ClaimCheck(object):
+    """
+    Offload oversized enrichment payloads to S3 and replace them with a slim
+    event carrying a pointer to the stored body and the key fields.
+
+    Bodies are stored gzip compressed under the sha256 of their canonical
+    JSON, so identical payloads are written once.
+
+    Args:
+        s3_uri (str): s3 prefix the payloads are stored under
+        s3_client: boto3 s3 client
+        threshold (int): payloads larger than this many bytes are offloaded
+    """
+
+    def __init__(self, s3_uri, s3_client=None, threshold=DEFAULT_THRESHOLD_BYTES):
+        self.s3_uri = s3_uri.rstrip("/")
+        self.bucket_name, self.prefix, _ = utils.split_s3_url(self.s3_uri)
+        self.client = s3_client if s3_client is not None else aws_clients.s3()
+        self.threshold = int(threshold)
+
+        # digests known to exist in the bucket
+        self.stored = set()
+        self.offloaded_count = 0
+        self.logger = logging.getLogger(__name__)
+
+    def make_key(self, digest):
+        return "{}/{}/{}.json.gz".format(self.prefix, digest[:2], digest) if self.prefix else \
+            "{}/{}.json.gz".format(digest[:2], digest)
+
+    def check(self, payload):
+        """Return the payload to publish, offloading it when it is too large
+
+        Args:
+            payload (dict): enrichment payload
+
+        Returns:
+            dict: the payload itself, or the slim event pointing to S3
+        """
+        size = serialized_size(payload)
+        if size <= self.threshold:
+            return payload
+
+        body = json.dumps(payload, sort_keys=True, default=str).encode('utf-8')
+        digest = hashlib.sha256(body).hexdigest()
+        key = self.make_key(digest)
+
+        self.store(key, digest, body)
+        self.offloaded_count += 1
+
+        return self.make_slim_payload(payload, key, digest, size)
+
+    def offload(self, value):
+        """Store any JSON value and return the pointer standing for it, see resolve
+
+        Args:
+            value: JSON serializable value, e.g. a chunk of delta records
+
+        Returns:
+            dict: {'claim_check': {'s3_uri', 'sha256', 'size_bytes', 'content_encoding'}}
+        """
+        body = json.dumps(value, sort_keys=True, default=str).encode('utf-8')
+        digest = hashlib.sha256(body).hexdigest()
+        key = self.make_key(digest)
+
+        self.store(key, digest, body)
+        self.offloaded_count += 1
+
+        return {'claim_check': {
+            's3_uri': utils.make_s3_uri(self.bucket_name, key),
+            'sha256': digest,
+            'size_bytes': len(body),
+            'content_encoding': 'gzip'
+        }}
+
+    def store(self, key, digest, body):
+        if digest in self.stored:
+            return
+
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket_name, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+                raise
+            self.client.put_object(Bucket=self.bucket_name, Key=key, Body=gzip.compress(body),
+                                   ContentType='application/json', ContentEncoding='gzip')
+            self.logger.info(f"offloaded {len(body)} byte payload to: {utils.make_s3_uri(self.bucket_name, key)}")
+
+        self.stored.add(digest)
+
+    def make_slim_payload(self, payload, key, digest, size):
+        slim = dict((field, payload[field]) for field in KEY_FIELDS if field in payload)
+
+        fda = payload.get('fda', {})
+        slim['fda'] = dict((field, fda[field]) for field in FDA_KEY_FIELDS if field in fda)
+
+        slim['claim_check'] = {
+            's3_uri': utils.make_s3_uri(self.bucket_name, key),
+            'sha256': digest,
+            'size_bytes': size,
+            'content_encoding': 'gzip'
+        }
+        return slim
+
+
+def is_pointer(value):
+    """Whether a value is a pointer built by ClaimCheck.offload"""
+    return isinstance(value, dict) and set(value) == {'claim_check'}
+
+
+def resolve(value):
+    """The value a pointer built by ClaimCheck.offload stands for; other values are returned unchanged"""
+    if not is_pointer(value):
+        return value
+
+    content = utils.read_obj_from_bucket(value['claim_check']['s3_uri'])
+    with compression.open_stream(content['Body'], 'utf-8') as f:
+        return json.load(f)
+
+
+def get_claim_check(configuration, s3_client=None):
+    """Build the claim check configured by CLAIM_CHECK_S3_URI, if any
+
+    Args:
+        configuration (dict): environment configuration
+        s3_client (optional): boto3 s3 client
+
+    Returns:
+        ClaimCheck or None
+    """
+    s3_uri = configuration.get("CLAIM_CHECK_S3_URI", "")
+    if not s3_uri:
+        return None
+
+    threshold = configuration.get("CLAIM_CHECK_THRESHOLD_BYTES", "") or DEFAULT_THRESHOLD_BYTES
+    return ClaimCheck(s3_uri, s3_client=s3_client, threshold=threshold)
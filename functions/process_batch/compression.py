@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+Transparent reading and writing of compressed metadata, delta and snapshot files.
+
+Compressed inputs are recognised by their leading magic bytes, whatever
+their name, and decompressed incrementally as they are read, so an S3 body
+is never held in memory whole, compressed or not. Uncompressed inputs are
+read unchanged.
+"""
+
+import io
+import os
+import bz2
+import gzip
+import lzma
+import shutil
+
+## extension -> (magic bytes, module opening a compressed file object)
+CODECS = {
+    '.gz': (b'\x1f\x8b', gzip),
+    '.bz2': (b'BZh', bz2),
+    '.xz': (b'\xfd7zXZ\x00', lzma),
+}
+MAGIC_LENGTH = max(len(magic) for magic, _ in CODECS.values())
+
+## codec of the snapshots and files we write
+DEFAULT_CODEC = '.gz'
+
+## bytes pulled from the underlying stream per read
+CHUNK_SIZE = 1024 * 1024
+
+
+class PrefixedStream(io.RawIOBase):
+    """Raw stream replaying bytes already read from the head of another stream"""
+
+    def __init__(self, stream, head=b''):
+        self.stream = stream
+        self.head = head
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.head:
+            n = min(len(buffer), len(self.head))
+            buffer[:n] = self.head[:n]
+            self.head = self.head[n:]
+            return n
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if hasattr(self.stream, 'close'):
+            self.stream.close()
+        super(PrefixedStream, self).close()
+
+
+def detect(head):
+    """Extension of the codec whose magic bytes start `head`, None for uncompressed data"""
+    for extension, (magic, _) in CODECS.items():
+        if head.startswith(magic):
+            return extension
+    return None
+
+
+def codec_of(name):
+    """Extension of the codec a file name ends with, None when it names no codec"""
+    _, extension = os.path.splitext(name.lower())
+    return extension if extension in CODECS else None
+
+
+def strip_codec(name):
+    """File name without its codec extension, e.g. Products.txt for Products.txt.gz"""
+    return name[:-len(codec_of(name))] if codec_of(name) else name
+
+
+def suffixes(suffix):
+    """A file suffix and its compressed variants, for listings, e.g. ('.txt', '.txt.gz', ...)"""
+    return (suffix,) + tuple(suffix + extension for extension in CODECS)
+
+
+def open_stream(stream, encoding=None):
+    """Readable stream of the decompressed contents of a binary stream
+
+    Args:
+        stream: binary file object or S3 `Body`, read incrementally
+        encoding (str, optional): decode to text with this encoding and
+            universal newlines; binary when None
+
+    Returns:
+        file object: closing it closes `stream`
+    """
+    head = stream.read(MAGIC_LENGTH)
+    codec = detect(head)
+    reader = io.BufferedReader(PrefixedStream(stream, head), CHUNK_SIZE)
+    if codec is not None:
+        reader = CODECS[codec][1].open(reader, 'rb')
+    if encoding is None:
+        return reader
+    return io.TextIOWrapper(reader, encoding=encoding, newline=None)
+
+
+def open_path(path, encoding=None):
+    """Decompressed contents of a local file, see open_stream"""
+    return open_stream(open(path, 'rb'), encoding)
+
+
+def local_variant(path):
+    """The file itself, or the first compressed variant of it that exists; None when there is none"""
+    for candidate in (path,) + tuple(path + extension for extension in CODECS):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def compress_file(path, destination=None, codec=DEFAULT_CODEC):
+    """Compress a file in chunks
+
+    Args:
+        path (str): file to compress
+        destination (str, optional): compressed file, `path` plus the codec extension by default
+        codec (str): extension of the codec
+
+    Returns:
+        str: path of the compressed file
+    """
+    destination = destination or path + codec
+    with open(path, 'rb') as source, CODECS[codec][1].open(destination, 'wb') as target:
+        shutil.copyfileobj(source, target, CHUNK_SIZE)
+    return destination
+
+
+def copy_decompressed(stream, path):
+    """Write the decompressed contents of a binary stream to a file, in chunks"""
+    with open_stream(stream) as source, open(path, 'wb') as target:
+        shutil.copyfileobj(source, target, CHUNK_SIZE)
+    return path
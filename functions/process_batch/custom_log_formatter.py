@@ -2,28 +2,52 @@
 
 import logging
 import json
+import time
 
 ## Format logger
 
 
 class CustomLogFormatter(logging.Formatter):
+    """
+    JSON log formatter. The message is only built when a record is emitted,
+    and the time string is cached per second, since many records share it.
+    """
+
+    converter = time.gmtime
+
+    def __init__(self, fmt=None, datefmt=None, *args, **kwargs):
+        super(CustomLogFormatter, self).__init__(fmt, datefmt, *args, **kwargs)
+        self.time_cache = (None, None)
+
+    def format_time(self, record):
+        second = int(record.created)
+        cached_second, cached_time = self.time_cache
+        if cached_second != second:
+            cached_time = time.strftime(self.datefmt or "%Y-%m-%dT%H:%M:%S", self.converter(second))
+            self.time_cache = (second, cached_time)
+        return '%s.%dZ' % (cached_time, record.msecs)
 
     def format(self, record):
 
         ## get message from record
         record.message = record.getMessage()
 
-        ## include time
-        if self.usesTime():
-            record.asctime = self.formatTime(record, self.datefmt)
-
         j = {
             'levelname': record.levelname,
-            'time': '%(asctime)s.%(msecs)dZ' % dict(asctime=record.asctime, msecs=record.msecs),
+            'time': self.format_time(record),
             'aws_request_id': getattr(record, 'aws_request_id', '00000000-0000-0000-0000-000000000000'),
             'message': record.message,
             'module': record.module,
             'extra_data': record.__dict__.get('data', {}),
         }
 
-        return json.dumps(j)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            j['exception'] = record.exc_text
+
+        ## embedded metric format documents must be at the top level of the log line
+        if 'emf' in record.__dict__:
+            j.update(record.__dict__['emf'])
+
+        return json.dumps(j, default=str)
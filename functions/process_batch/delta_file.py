@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+import csv
+import json
+import locale
+import logging
+import itertools
+
+import utils
+import compression
+
+## delta files are exported with either lower case or FDA style headers
+DELTA_COLUMN_ALIASES = {
+    's3path': 's3_path',
+    'applicationdocsurl': 'url'
+}
+
+
+def normalise_header(name):
+    """Map a delta file column name to the lower case name used in records
+
+    Args:
+        name (str): column name as found in the csv header
+    """
+    key = name.strip().lower()
+    return DELTA_COLUMN_ALIASES.get(key, key)
+
+
+def read_delta_lines(path, is_local=False):
+    """Read the delta file from the local filesystem or s3
+
+    gzip, bz2 and xz files are decompressed as they are read; a local
+    file may also be found under its name plus the codec extension.
+
+    Args:
+        path (str): local path or s3 url of the delta file
+        is_local (bool): read from the local filesystem
+
+    Returns:
+        generator: lines of the delta file
+    """
+    if is_local:
+        ## decoded like open(path, 'r')
+        stream, encoding = open(compression.local_variant(path) or path, 'rb'), locale.getpreferredencoding(False)
+    else:
+        stream, encoding = utils.read_obj_from_bucket(path)['Body'], 'utf-8'
+
+    with compression.open_stream(stream, encoding) as f:
+        for line in f:
+            yield line.rstrip("\n")
+
+
+def parse_delta_rows(lines):
+    """Parse delta file lines, skipping blank lines and rows of empty columns
+
+    Args:
+        lines (iterable): lines of the delta file, header first
+
+    Returns:
+        generator: rows keyed by normalised column name
+    """
+    lines = (line for line in lines if line.replace(",", "").strip())
+
+    reader = csv.DictReader(lines, delimiter=',')
+    if reader.fieldnames is None:
+        return
+
+    reader.fieldnames = [normalise_header(name) for name in reader.fieldnames]
+    for row in reader:
+        yield row
+
+
+def map_row(row):
+    """Map a delta row to the record format passed to process_batch"""
+    return {
+        'appplication_docs_type_id': row['applicationdocstypeid'],
+        'application_no': row['applno'],
+        'submission_type': row['submissiontype'],
+        'submission_no': row['submissionno'],
+        'application_docs_url': row['url'],
+        'drug_name': row['drugname'],
+        's3_path': row['s3_path'],
+        'url': row['url']
+    }
+
+
+def is_cfm_folder(row):
+    return row['s3_path'].endswith("cfm")
+
+
+## fields process_batch converts with int(); application numbers may instead be resolved from the drug name
+NUMERIC_FIELDS = ('submission_no', 'appplication_docs_type_id')
+
+
+def normalise_record(record):
+    """Record with every field stripped of surrounding whitespace, missing columns read as ''"""
+    return dict((name, (value or '').strip() if isinstance(value, str) or value is None else value)
+                for name, value in record.items())
+
+
+def is_number(value):
+    """Whether int() reads a field, e.g. '004782' but not '' or '4782a'"""
+    return value.isascii() and value.isdigit()
+
+
+def as_key_number(value):
+    """Number of a numeric field without its leading zeros, the field itself when it is not a number"""
+    return str(int(value)) if is_number(value) else value
+
+
+def enrichment_key(record):
+    """Fields the enrichment of a record depends on; records sharing it get the same payload but for their document
+
+    Records without an application number are keyed by the drug name they
+    are resolved from.
+    """
+    application_no = str(record.get('application_no') or '').strip()
+    drug_name = '' if is_number(application_no) else (record.get('drug_name') or '').strip().lower()
+    return (as_key_number(application_no), as_key_number(str(record.get('submission_no') or '').strip()),
+            as_key_number(str(record.get('appplication_docs_type_id') or '').strip()), drug_name)
+
+
+def validation_errors(record):
+    """Reasons a normalised record cannot be enriched, empty when it can"""
+    reasons = []
+    for name in NUMERIC_FIELDS:
+        if not record[name]:
+            reasons.append(f"{name} is blank")
+        elif not is_number(record[name]):
+            reasons.append(f"{name} is not a number: {record[name]!r}")
+    if not is_number(record['application_no']) and not record['drug_name']:
+        reasons.append("application_no is not a number and there is no drug_name to resolve it from")
+    return reasons
+
+
+def coalesce_records(records):
+    """Validate the delta records and coalesce them before chunking
+
+    Fields are stripped of whitespace (SubmissionType carries trailing
+    spaces), records that cannot be enriched are rejected with their
+    reasons, and exact repeats of a record are dropped. Repeats are
+    compared on every field: the s3 path is the submission's folder, shared
+    by its documents, which only differ by their url. The remaining records
+    are grouped by enrichment key, in order of first appearance, so
+    chunk_records can keep each group in one chunk where it is enriched once.
+
+    Args:
+        records (list): delta records as built by map_row
+
+    Returns:
+        tuple: (records to enrich, rejected records as {'record', 'reasons'}, number of duplicates dropped)
+    """
+    groups = {}
+    rejected = []
+    seen = set()
+    duplicates = 0
+    for record in records:
+        record = normalise_record(record)
+        reasons = validation_errors(record)
+        if reasons:
+            rejected.append({'record': record, 'reasons': reasons})
+            continue
+
+        identity = tuple(sorted(record.items()))
+        if identity in seen:
+            duplicates += 1
+            continue
+        seen.add(identity)
+        groups.setdefault(enrichment_key(record), []).append(record)
+
+    return ([record for group in groups.values() for record in group], rejected, duplicates)
+
+
+def write_rejects(rejected, s3_uri, run_id, name="rejects", s3_client=None):
+    """Write rejected records, one JSON line each with its reasons, to <s3_uri>/<run id>/<name>.jsonl
+
+    Returns:
+        str: s3 uri of the reject file
+    """
+    if s3_client is None:
+        import aws_clients
+        s3_client = aws_clients.s3()
+
+    uri = "{}/{}/{}.jsonl".format(s3_uri.rstrip("/"), run_id, name)
+    bucket_name, key, _ = utils.split_s3_url(uri)
+    body = "".join(json.dumps(reject, sort_keys=True) + "\n" for reject in rejected)
+    s3_client.put_object(Bucket=bucket_name, Key=key, Body=body.encode('utf-8'), ContentType='application/x-ndjson')
+    return uri
+
+
+def chunk_records(records, chunk_size, key=None):
+    """Split records into lists of at most chunk_size records
+
+    With a key, consecutive records sharing it are kept in one chunk when
+    they fit; a run of more than chunk_size records fills chunks of its own.
+
+    Args:
+        records (list): delta records
+        chunk_size (int): number of records per chunk
+        key (callable, optional): e.g. enrichment_key
+    """
+    n = max(int(chunk_size), 1)
+    if key is None:
+        return [records[i * n:(i + 1) * n] for i in range((len(records) + n - 1) // n)]
+
+    chunks, chunk = [], []
+    for _, group in itertools.groupby(records, key):
+        group = list(group)
+        if chunk and len(chunk) + len(group) > n:
+            chunks.append(chunk)
+            chunk = []
+        chunk.extend(group)
+        while len(chunk) >= n:
+            chunks.append(chunk[:n])
+            chunk = chunk[n:]
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def load_local_records(path, is_local=True):
+    """Load the records of a delta file that can be enriched without s3 listings
+
+    cfm folders need their inner pdfs listed from s3 and are skipped.
+
+    Args:
+        path (str): local path or s3 url of the delta file
+        is_local (bool): read from the local filesystem
+    """
+    records = []
+    skipped = 0
+    for row in parse_delta_rows(read_delta_lines(path, is_local)):
+        if is_cfm_folder(row):
+            skipped += 1
+            continue
+        records.append(map_row(row))
+
+    if skipped:
+        logging.getLogger(__name__).warning(f"{skipped} cfm folder rows skipped in: {path}")
+
+    return records
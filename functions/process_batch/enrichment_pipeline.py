@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+import queue
+import logging
+import threading
+from collections import deque
+
+## marks the end of the payload stream
+END_OF_STREAM = object()
+
+
+def bounded_map(executor, fn, items, window):
+    """Like executor.map, but with at most `window` calls in flight
+
+    Results are yielded in input order.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+class Publisher(threading.Thread):
+    """
+    Consumer thread writing enriched payloads to the output sink
+
+    Args:
+        sink (OutputSink): destination of the payloads
+        payloads (queue.Queue): bounded queue filled by the enrichment workers
+    """
+
+    def __init__(self, sink, payloads):
+        super(Publisher, self).__init__(name="publisher", daemon=True)
+        self.sink = sink
+        self.payloads = payloads
+        self.error = None
+
+    def run(self):
+        while True:
+            payload = self.payloads.get()
+            if payload is END_OF_STREAM:
+                break
+
+            # keep draining after a failure so producers never block
+            if self.error is not None:
+                continue
+
+            try:
+                self.sink.write(payload)
+            except Exception as e:
+                logging.exception("failed to publish payload")
+                self.error = e
+
+
+class SharedEnrichment(object):
+    """
+    Enrich function computing one payload per key, shared by the records with that key
+
+    The first record of a key is enriched; the others get a copy of its
+    payload with their own document fields. Records of one key enriched
+    concurrently wait for the first instead of repeating its lookups.
+
+    Args:
+        enrich (callable): maps a record to its payload
+        key (callable): maps a record to the key its payload depends on, e.g. delta_file.enrichment_key
+        document_fields (callable): maps a record to the payload fields of its own document
+    """
+
+    def __init__(self, enrich, key, document_fields):
+        self.enrich = enrich
+        self.key = key
+        self.document_fields = document_fields
+        self.results = {}
+        self.lock = threading.Lock()
+        self.shared_count = 0
+
+    def __call__(self, record):
+        from concurrent.futures import Future
+
+        key = self.key(record)
+        with self.lock:
+            result = self.results.get(key)
+            first = result is None
+            if first:
+                result = self.results[key] = Future()
+            else:
+                self.shared_count += 1
+
+        if first:
+            try:
+                result.set_result(self.enrich(record))
+            except Exception as e:
+                result.set_exception(e)
+            return result.result()
+
+        return dict(result.result(), **self.document_fields(record))
+
+
+def run_pipeline(enrich, records, sink, workers=1, queue_size=100):
+    """Enrich records and publish the payloads concurrently
+
+    Records are enriched on a pool of `workers` threads while a publisher
+    thread writes the finished payloads to the sink. The queue between them
+    holds at most `queue_size` payloads, so enrichment backs off when the
+    sink is slower.
+
+    Args:
+        enrich (callable): maps a delta record to its payload
+        records (list): delta records
+        sink (OutputSink): destination of the payloads
+        workers (int): number of enrichment threads
+        queue_size (int): maximum number of payloads waiting to be published
+
+    Returns:
+        int: number of payloads handed to the sink
+    """
+    workers = max(int(workers), 1)
+    payloads = queue.Queue(maxsize=max(int(queue_size), 1))
+
+    publisher = Publisher(sink, payloads)
+    publisher.start()
+
+    count = 0
+    try:
+        if workers == 1:
+            for record in records:
+                payloads.put(enrich(record))
+                count += 1
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="enrich") as executor:
+                for payload in bounded_map(executor, enrich, records, workers * 2):
+                    payloads.put(payload)
+                    count += 1
+    finally:
+        payloads.put(END_OF_STREAM)
+        publisher.join()
+
+    if publisher.error is not None:
+        raise publisher.error
+
+    return count
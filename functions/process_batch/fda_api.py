@@ -1,18 +1,19 @@
 #!/usr/bin/env python
 
 import os
-import json
 import sqlite3
 import traceback
 import csv
 import time
-
-from functools import reduce
+import threading
+import difflib
 
 import logging
 from collections import namedtuple
 
-from utils import load_log_config, make_unique_id, read_obj_from_bucket
+import compression
+from utils import make_unique_id, read_obj_from_bucket
+from fda_records import Product, Application, Submission
 
 META_DATA_ITEM = namedtuple("META_DATA_ITEM", 'tablename filename')
 
@@ -50,21 +51,64 @@ class FDAAPI(object):
     # TODO: check with Suresh
     APPROVED = "Approved"
 
+    # full text index of product drug names and active ingredients
+    PRODUCT_NAME_INDEX = 'product_name_index'
+
+    # FTS5 tokenizers tried in order; trigram (SQLite 3.34+) matches substrings of names
+    NAME_INDEX_TOKENIZERS = ['trigram', 'unicode61']
+
+    # candidate rows scored per name, and the score a record needs to be resolved by its drug name
+    NAME_MATCH_CANDIDATES = 200
+    NAME_MATCH_MIN_SCORE = 0.9
+
+    # indexes of the columns the lookups join and filter on, built into lookup snapshots
+    LOOKUP_INDEXES = [(PRODUCT, 'applNo, productNo'), (MARKETING_STATUS, 'applNo, productNo'),
+                      (TE, 'applNo, productNo'), (APPLICATION, 'applNo'), (SUBMISSION, 'applNo, subNo'),
+                      (APPLICATION_DOC, 'applNo, submissionNo'), (SUBMISSION_PROPERTY_TYPE, 'applNo, submissionNo')]
+
     def __init__(self, **kwargs):
         metadata_folder_loc = kwargs.get('S3_metadata_loc', '')
+        snapshot_loc = kwargs.get('snapshot', None)
 
-        if metadata_folder_loc is None:
+        if metadata_folder_loc is None and snapshot_loc is None:
             raise Exception("Metadata location was not specified!")
 
         self.metadata_folder_loc = metadata_folder_loc
-        self.engine_url = ":memory:"
+
+        # named in-memory database, shared by the per-thread read connections
+        self.engine_url = "file:fdaapi_%s?mode=memory&cache=shared" % make_unique_id()
+        if snapshot_loc:
+            self.engine_url = self.make_snapshot_url(snapshot_loc)
+        self.read_url = self.engine_url
+        self.snapshot_loc = snapshot_loc
+
+        # day the lookups of a versioned metadata store (metadata_store) are made as of
+        self.as_of = kwargs.get('as_of', None)
+        if self.as_of is not None and not snapshot_loc:
+            raise Exception("as_of lookups need a metadata store snapshot!")
 
         self.is_test = True if 'test' in kwargs else False
 
+        # read connections are opened once per thread, and tracked so close() closes them all
+        self.local = threading.local()
+        self.read_connections = []
+        self.read_connections_lock = threading.Lock()
+
+        # per table load timings, filled by insert_metadata
+        self.load_timings = {}
+        self.insert_seconds = 0.0
+
+        # optional StageMetrics recording lookup timings
+        self.metrics = kwargs.get('metrics', None)
+
         # setup logger
-        self.logger = load_log_config()
+        self.logger = logging.getLogger(__name__)
         self.conn, self.cursor = self.create_connection()
 
+        # snapshots are prebuilt, read-only databases
+        if snapshot_loc:
+            return
+
         result = self.create_tables()
 
         # if result - insert metadata
@@ -78,7 +122,8 @@ class FDAAPI(object):
         """
         conn = None
         try:
-            conn = sqlite3.connect(self.engine_url)
+            # closed by whichever thread calls close(), e.g. a warm lookup snapshot being replaced
+            conn = sqlite3.connect(self.engine_url, uri=True, check_same_thread=False)
             conn.row_factory = sqlite3.Row  # getting the column names
             c = conn.cursor()
         except Exception as e:
@@ -86,6 +131,115 @@ class FDAAPI(object):
 
         return (conn, c)
 
+    @staticmethod
+    def make_snapshot_url(path):
+        return "file:%s?mode=ro&immutable=1" % os.path.abspath(path)
+
+    def get_read_connection(self):
+        """Return the read-only connection of the calling thread
+
+        Each thread gets its own connection, so lookups can run concurrently
+        once the metadata has been loaded.
+        """
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.url != self.read_url:
+            if conn is not None:
+                self.close_read_connection(conn)
+            # closed by whichever thread calls close()
+            conn = sqlite3.connect(self.read_url, uri=True, check_same_thread=False)
+            conn.row_factory = self.sqlite_dict
+            if self.as_of is not None:
+                self.create_as_of_views(conn)
+            conn.execute("PRAGMA query_only = ON")
+            with self.read_connections_lock:
+                self.read_connections.append(conn)
+            self.local.conn = conn
+            self.local.url = self.read_url
+
+        return conn
+
+    def close_read_connection(self, conn):
+        with self.read_connections_lock:
+            if conn in self.read_connections:
+                self.read_connections.remove(conn)
+        conn.close()
+
+    def create_as_of_views(self, conn):
+        """Shadow the versioned tables of a metadata store with views of their rows as of `as_of`
+
+        Temporary views are resolved before the tables of the same name, so
+        the lookup queries read the metadata of that day unchanged.
+        """
+        import metadata_store
+
+        condition = metadata_store.valid_on(self.as_of)
+        for item, _ in self.metadata_tables():
+            columns = [name for name, _ in metadata_store.table_columns(conn, item.tablename)]
+            if metadata_store.VALID_FROM not in columns:
+                raise Exception(f"{self.snapshot_loc} is not a metadata store, {item.tablename} has no versions")
+
+            conn.execute("CREATE TEMP VIEW %s AS SELECT %s FROM main.%s WHERE %s" % (
+                item.tablename, ", ".join(c for c in columns if c not in metadata_store.VERSION_COLUMNS),
+                item.tablename, condition))
+
+    def snapshot(self, path):
+        """Write the loaded metadata to a SQLite database file
+
+        Args:
+            path (str): database file to create
+
+        Returns:
+            str: path of the snapshot
+        """
+        dest = sqlite3.connect(path)
+        try:
+            self.conn.backup(dest)
+        finally:
+            dest.close()
+
+        self.logger.info(f"metadata snapshot written to: {path}")
+        return path
+
+    def enable_concurrent_reads(self, path=None):
+        """Serve lookups from a read-only file snapshot of the metadata
+
+        Threads sharing the in-memory database are serialized by SQLite's
+        shared cache; an immutable snapshot file lets them read in parallel.
+
+        Args:
+            path (str, optional): snapshot file, a temporary file by default
+        """
+        if self.snapshot_loc:
+            return self.snapshot_loc
+
+        if path is None:
+            import tempfile
+
+            fd, path = tempfile.mkstemp(prefix="fdaapi_", suffix=".db")
+            os.close(fd)
+            os.remove(path)
+
+        self.snapshot_loc = self.snapshot(path)
+        self.read_url = self.make_snapshot_url(path)
+        self.owns_snapshot = True
+        return path
+
+    def close(self):
+        """Close the database and the read connections of every thread, and remove snapshots created by enable_concurrent_reads"""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+        with self.read_connections_lock:
+            read_connections, self.read_connections = self.read_connections, []
+        for conn in read_connections:
+            conn.close()
+        self.local = threading.local()
+
+        if getattr(self, 'owns_snapshot', False) and os.path.exists(self.snapshot_loc):
+            os.remove(self.snapshot_loc)
+            self.owns_snapshot = False
+
     def create_tables(self):
         number_of_tables = 0
         conn = self.conn
@@ -165,75 +319,246 @@ class FDAAPI(object):
         Args:
             sql (string): select query
         """
-        cur = self.conn.cursor()
-        self.conn.row_factory = self.sqlite_dict
+        cur = self.get_read_connection().cursor()
         cur.execute(sql)
         return cur.fetchall()
 
     def get_row(self, sql):
-        """Function for getting multiple rows
+        """Function for getting a single row
 
         Args:
             sql (string): select query
         """
-        cur = self.conn.cursor()
-        self.conn.row_factory = self.sqlite_dict
+        cur = self.get_read_connection().cursor()
         cur.execute(sql)
         return cur.fetchone()
 
+    def get_tuples(self, sql, parameters):
+        """Rows of a parameterized query as plain tuples, in the order of the selected columns"""
+        cur = self.get_read_connection().cursor()
+        cur.row_factory = None
+        return cur.execute(sql, parameters).fetchall()
+
+    def get_tuple(self, sql, parameters):
+        """First row of a parameterized query as a plain tuple, None when there is none"""
+        cur = self.get_read_connection().cursor()
+        cur.row_factory = None
+        return cur.execute(sql, parameters).fetchone()
+
+    def metadata_tables(self):
+        """Metadata files in load order, with the method inserting their rows"""
+        return [
+            (self.ACTION_TYPE, self.insert_action_type),
+            (self.APPLICATION_DOC, self.insert_into_appl_docs),
+            (self.APPLICATION, self.insert_into_appl),
+            (self.APPLICATION_DOC_TYPE, self.insert_into_appl_docs_type),
+            (self.MARKETING_STATUS, self.insert_into_marketing_status),
+            (self.MARKETING_STATUS_LOOKUP, self.insert_into_marketing_status_lookup),
+            (self.PRODUCT, self.insert_into_products),
+            (self.SUBMISSION_CLASS, self.insert_into_submission_class_lookup),
+            (self.SUBMISSION_PROPERTY_TYPE, self.insert_into_submission_property_type),
+            (self.SUBMISSION, self.insert_into_submissions),
+            (self.TE, self.insert_into_te),
+        ]
+
     def insert_metadata(self):
         """
         insert metadata
+
+        Time spent reading, converting and inserting each file is kept in
+        `load_timings`, keyed by table name.
         """
-        # ActionTypes
-        num_rows = self.insert_action_type(self.read_metadata_file(os.path.join(
-            self.metadata_folder_loc, self.ACTION_TYPE.filename)))
+        for item, insert in self.metadata_tables():
+            start = time.perf_counter()
+            data = self.read_metadata_file(
+                os.path.join(self.metadata_folder_loc, item.filename))
+            read_done = time.perf_counter()
+
+            self.insert_seconds = 0.0
+            insert(data)
+            done = time.perf_counter()
+
+            self.load_timings[item.tablename] = {
+                'rows': len(data),
+                'read_seconds': read_done - start,
+                'convert_seconds': done - read_done - self.insert_seconds,
+                'insert_seconds': self.insert_seconds
+            }
+            self.logger.info(
+                f"inserted into {item.tablename}, no of rows: {len(data)} inserted")
+
+    def create_name_index(self):
+        """Index product drug names and active ingredients for resolve_application_numbers
+
+        Uses an FTS5 table, with the trigram tokenizer when SQLite supports
+        it; without FTS5 the index is not built and names resolve to nothing.
+        Built on the first name lookup, so invocations whose records all
+        carry an application number do not pay for it, and copied into
+        snapshots written afterwards.
 
-        self.logger.info(
-            f"inserted into action type, no of rows: {num_rows} inserted")
+        Returns:
+            str: tokenizer of the index, or None when it was not built
+        """
+        if self.check_table_exists(self.PRODUCT_NAME_INDEX):
+            return self.name_index_tokenizer()
+
+        start = time.perf_counter()
+        for tokenizer in self.NAME_INDEX_TOKENIZERS:
+            try:
+                self.conn.execute("CREATE VIRTUAL TABLE %s USING fts5(drugName, activeIngredient, applNo UNINDEXED, tokenize='%s')"
+                                  % (self.PRODUCT_NAME_INDEX, tokenizer))
+                break
+            except sqlite3.OperationalError:
+                continue
+        else:
+            self.logger.warning(f"SQLite {sqlite3.sqlite_version} has no FTS5, products cannot be resolved by name")
+            return None
 
-        # ApplicationDocs
-        self.insert_into_appl_docs(self.read_metadata_file(os.path.join(
-            self.metadata_folder_loc, self.APPLICATION_DOC.filename)))
-        print("inserted into application docs")
+        self.conn.execute("INSERT INTO %s (drugName, activeIngredient, applNo) SELECT DISTINCT drugName, activeIngredient, applNo FROM %s WHERE applNo != ''"
+                          % (self.PRODUCT_NAME_INDEX, self.PRODUCT.tablename))
+        self.conn.commit()
 
-        # Applications
-        self.insert_into_appl(self.read_metadata_file(os.path.join(
-            self.metadata_folder_loc, self.APPLICATION.filename)))
-        print("inserted into applications")
+        if self.metrics is not None:
+            self.metrics.record('name_index_build', time.perf_counter() - start)
+        self.logger.info(f"product name index built with the {tokenizer} tokenizer")
+        return tokenizer
 
-        # application doc type
-        self.insert_into_appl_docs_type(self.read_metadata_file(os.path.join(
-            self.metadata_folder_loc, self.APPLICATION_DOC_TYPE.filename)))
-        print("inserted into application doc type")
+    def create_lookup_indexes(self):
+        """Index the loaded tables for per application lookups
 
-        # marketing
-        self.insert_into_marketing_status(self.read_metadata_file(
-            os.path.join(self.metadata_folder_loc, self.MARKETING_STATUS.filename)))
+        Not done on load; snapshots serving many lookups, like the lookup
+        endpoint's, are indexed before they are written.
+        """
+        start = time.perf_counter()
+        for item, columns in self.LOOKUP_INDEXES:
+            self.conn.execute("CREATE INDEX IF NOT EXISTS %s_lookup_idx ON %s (%s)" % (item.tablename, item.tablename, columns))
+        self.conn.commit()
 
-        # marketing status
-        self.insert_into_marketing_status_lookup(self.read_metadata_file(
-            os.path.join(self.metadata_folder_loc, self.MARKETING_STATUS_LOOKUP.filename)))
+        if self.metrics is not None:
+            self.metrics.record('lookup_index_build', time.perf_counter() - start)
+
+    def name_index_tokenizer(self):
+        """Tokenizer of an existing product name index, None when there is no index"""
+        row = self.get_row("select sql from sqlite_master where name = '%s'" % self.PRODUCT_NAME_INDEX)
+        if row is None:
+            return None
+        return 'trigram' if 'trigram' in row['sql'] else 'unicode61'
+
+    @staticmethod
+    def name_match_query(name, tokenizer):
+        """FTS5 query matching any word of a name; trigram words need 3 characters"""
+        words = [word for word in name.upper().replace('"', ' ').split()
+                 if tokenizer != 'trigram' or len(word) >= 3]
+        return " OR ".join('"%s"' % word for word in words)
+
+    @staticmethod
+    def name_score(name, *candidates):
+        """Similarity of a name to the closest candidate, from 0 to 1"""
+        name = " ".join(name.upper().split())
+        return max(difflib.SequenceMatcher(None, name, " ".join((candidate or '').upper().split())).ratio()
+                   for candidate in candidates)
+
+    def resolve_application_numbers(self, names, limit=5):
+        """Candidate application numbers of drug names, best first
+
+        Each distinct name is one full text index lookup; the matching
+        products are scored by the similarity of their drug name or active
+        ingredient to the name, and every application keeps its best score.
 
-        # products
-        self.insert_into_products(self.read_metadata_file(
-            os.path.join(self.metadata_folder_loc, self.PRODUCT.filename)))
+        Args:
+            names (iterable): drug names, e.g. from the DrugName column of a delta file
+            limit (int, optional): most candidates returned per name, all of them when None
 
-        # submission class lookup
-        self.insert_into_submission_class_lookup(self.read_metadata_file(
-            os.path.join(self.metadata_folder_loc, self.SUBMISSION_CLASS.filename)))
+        Returns:
+            dict: name -> [{'application_no', 'score', 'drug_name', 'active_substance'}]
+        """
+        results = dict((name, []) for name in names)
 
-        # submission property type
-        self.insert_into_submission_property_type(self.read_metadata_file(
-            os.path.join(self.metadata_folder_loc, self.SUBMISSION_PROPERTY_TYPE.filename)))
+        ## snapshots are read-only, the index is only built in the loaded database
+        if self.snapshot_loc is None:
+            tokenizer = self.create_name_index()
+        else:
+            tokenizer = self.name_index_tokenizer()
+        if tokenizer is None:
+            return results
+
+        conn = self.get_read_connection()
+        for name in results:
+            query = self.name_match_query(name or '', tokenizer)
+            if not query:
+                continue
+
+            rows = conn.execute("SELECT applNo, drugName, activeIngredient FROM %s WHERE %s MATCH ? ORDER BY rank LIMIT ?"
+                                % (self.PRODUCT_NAME_INDEX, self.PRODUCT_NAME_INDEX),
+                                (query, self.NAME_MATCH_CANDIDATES)).fetchall()
+            best = {}
+            for row in rows:
+                score = self.name_score(name, row['drugName'], row['activeIngredient'])
+                if row['applNo'] not in best or score > best[row['applNo']]['score']:
+                    best[row['applNo']] = {'application_no': row['applNo'], 'score': round(score, 4),
+                                           'drug_name': row['drugName'], 'active_substance': row['activeIngredient']}
+
+            results[name] = sorted(best.values(), key=lambda c: (-c['score'], c['application_no']))
+            if limit is not None:
+                results[name] = results[name][:limit]
+
+        return results
+
+    def resolve_records(self, records, min_score=None):
+        """Fill in the application number of delta records that have a drug name but no usable ApplNo
+
+        A record is resolved when its best candidate scores at least
+        `min_score`; when several applications share the best score, the
+        one with a submission of the record's SubmissionNo is kept, and the
+        record stays unresolved if that is still ambiguous.
 
-        # submissions
-        self.insert_into_submissions(self.read_metadata_file(
-            os.path.join(self.metadata_folder_loc, self.SUBMISSION.filename)))
+        Args:
+            records (list): delta records as built by delta_file.map_row
+            min_score (float, optional): NAME_MATCH_MIN_SCORE by default
 
-        # te
-        self.insert_into_te(self.read_metadata_file(
-            os.path.join(self.metadata_folder_loc, self.TE.filename)))
+        Returns:
+            tuple: (records that can be enriched, unresolved records)
+        """
+        min_score = self.NAME_MATCH_MIN_SCORE if min_score is None else min_score
+        missing = [record for record in records if not str(record.get('application_no', '')).strip().isdigit()]
+        if not missing:
+            return (records, [])
+
+        candidates = self.resolve_application_numbers(
+            set(record.get('drug_name', '').strip() for record in missing if record.get('drug_name', '').strip()), limit=None)
+
+        resolved, unresolved = [], []
+        for record in records:
+            if str(record.get('application_no', '')).strip().isdigit():
+                resolved.append(record)
+                continue
+
+            matches = candidates.get(record.get('drug_name', '').strip(), [])
+            best = [match for match in matches if matches[0]['score'] >= min_score and match['score'] == matches[0]['score']]
+            if len(best) > 1:
+                best = self.with_submission(best, record.get('submission_no', ''))
+            if len(best) != 1:
+                unresolved.append(record)
+                continue
+
+            record = dict(record, application_no=str(best[0]['application_no']),
+                          application_no_source='drug_name', application_no_score=best[0]['score'])
+            resolved.append(record)
+
+        if unresolved:
+            self.logger.warning(f"{len(unresolved)} records without an application number could not be resolved by drug name")
+        return (resolved, unresolved)
+
+    def with_submission(self, candidates, submission_no):
+        """Candidates whose application has a submission numbered submission_no"""
+        if not str(submission_no).strip().isdigit():
+            return candidates
+
+        applications = [int(candidate['application_no']) for candidate in candidates]
+        rows = self.get_rows("select distinct applNo from %s where subNo = %d and applNo in (%s)"
+                             % (self.SUBMISSION.tablename, int(submission_no), ",".join(map(str, applications))))
+        found = set(row['applNo'] for row in rows)
+        return [candidate for candidate in candidates if candidate['application_no'] in found]
 
     def format_response(self, **kwargs):
         """[summary] JSON response for the event
@@ -257,77 +582,80 @@ class FDAAPI(object):
         s3_raw = kwargs.get("s3_raw", "")
         url = kwargs.get("url", "")
 
-        product_info = self.get_products(application_no)
-        application_info = self.get_application(application_no)
-        submission_info = self.get_submission(
-            application_no, application_doc_type_id, submission_no)
+        if self.metrics is None:
+            products = self.get_products(application_no)
+            application = self.get_application(application_no)
+            submission = self.get_submission(
+                application_no, application_doc_type_id, submission_no)
+        else:
+            with self.metrics.timer('lookup_products'):
+                products = self.get_products(application_no)
+            with self.metrics.timer('lookup_application'):
+                application = self.get_application(application_no)
+            with self.metrics.timer('lookup_submission'):
+                submission = self.get_submission(
+                    application_no, application_doc_type_id, submission_no)
+
+        # distinct values of a product field, a single one unwrapped for the drug name
+        drug_names = list(set([product.drug_name for product in products]))
+        dosage_forms = list(set([product.dosage_form for product in products]))
 
-        # lambda helpers
-        def extract_from_product_info(key, dict_items): return list(
-            set([self.extract_from_dict(key, item) for item in dict_items]))
+        # build response object
+        return {
+            's3_raw': s3_raw,
+            'last_updated': last_updated,
+            'source_url': url,
+            'file_name': os.path.basename(s3_raw),
+            'data_source': 'FDA',
+            'drug_name': drug_names.pop() if len(drug_names) == 1 else drug_names,
+            'active_substance': list(set([product.active_substance for product in products])),
+            'strength': list(set([product.strength for product in products])),
+            'dosage_form': dosage_forms,
+            'therapeutic_area': '',
+            'therapeutic_indication': '',
+            'year_of_authorization': submission.yearOfAuthorization,
+            'license_holder': application.sponsorName,
+            'route_of_administration': list(dosage_forms),
+            # TODO: check with Suresh again
+            'submission_date_for_initial_approval': '',
+            # NCE, Labeling etc.
+            'approval_type': submission.approvalType,
+            'document_type': submission.documentTypeDesc,
+            # TODO: check with Suresh again (EMA has Authorized/Withdrawn)
+            'approval_status': self.APPROVED,
+            'orphan_designation': submission.orphanDesignation,
+            'fda': {
+                'application_no': application_no,
+                'submission_no': submission_no,
+                'submission_type_id': application_doc_type_id,
+                'submission_type_desc': submission.submissionType,
+                'approval_type_code': submission.approvalTypeCode,
+                'submission_status': submission.submissionStatus,
+                'submission_notes': submission.submissionNotes,
+                'review_priority': submission.reviewPriority,
+                'products': [product.to_dict() for product in products],
+            },
+        }
+
+    @staticmethod
+    def document_fields(record):
+        """Payload fields of a delta record's own document; the rest only depends on delta_file.enrichment_key"""
+        return {'s3_raw': record['s3_path'], 'source_url': record['application_docs_url'],
+                'file_name': os.path.basename(record['s3_path'])}
+
+    def format_record(self, record):
+        """JSON response for a delta file record
 
-        def get_item(l): return l.pop() if len(l) == 1 else l
+        Args:
+            record (dict): delta record as built by delta_file.map_row
 
-        # Construct response object
-        # build response object
-        response = {}
-        response['s3_raw'] = s3_raw
-        response['last_updated'] = last_updated
-        response['source_url'] = url
-        response['file_name'] = os.path.basename(s3_raw)
-        response['data_source'] = 'FDA'
-        response['drug_name'] = get_item(
-            extract_from_product_info("drug_name", product_info))
-        response['active_substance'] = extract_from_product_info(
-            "active_substance", product_info)
-        response['strength'] = extract_from_product_info(
-            "strength", product_info)
-        response['dosage_form'] = extract_from_product_info(
-            "dosage_form", product_info)
-        response['therapeutic_area'] = ''
-        response['therapeutic_indication'] = ''
-        response['year_of_authorization'] = self.extract_from_dict(
-            "yearOfAuthorization", submission_info)
-        response['license_holder'] = self.extract_from_dict(
-            'sponsorName', application_info)
-        response['route_of_administration'] = extract_from_product_info(
-            "dosage_form", product_info)
-
-        # TODO: check with Suresh again
-        response['submission_date_for_initial_approval'] = ''
-
-        # NCE, Labeling etc.
-        response['approval_type'] = self.extract_from_dict(
-            'approvalType', submission_info)
-        response['document_type'] = self.extract_from_dict(
-            'documentTypeDesc', application_info)
-
-        # TODO: check with Suresh again (EMA has Authorized/Withdrawn)
-        response['approval_status'] = self.APPROVED
-        response['orphan_designation'] = self.extract_from_dict(
-            'orphanDesignation', submission_info)
-
-        fda = {}
-        fda['application_no'] = application_no
-        fda['submission_no'] = submission_no
-
-        fda['submission_type_id'] = application_doc_type_id
-        fda['submission_type_desc'] = self.extract_from_dict(
-            'submissionType', submission_info)
-
-        fda['approval_type_code'] = self.extract_from_dict(
-            'approvalTypeCode', submission_info)
-        fda['submission_status'] = self.extract_from_dict(
-            'submissionStatus', submission_info)
-        fda['submission_notes'] = self.extract_from_dict(
-            'submissionNotes', submission_info)
-        fda['review_priority'] = self.extract_from_dict(
-            'reviewPriority', submission_info)
-        fda['products'] = product_info
-
-        response['fda'] = fda
-
-        return response
+        Returns:
+            [type]: [json event response]
+        """
+        return self.format_response(
+            application_no=int(record['application_no']), submission_no=int(record['submission_no']),
+            application_doc_type_id=int(record['appplication_docs_type_id']),
+            submission_type=record['submission_type'], s3_raw=record['s3_path'], url=record['application_docs_url'])
 
     # region private methods to insert data
     def insert_action_type(self, data):
@@ -526,47 +854,20 @@ class FDAAPI(object):
     # endregion
 
     # region get
-    def get_products(self, application_no):
-        # fill following data
-        # get product information
-        product_sql = """select distinct  p.drugName 'drug_name', p.activeIngredient 'active_substance', p.strength strength, p.form 'dosage_form', x.description as 'marketing_status', (case when te.teCode is NULL then 'None' else te.teCode end)  'therapeutic_equivalence_codes',
+    PRODUCT_SQL = """select distinct  p.drugName 'drug_name', p.activeIngredient 'active_substance', p.strength strength, p.form 'dosage_form', x.description as 'marketing_status', (case when te.teCode is NULL then 'None' else te.teCode end)  'therapeutic_equivalence_codes',
                 (case when p.referenceDrug is '1' then 'Yes' else 'No' end) 'reference_drug',
                 (case when p.referenceStandard is '1' then 'Yes' else 'No' end) 'reference_standard',
                 p.productNo as 'product_number'
                 from {product_tbl} p 
-                        left join(select ms.id, ms.applNo, ms_lkp.description, ms.productNo from {marketing_status_tbl} ms
-                        left join {marketing_status_lkp_tbl} ms_lkp on ms.id=ms_lkp.id) x
-                on p.applNo = x.applNo and p.productNo = x.productNo
+                        left join {marketing_status_tbl} ms on p.applNo = ms.applNo and p.productNo = ms.productNo
+                        left join {marketing_status_lkp_tbl} x on ms.id = x.id
                 left join {te_tbl} on p.applNo = te.applNo and p.productNo = te.productNo 
-                where p.applNo = {applNo}
-
-                """
-
-        product_sql = (product_sql.format(product_tbl=self.PRODUCT.tablename,
-                                          marketing_status_tbl=self.MARKETING_STATUS.tablename,
-                                          marketing_status_lkp_tbl=self.MARKETING_STATUS_LOOKUP.tablename,
-                                          te_tbl=self.TE.tablename, applNo=application_no))
+                where p.applNo = ?
 
-        product_rows = self.get_rows(product_sql)
+                """.format(product_tbl=PRODUCT.tablename, marketing_status_tbl=MARKETING_STATUS.tablename,
+                           marketing_status_lkp_tbl=MARKETING_STATUS_LOOKUP.tablename, te_tbl=TE.tablename)
 
-        products = []
-        for row in product_rows:
-            item = dict(row)
-            product_info = {}
-            for k, v in item.items():
-                if k not in product_info:
-                    product_info[k] = set()
-                if v is not None:
-                    product_info[k].add(v)
-            product_info = (dict([(k, v.pop()) if len(v) == 1 else(
-                k, list(v)) for k, v in product_info.items()]))
-            products.append(product_info)
-
-        return products
-
-    def get_submission(self, application_no, application_doc_type_id, submission_no):
-        # supplement information query
-        submission_sql = """
+    SUBMISSION_SQL = """
         select distinct 
 		sub_class_lkp.submissionClassCode approvalTypeCode,
 		sub_class_lkp.submissionClassDescription approvalType,
@@ -583,20 +884,23 @@ class FDAAPI(object):
         left join {submission_property_type_tbl} sub_prop_type on sub.applNo = sub_prop_type.applNo and sub.subNo = sub_prop_type.submissionNo
         inner join (select docs.id,docs.submissionNo, docsTypeId, docs_lkp.description docTypeDesc, applNo, submissionType, applicationDocsTitle, applicationDocsURL, applicationDocsDate, description from {application_docs_tbl} docs
         left join {application_docs_type_lookup_tbl} docs_lkp on docs.docsTypeId = docs_lkp.id) docs on docs.applNo = sub.applNo and docs.submissionNo = sub.subNo 
-        where sub.applNo = {applNo} and sub.subNo = {subNo} and docsTypeId={docsTypeId}
-        """
-        submission_sql = submission_sql.format(submission_tbl=self.SUBMISSION.tablename, submission_class_lkp_tbl=self.SUBMISSION_CLASS.tablename, submission_property_type_tbl=self.SUBMISSION_PROPERTY_TYPE.tablename,
-                                               application_docs_tbl=self.APPLICATION_DOC.tablename, application_docs_type_lookup_tbl=self.APPLICATION_DOC_TYPE.tablename, applNo=application_no,
-                                               subNo=submission_no,
-                                               docsTypeId=application_doc_type_id)
-
-        submission_row = self.get_row(submission_sql)
-        if submission_row is not None and len(submission_row) > 0:
-            submission_info = dict(submission_row)
-        else:
-            submission_info = {}
+        where sub.applNo = ? and sub.subNo = ? and docsTypeId=?
+        """.format(submission_tbl=SUBMISSION.tablename, submission_class_lkp_tbl=SUBMISSION_CLASS.tablename,
+                   submission_property_type_tbl=SUBMISSION_PROPERTY_TYPE.tablename,
+                   application_docs_tbl=APPLICATION_DOC.tablename,
+                   application_docs_type_lookup_tbl=APPLICATION_DOC_TYPE.tablename)
 
-        return submission_info
+    APPLICATION_SQL = "select applNo, applType, applPublicNotes, sponsorName from {table_name} where applNo = ? ".format(
+        table_name=APPLICATION.tablename)
+
+    def get_products(self, application_no):
+        """Products of an application, one Product record per distinct row"""
+        return [Product.from_row(row) for row in self.get_tuples(self.PRODUCT_SQL, (application_no,))]
+
+    def get_submission(self, application_no, application_doc_type_id, submission_no):
+        """Submission of an application document, or an empty Submission record when there is none"""
+        row = self.get_tuple(self.SUBMISSION_SQL, (application_no, submission_no, application_doc_type_id))
+        return Submission.from_row(row) if row is not None else Submission.empty()
 
     def get_application(self, application_no):
         """ Function to retrieve application information from application table
@@ -604,32 +908,24 @@ class FDAAPI(object):
             application_no (int): application no
 
         Returns:
-            [type]: [description]
+            Application: application record, or an empty one when the application is unknown
         """
-        application_sql = "select * from {table_name} where applNo = {application_no} ".format(table_name=self.APPLICATION.tablename,
-                                                                                               application_no=application_no)
-
-        application_row = self.get_row(application_sql)
+        row = self.get_tuple(self.APPLICATION_SQL, (application_no,))
+        if row is None:
+            return Application.empty()
 
-        if application_row is not None and len(application_row) > 0:
-            application_info = dict(application_row)
-
-            # map application doc type
-            application_info['documentType'] = self.APPLICATION_TYPE_MAPPING.get(
-                application_info['applType'], '')
-
-        else:
-            application_info = {}
-
-        return application_info
+        # map application doc type
+        return Application(*row, self.APPLICATION_TYPE_MAPPING.get(row[1], ''))
 
     # endregion
 
     # region helpers
 
     def insert_into_sqlite_table(self, data, sql):
+        start = time.perf_counter()
         self.cursor.executemany(sql, data)
         self.conn.commit()
+        self.insert_seconds += time.perf_counter() - start
 
     def read_metadata_file(self, filepath):
         """Read data
@@ -641,29 +937,40 @@ class FDAAPI(object):
             reader: return dictionary reader
         """
         if self.is_test:
-            if os.path.exists(filepath):
-                rows = []
-                with open(filepath, 'r', encoding='windows-1252') as f:
-                    reader = csv.DictReader(
-                        f, delimiter='\t', quoting=csv.QUOTE_NONE)
-                    for row in reader:
-                        rows.append(row)
-                    return rows
-
-        response = read_obj_from_bucket(filepath)
-
-        # split the contents of the file
-        content = response['Body'].read().decode('windows-1252')
-        lines = content.split("\n")
-        self.logger.info(
-            f"read from s3: {filepath}, number of lines:{len(lines)}")
-        rows = []
-        reader = csv.DictReader(lines, delimiter='\t', quoting=csv.QUOTE_NONE)
-        for row in reader:
-            rows.append(row)
+            # gzip, bz2 and xz files are read as well, under their own name or with their extension
+            local_path = compression.local_variant(filepath)
+            if local_path is not None:
+                with compression.open_path(local_path, 'windows-1252') as f:
+                    return list(csv.DictReader(f, delimiter='\t', quoting=csv.QUOTE_NONE))
+
+            # local metadata folders may not carry every FDA file
+            if not filepath.startswith("s3://"):
+                self.logger.warning(f"metadata file not found, table left empty: {filepath}")
+                return []
+
+        response = self.read_metadata_object(filepath)
+
+        # parsed as it is read and decompressed, the whole file is never held in memory
+        with compression.open_stream(response['Body'], 'windows-1252') as f:
+            rows = list(csv.DictReader(f, delimiter='\t', quoting=csv.QUOTE_NONE))
+        self.logger.info(f"read from s3: {filepath}, number of rows:{len(rows)}")
 
         return rows
 
+    def read_metadata_object(self, filepath):
+        """S3 response of a metadata file, or of its compressed variant when only that one exists"""
+        from botocore.exceptions import ClientError
+
+        error = None
+        for candidate in compression.suffixes(filepath):
+            try:
+                return read_obj_from_bucket(candidate)
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                    raise
+                error = error or e
+        raise error
+
     def check_table_exists(self, table_name):
         """Method to check if the table exists
 
@@ -702,16 +1009,4 @@ class FDAAPI(object):
         s = s.rstrip(os.linesep)
         return s.strip()
 
-    # extract from nested dictionary
-    def extract_from_dict(self, my_key, dictionary_items):
-        found_value = ''
-        for key, value in dictionary_items.items():
-            if type(value) is dict:
-                self.extract_from_dict(my_key, value)
-            else:
-                if key == my_key:
-                    found_value = value
-
-        return found_value
-
     # endregion
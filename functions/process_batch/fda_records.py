@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import json
+
+## one encoder for every payload written to a sink; it gives the same output as json.dumps
+ENCODER = json.JSONEncoder(check_circular=False)
+
+
+def dumps(payload):
+    """Serialize an enrichment payload as it is written to the sinks"""
+    return ENCODER.encode(payload)
+
+
+def event_detail(payload):
+    """Detail of the EventBridge event carrying a payload, same as json.dumps({"metadata": payload})"""
+    return '{"metadata": ' + ENCODER.encode(payload) + '}'
+
+
+class Record(object):
+    """
+    Row of a metadata lookup, with one slot per selected column.
+
+    Rows are built from the plain tuples returned by SQLite, in the order of
+    FIELDS, so no dict is made per row. `get` returns '' for fields a record
+    does not have, as lookups of missing keys always did.
+    """
+
+    __slots__ = ()
+    FIELDS = ()
+
+    def __init__(self, *values):
+        for field, value in zip(self.FIELDS, values):
+            setattr(self, field, value)
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+    @classmethod
+    def empty(cls):
+        """Record of a lookup that found nothing: every field is ''"""
+        return cls(*([''] * len(cls.FIELDS)))
+
+    def get(self, field, default=''):
+        return getattr(self, field, default)
+
+    def to_dict(self):
+        return dict(zip(self.FIELDS, [getattr(self, field) for field in self.FIELDS]))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, ", ".join(
+            "{}={!r}".format(field, getattr(self, field)) for field in self.FIELDS))
+
+
+class Product(Record):
+    """Product of an application, with its marketing status and TE code"""
+
+    __slots__ = FIELDS = ('drug_name', 'active_substance', 'strength', 'dosage_form', 'marketing_status',
+                          'therapeutic_equivalence_codes', 'reference_drug', 'reference_standard', 'product_number')
+
+    @classmethod
+    def from_row(cls, row):
+        ## NULL columns are written to the payload as empty lists
+        return cls(*[[] if value is None else value for value in row])
+
+
+class Application(Record):
+    """Application row and the description of its type"""
+
+    __slots__ = FIELDS = ('applNo', 'applType', 'applPublicNotes', 'sponsorName', 'documentType')
+
+
+class Submission(Record):
+    """Submission of an application, joined to its class, property type and document type"""
+
+    __slots__ = FIELDS = ('approvalTypeCode', 'approvalType', 'submissionStatus', 'documentTypeId',
+                          'documentTypeDesc', 'yearOfAuthorization', 'submissionNotes', 'reviewPriority',
+                          'orphanDesignation', 'submissionType')
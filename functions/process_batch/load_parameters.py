@@ -2,17 +2,19 @@
 
 import json
 import os
-import sys
-from datetime import datetime
 import logging
-import csv
 import warnings
-import itertools
 from datetime import datetime
-# AWS specific packages
-import boto3
 
 import utils
+import metrics
+import claim_check
+import compression
+import aws_clients
+import profiling
+import delta_file
+import s3_discovery
+import backfill
 
 warnings.filterwarnings("ignore")
 
@@ -20,12 +22,38 @@ warnings.filterwarnings("ignore")
 logger = utils.load_log_config()
 configuration = utils.load_osenv()
 
-# Import AWS resources
-s3_resource = boto3.resource("s3")
-sfn = boto3.client("stepfunctions")
+## used when STATE_MACHINE_ARN is not set in the environment or Parameter Store
+DEFAULT_STATE_MACHINE_ARN = "arn:aws:states:us-east-2:896265685124:stateMachine:process-batch"
+
+## Step Functions refuses execution inputs larger than this
+MAX_EXECUTION_INPUT_BYTES = 256 * 1024
+
+## `partition_date` of an event, the year/month/day of the s3 partition to process
+PARTITION_DATE_FORMAT = "%Y-%m-%d"
 
 
+@profiling.profiled('load_parameters')
 def handler(event, context):
+    ## Parameter Store values (cached between invocations) override the environment
+    configuration.update(utils.load_ssm_parameters())
+
+    ## stage timings are emitted once, as an EMF log line, at the end of the invocation
+    stage_metrics = metrics.get_stage_metrics(configuration, configuration.get("STAGE", "dev"))
+    try:
+        if 'backfill' in event:
+            return start_backfill(event, stage_metrics)
+        return start_batch(event, stage_metrics)
+    finally:
+        stage_metrics.emit()
+
+
+def start_batch(event, stage_metrics, discovery=None):
+    """Find the partition's delta and metadata files, chunk the delta and start the state machine
+
+    The partition is today's unless the event names one in `partition_date`
+    (YYYY-MM-DD); `execution_name` names the execution, so starting the
+    same partition twice fails with ExecutionAlreadyExists.
+    """
     logger.info("Loading parameters from environment")
 
     # load environment variables
@@ -44,9 +72,19 @@ def handler(event, context):
     event['parameters']['stage'] = stage
     event['parameters']['bucket_name'] = bucket_name
 
+    ## s3 listings are cached for this invocation
+    if discovery is None:
+        discovery = s3_discovery.S3Discovery(workers=configuration.get("S3_LISTING_WORKERS", "") or
+                                             s3_discovery.DEFAULT_LISTING_WORKERS)
+
+    partition_date = None
+    if event.get('partition_date'):
+        partition_date = datetime.strptime(event['partition_date'], PARTITION_DATE_FORMAT)
+
     ## compute delta file path, metadata file path
-    (response, paths) = validate_get_paths(
-        s3_delta_file_path, s3_metadata_file_path)
+    with stage_metrics.timer('discover_paths'), profiling.stage('discover_paths'):
+        (response, paths) = validate_get_paths(
+            s3_delta_file_path, s3_metadata_file_path, discovery=discovery, partition_date=partition_date)
     if not response:
         raise Exception("Nothing to process, delta files not found!")
 
@@ -62,9 +100,22 @@ def handler(event, context):
     logging.info(f"s3 path to the metadata file:{s3_metadata_file_path}")
 
     istest = True if 'test' in event else False
-    delta_file_details = load_delta_file(s3_delta_file_path, istest)
+    ## names the run in summaries, reject files and their detail in s3
+    event.setdefault('run_id', event.get('execution_name') or utils.make_unique_id())
+    with stage_metrics.timer('load_delta_file'), profiling.stage('load_delta_file'):
+        delta_file_details = load_delta_file(s3_delta_file_path, istest, discovery=discovery, run_id=event['run_id'])
+    stage_metrics.count('records_to_process', delta_file_details[1])
+    stage_metrics.count('chunks', len(delta_file_details[0]))
+    stage_metrics.count('records_rejected', delta_file_details[2]['rejected'])
+    stage_metrics.count('records_duplicate', delta_file_details[2]['duplicates'])
 
-    # Add - stats information
+    add_batch_stats(event, delta_file_details)
+
+    return start_execution(event, stage_metrics)
+
+
+def add_batch_stats(event, delta_file_details):
+    """Add the chunks and the stats of the run to the execution input"""
     if not "fda" in event:
         event['fda'] = {}
         event['fda']['process_batch_stats'] = {}
@@ -75,13 +126,20 @@ def handler(event, context):
         event['fda']['process_batch_stats']['process_batch_end_timestamp'] = None
         event['fda']['process_batch_stats']['stepfunction-execution-counter'] = 1
         event['fda']['process_batch_stats']['number_of_records_to_process'] = delta_file_details[1]
+        if len(delta_file_details) > 2:
+            event['fda']['process_batch_stats']['delta_validation'] = delta_file_details[2]
         event['fda']['chunks'] = delta_file_details[0]
 
     else:
         event['process_batch_stats']['fda']['stepfunction-execution-counter'] += 1
 
+
+def start_execution(event, stage_metrics):
+    ## names the run in summaries and their detail in s3
+    event.setdefault('run_id', event.get('execution_name') or utils.make_unique_id())
+
     # Invoke stepfunctions
-    sfn_arn = "arn:aws:states:us-east-2:896265685124:stateMachine:process-batch"
+    sfn_arn = configuration.get("STATE_MACHINE_ARN", "") or DEFAULT_STATE_MACHINE_ARN
     logger.info("Starting Step Function (%s) with json %s...",
                 sfn_arn, json.dumps(event))
 
@@ -89,30 +147,192 @@ def handler(event, context):
     if "test" in event:
         return event
 
-    response = sfn.start_execution(
-        stateMachineArn=sfn_arn,
-        input=json.dumps(event)
-    )
+    fit_execution_input(event)
+
+    with stage_metrics.timer('start_execution'), profiling.stage('start_execution'):
+        kwargs = {'name': event['execution_name']} if event.get('execution_name') else {}
+        response = aws_clients.stepfunctions().start_execution(
+            stateMachineArn=sfn_arn,
+            input=json.dumps(event),
+            **kwargs
+        )
+    event['execution_arn'] = response['executionArn']
 
     return event
 
 
-def validate_get_paths(s3_delta_file_path, s3_metadata_file_path):
-    """[summary]
+def fit_execution_input(event):
+    """Offload the chunks of an execution input larger than MAX_EXECUTION_INPUT_BYTES to the claim check
+
+    Each chunk is replaced by a pointer to it under CLAIM_CHECK_S3_URI,
+    which process_batch resolves. Raises ValueError when there is no claim
+    check, or when the pointers alone are still too large.
+    """
+    size = len(json.dumps(event).encode('utf-8'))
+    if size <= MAX_EXECUTION_INPUT_BYTES:
+        return event
+
+    checker = claim_check.get_claim_check(configuration)
+    if checker is None:
+        raise ValueError(f"execution input is {size} bytes, over the {MAX_EXECUTION_INPUT_BYTES} byte Step Functions "
+                         "limit; set CLAIM_CHECK_S3_URI to pass its chunks by claim check")
+
+    event['fda']['chunks'] = [checker.offload(chunk) for chunk in event['fda']['chunks']]
+    size = len(json.dumps(event).encode('utf-8'))
+    if size > MAX_EXECUTION_INPUT_BYTES:
+        raise ValueError(f"execution input is still {size} bytes with its {len(event['fda']['chunks'])} chunks "
+                         "passed by claim check; use fewer days per execution or larger chunks")
+    logger.info("%s chunks passed by claim check, execution input is %s bytes", len(event['fda']['chunks']), size)
+    return event
+
+
+def start_backfill(event, stage_metrics):
+    """Start executions for every delta partition of a date range
+
+    The event's `backfill` names the range, {"start": "YYYY-MM-DD", "end":
+    "YYYY-MM-DD"}, and optionally `max_concurrency` and
+    `max_days_per_execution`. Days are grouped by the latest complete
+    metadata snapshot on or before them, so each snapshot is loaded once
+    per group instead of once per day; at most `max_concurrency` backfill
+    executions run at once. Execution names are derived from the groups,
+    so invoking the same backfill again starts the groups left pending and
+    reports those already started with the status of their execution
+    (running, succeeded, failed, ...).
+
+    Returns:
+        dict: the groups with their execution names and status, and the days
+            without a metadata snapshot
+    """
+    request = event['backfill']
+    stage = configuration.get("STAGE", "dev")
+    bucket_name = configuration.get("BUCKET_NAME", "lly-reg-intel-raw-zone-dev")
+    delta_prefix = configuration.get("DELTA_FILE_PATH", "")
+    metadata_prefix = configuration.get("METADATA_FILE_PATH", "")
+    sfn_arn = configuration.get("STATE_MACHINE_ARN", "") or DEFAULT_STATE_MACHINE_ARN
+
+    max_concurrency = int(request.get('max_concurrency') or configuration.get("BACKFILL_MAX_CONCURRENCY", "") or
+                          backfill.DEFAULT_MAX_CONCURRENCY)
+    max_days = int(request.get('max_days_per_execution') or configuration.get("BACKFILL_MAX_DAYS_PER_EXECUTION", "") or
+                   backfill.DEFAULT_MAX_DAYS_PER_EXECUTION)
+    days = backfill.date_range(backfill.parse_date(request['start']), backfill.parse_date(request['end']))
+
+    discovery = s3_discovery.S3Discovery(workers=configuration.get("S3_LISTING_WORKERS", "") or
+                                         s3_discovery.DEFAULT_LISTING_WORKERS)
+
+    with stage_metrics.timer('discover_paths'), profiling.stage('discover_paths'):
+        partitions = backfill.discover_delta_partitions(discovery, bucket_name, delta_prefix, days)
+        snapshots = backfill.discover_metadata_snapshots(
+            discovery, bucket_name, metadata_prefix, days[0], days[-1],
+            configuration.get("NUM_METADATA_FILES", 10),
+            int(configuration.get("BACKFILL_METADATA_LOOKBACK_DAYS", "") or backfill.DEFAULT_METADATA_LOOKBACK_DAYS))
+        groups, unmatched = backfill.group_by_snapshot(partitions, snapshots, max_days)
+
+    for day in unmatched:
+        logger.warning("no metadata snapshot on or before %s, its delta is not backfilled", day)
+    logger.info("backfill of %s to %s: %s delta partitions in %s executions",
+                request['start'], request['end'], len(partitions), len(groups))
+
+    executions = backfill.backfill_executions(aws_clients.stepfunctions(), sfn_arn)
+    to_start, pending, started = backfill.schedule(groups, executions, max_concurrency)
+
+    def group_event(group):
+        delta_paths = [utils.make_s3_uri(bucket_name, key) for key in group['delta_keys']]
+        records = []
+        validation = {'rejected': 0, 'duplicates': 0, 'rejects_uris': []}
+        for index, path in enumerate(delta_paths):
+            chunks, _, outcome = load_delta_file(path, discovery=discovery, run_id=backfill.execution_name(group),
+                                                 rejects_name=f"rejects-{index}")
+            records.extend(record for chunk in chunks for record in chunk)
+            validation['rejected'] += outcome['rejected']
+            validation['duplicates'] += outcome['duplicates']
+            if outcome['rejects_uri']:
+                validation['rejects_uris'].append(outcome['rejects_uri'])
+
+        execution_input = {
+            'execution_name': backfill.execution_name(group),
+            'partition_dates': [day.strftime(backfill.DATE_FORMAT) for day in group['days']],
+            'parameters': {
+                'stage': stage,
+                'bucket_name': bucket_name,
+                's3_metadata_file_path': utils.make_s3_uri(
+                    bucket_name, backfill.day_prefix(metadata_prefix, group['snapshot'])),
+                's3_delta_file_path': delta_paths[-1],
+                's3_delta_file_paths': delta_paths,
+            }}
+        n = int(configuration.get('DEFAULT_CHUNK_SIZE', 10))
+        add_batch_stats(execution_input,
+                        (delta_file.chunk_records(records, n, key=delta_file.enrichment_key), len(records), validation))
+        stage_metrics.count('records_to_process', len(records))
+        stage_metrics.count('records_rejected', validation['rejected'])
+        return execution_input
+
+    from botocore.exceptions import ClientError
+
+    errors = {}
+
+    def start_group(group):
+        try:
+            start_execution(group_event(group), stage_metrics)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ExecutionAlreadyExists':
+                return 'duplicate'
+            errors[backfill.execution_name(group)] = str(e)
+        except Exception as e:
+            errors[backfill.execution_name(group)] = f"{type(e).__name__}: {e}"
+        else:
+            return 'started'
+
+        ## no execution was started, so invoking the backfill again schedules the group again
+        logger.exception("failed to start backfill execution %s", backfill.execution_name(group))
+        return 'start_failed'
+
+    ## the delta files of the groups started now are read concurrently
+    status = {}
+    if to_start:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with stage_metrics.timer('load_delta_file'), profiling.stage('load_delta_file'):
+            ## profiling stages are not thread safe
+            workers = 1 if profiling.active() else max_concurrency
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backfill") as executor:
+                for group, outcome in zip(to_start, executor.map(start_group, to_start)):
+                    status[backfill.execution_name(group)] = outcome
+    status.update((backfill.execution_name(group), 'pending') for group in pending)
+    status.update((backfill.execution_name(group), executions[backfill.execution_name(group)].lower())
+                  for group in started)
+
+    for outcome in set(status.values()):
+        stage_metrics.count(f"backfill_{outcome}", list(status.values()).count(outcome))
+
+    return {
+        'backfill': request,
+        'executions': [{'execution_name': backfill.execution_name(group),
+                        'snapshot': group['snapshot'].strftime(backfill.DATE_FORMAT),
+                        'partition_dates': [day.strftime(backfill.DATE_FORMAT) for day in group['days']],
+                        'status': status[backfill.execution_name(group)],
+                        **({'error': errors[backfill.execution_name(group)]}
+                           if backfill.execution_name(group) in errors else {})} for group in groups],
+        'unmatched_dates': [day.strftime(backfill.DATE_FORMAT) for day in unmatched],
+    }
+
+
+def validate_get_paths(s3_delta_file_path, s3_metadata_file_path, discovery=None, partition_date=None):
+    """Find the delta file and metadata files of a day's partition
 
     Args:
-        s3_delta_file_path ([type]): [description]
-        s3_metadata_file_path ([type]): [description]
+        s3_delta_file_path (str): delta file prefix
+        s3_metadata_file_path (str): metadata files prefix
+        discovery (S3Discovery, optional): lists the delta and metadata prefixes concurrently
+        partition_date (datetime, optional): day of the partition, today by default
     """
+    discovery = discovery or s3_discovery.S3Discovery()
     bucket_name = configuration.get("BUCKET_NAME", "")
     number_of_metadata_files = configuration.get("NUM_METADATA_FILES", 10)
 
-    month = str('%02d' % datetime.now().month)
-    year = str(datetime.now().year)
-    day = str('%02d' % datetime.now().day)
-    hour = str('%02d' % datetime.now().hour)
-    minute = str('%02d' % datetime.now().minute)
-    second = str('%02d' % datetime.now().second)
+    partition_date = partition_date or datetime.now()
+    month = str('%02d' % partition_date.month)
+    year = str(partition_date.year)
+    day = str('%02d' % partition_date.day)
 
     ## year, month, date
     def compute_path(path): return "{}/{}/{}/{}".format(path, year, month, day)
@@ -120,80 +340,69 @@ def validate_get_paths(s3_delta_file_path, s3_metadata_file_path):
     s3_delta_file_path = compute_path(s3_delta_file_path)
     s3_metadata_file_path = compute_path(s3_metadata_file_path)
 
-    ## check if there is .csv in delta
-    csv_file_path = utils.get_s3_objects(
-        bucket=bucket_name, prefix=s3_delta_file_path, suffix=".csv")
-    csv_file_path = list(csv_file_path)
+    ## list the delta (.csv) and metadata (.txt) prefixes together
+    csv_file_path, metadata_files = discovery.list_many([
+        (bucket_name, s3_delta_file_path, compression.suffixes(".csv")),
+        (bucket_name, s3_metadata_file_path, compression.suffixes(".txt"))])
 
     if len(csv_file_path) == 0:
         return (False, "delta file not found! nothing to process")
 
     ## check for metadata
-    metadata_files = utils.get_s3_objects(
-        bucket=bucket_name, prefix=s3_metadata_file_path, suffix=".txt")
-    metadata_files = list(metadata_files)
-
     if len(metadata_files) != int(number_of_metadata_files):
         return (False, "metadata files not found! nothing to process")
 
-    print(list(map(lambda x: utils.make_s3_uri(bucket_name, x), metadata_files)))
+    logger.info("metadata files: %s", [utils.make_s3_uri(bucket_name, x) for x in metadata_files])
 
     return (True, {"delta_file_path": utils.make_s3_uri(bucket_name, csv_file_path.pop()), "metadata_file_path": utils.make_s3_uri(bucket_name, s3_metadata_file_path),
                    "metadata_files": list(map(lambda x: utils.make_s3_uri(bucket_name, x), metadata_files))})
 
 
-def load_delta_file(s3_url, istest=False):
+def load_delta_file(s3_url, istest=False, discovery=None, run_id=None, rejects_name="rejects"):
     """
     Method to load the delta file with its content
+
+    cfm folders are expanded into one record per inner pdf; their s3
+    listings run concurrently. Local test files have no s3 folders to
+    list, so their cfm rows are skipped.
+
+    Records are then validated and coalesced (delta_file.coalesce_records):
+    rows that would fail enrichment are rejected, written with their
+    reasons to DELTA_REJECTS_S3_URI/<run id>/ when it is set, repeated
+    documents are dropped, and records sharing an enrichment key are
+    chunked together.
+
+    Returns:
+        tuple: (chunks, number of records, {'rejected', 'duplicates', 'rejects_uri'})
     """
-    if istest:
-        f = open(s3_url, 'r')
-        lines = f.read().splitlines()
+    lines = delta_file.read_delta_lines(s3_url, is_local=istest)
+    rows = list(delta_file.parse_delta_rows(lines))
 
+    if istest:
+        rows = [row for row in rows if not delta_file.is_cfm_folder(row)]
     else:
-        response = utils.read_obj_from_bucket(s3_url)
-        # split the contents of the file
-        content = response['Body'].read().decode('utf-8')
-        lines = content.split("\n")
-
-    csv_reader = csv.DictReader((line for line in lines if not line.isspace() and not line.replace(",", "").isspace()),
-                                delimiter=',')
-
-    def map_row(row): return {
-        'appplication_docs_type_id': row['applicationdocstypeid'],
-        'application_no': row['applno'],
-        'submission_type': row['submissiontype'],
-        'submission_no': row['submissionno'],
-        'application_docs_url': row['url'],
-        'drug_name': row['drugname'],
-        's3_path': row['s3_path'],
-        'url': row['url']
-    }
+        discovery = discovery or s3_discovery.S3Discovery()
+        rows = discovery.expand_cfm_rows(rows, delta_file.is_cfm_folder)
 
-    all_records = []
-    for row in list(csv_reader):
-
-        s3_path = row['s3_path']
-
-        ## cfm folder her inner pdfs
-        if row['s3_path'].endswith("cfm"):
-            continue
-            bucket_name, key, filename = split_s3_url(s3_path)
-            inner_pdf_paths = utils.get_s3_objects(
-                BUCKET_NAME=bucket_name, prefix=key, suffix=".pdf")
-            for path in list(inner_pdf_paths):
-                new_row = row.copy()
-                new_row['s3_path'] = path
-                all_records.append(map_row(new_row))
-        else:
-            all_records.append(map_row(row))
+    all_records, rejected, duplicates = delta_file.coalesce_records([delta_file.map_row(row) for row in rows])
 
     total_no_of_records = len(all_records)
-    print(total_no_of_records)
+    logger.info("%s records in the delta file: %s (%s rejected, %s duplicates dropped)",
+                total_no_of_records, s3_url, len(rejected), duplicates)
+
+    rejects_uri = None
+    if rejected:
+        logger.warning("%s delta rows rejected, e.g. %s", len(rejected),
+                       [reject['reasons'] for reject in rejected[:5]])
+        rejects_s3_uri = configuration.get("DELTA_REJECTS_S3_URI", "")
+        if rejects_s3_uri:
+            rejects_uri = delta_file.write_rejects(rejected, rejects_s3_uri, run_id or utils.make_unique_id(),
+                                                   rejects_name)
+            logger.info("rejected delta rows written to %s", rejects_uri)
 
     ##
     n = int(configuration.get('DEFAULT_CHUNK_SIZE', 10))
-    chunked_data = [all_records[i * n:(i + 1) * n]
-                    for i in range((len(all_records) + n - 1) // n)]
+    chunked_data = delta_file.chunk_records(all_records, n, key=delta_file.enrichment_key)
 
-    return (chunked_data, total_no_of_records)
+    return (chunked_data, total_no_of_records,
+            {'rejected': len(rejected), 'duplicates': duplicates, 'rejects_uri': rejects_uri})
@@ -0,0 +1,249 @@
+#! /usr/bin/env python3
+"""
+Read-only FDA metadata lookups behind API Gateway.
+
+    GET  /fda/applications/{application_no}
+    GET  /fda/applications/{application_no}/submissions/{submission_no}/documents/{docs_type_id}
+    POST /fda/lookups   {"lookups": [{"application_no": 4782, "submission_no": 125, "docs_type_id": 1}, ...]}
+
+Responses are the enrichment payloads process_batch publishes. They are
+served from a prebuilt, indexed SQLite snapshot of the metadata which is
+stored compressed, downloaded once per container and kept open between
+requests; the database is never rebuilt per request.
+
+Build and upload a snapshot:
+    python lookup.py --metadata data/metadata --output /tmp/fda_lookup.db --s3-uri s3://bucket/lookup/fda_lookup.db.gz
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+import utils
+import compression
+import fda_records
+from fda_api import FDAAPI
+
+# Initialize globals
+configuration = utils.load_osenv()
+logger = utils.load_log_config()
+
+## snapshot downloaded from LOOKUP_SNAPSHOT_S3_URI, or opened from LOOKUP_SNAPSHOT_PATH when there is no uri
+DEFAULT_SNAPSHOT_PATH = "/tmp/fda_lookup.db"
+
+## seconds between checks for a newer snapshot in S3; 0 keeps the first one for the container's life
+DEFAULT_SNAPSHOT_TTL_SECONDS = 300
+
+## most lookups per POST /fda/lookups request
+DEFAULT_MAX_BATCH = 100
+
+## FDAAPI over the snapshot, kept warm between invocations of the container
+WARM = {'api': None, 'etag': None, 'checked': 0.0}
+WARM_LOCK = threading.Lock()
+
+
+class LookupRequestError(Exception):
+    """Request the endpoint cannot serve, answered with its status code"""
+
+    def __init__(self, message, status_code=400):
+        super(LookupRequestError, self).__init__(message)
+        self.status_code = status_code
+
+
+def snapshot_etag(s3_uri):
+    import aws_clients
+
+    bucket_name, key, _ = utils.split_s3_url(s3_uri)
+    return aws_clients.s3().head_object(Bucket=bucket_name, Key=key)['ETag']
+
+
+def download_snapshot(s3_uri, path):
+    """Download the snapshot next to the one in use, decompressing it as it arrives, then move it into place"""
+    partial = path + ".download"
+    compression.copy_decompressed(utils.read_obj_from_bucket(s3_uri, whole=True)['Body'], partial)
+    os.replace(partial, path)
+
+
+def get_api():
+    """FDAAPI over the lookup snapshot, loaded on the first request of the container
+
+    With LOOKUP_SNAPSHOT_S3_URI set, the snapshot's ETag is checked at most
+    every LOOKUP_SNAPSHOT_TTL_SECONDS and a newer snapshot replaces the warm
+    one.
+    """
+    s3_uri = configuration.get("LOOKUP_SNAPSHOT_S3_URI", "")
+    path = configuration.get("LOOKUP_SNAPSHOT_PATH", "") or DEFAULT_SNAPSHOT_PATH
+    ttl = float(configuration.get("LOOKUP_SNAPSHOT_TTL_SECONDS", "") or DEFAULT_SNAPSHOT_TTL_SECONDS)
+
+    with WARM_LOCK:
+        now = time.monotonic()
+        if WARM['api'] is not None and (not s3_uri or not ttl or now - WARM['checked'] < ttl):
+            return WARM['api']
+
+        etag = snapshot_etag(s3_uri) if s3_uri else None
+        WARM['checked'] = now
+        if WARM['api'] is not None and etag == WARM['etag']:
+            return WARM['api']
+
+        start = time.perf_counter()
+        if s3_uri:
+            download_snapshot(s3_uri, path)
+        api = FDAAPI(snapshot=path)
+        if WARM['api'] is not None:
+            WARM['api'].close()
+        WARM.update(api=api, etag=etag)
+        logger.info(f"lookup snapshot loaded from {s3_uri or path} in {time.perf_counter() - start:.3f}s")
+        return api
+
+
+def reset():
+    """Forget the warm snapshot (used by tests)"""
+    with WARM_LOCK:
+        if WARM['api'] is not None:
+            WARM['api'].close()
+        WARM.update(api=None, etag=None, checked=0.0)
+
+
+def as_number(value, name):
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        raise LookupRequestError(f"{name} must be a number, got {value!r}")
+
+
+def lookup(api, application_no, submission_no=None, docs_type_id=None):
+    """Enrichment payload of an application, or of one of its submission documents
+
+    Raises:
+        LookupRequestError: 404 when the application is unknown
+    """
+    application_no = as_number(application_no, 'application_no')
+    kwargs = {'application_no': application_no}
+    if submission_no is not None or docs_type_id is not None:
+        kwargs['submission_no'] = as_number(submission_no, 'submission_no')
+        kwargs['application_doc_type_id'] = as_number(docs_type_id, 'docs_type_id')
+
+    payload = api.format_response(**kwargs)
+    if not payload['license_holder'] and not payload['fda']['products']:
+        raise LookupRequestError(f"application {application_no} not found", 404)
+    return payload
+
+
+def lookup_batch(api, lookups):
+    """Payloads of many lookups; each failed lookup gets an error and its status instead"""
+    max_batch = int(configuration.get("LOOKUP_MAX_BATCH", "") or DEFAULT_MAX_BATCH)
+    if not isinstance(lookups, list) or not lookups:
+        raise LookupRequestError("lookups must be a non-empty list")
+    if len(lookups) > max_batch:
+        raise LookupRequestError(f"at most {max_batch} lookups per request, got {len(lookups)}", 413)
+
+    results = []
+    for item in lookups:
+        try:
+            if not isinstance(item, dict):
+                raise LookupRequestError("every lookup must be an object")
+            results.append(lookup(api, item.get('application_no'), item.get('submission_no'),
+                                  item.get('docs_type_id')))
+        except LookupRequestError as e:
+            results.append({'error': str(e), 'status': e.status_code})
+    return {'results': results}
+
+
+def route(event):
+    """Answer an API Gateway proxy event"""
+    parameters = event.get('pathParameters') or {}
+    method = event.get('httpMethod', 'GET')
+
+    if method == 'POST':
+        try:
+            body = json.loads(event.get('body') or "{}")
+        except ValueError:
+            raise LookupRequestError("request body is not JSON")
+        return lookup_batch(get_api(), body.get('lookups') if isinstance(body, dict) else None)
+
+    if 'application_no' not in parameters:
+        raise LookupRequestError("application_no is required")
+    return lookup(get_api(), parameters['application_no'], parameters.get('submission_no'),
+                  parameters.get('docs_type_id'))
+
+
+def response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'headers': {'Content-Type': 'application/json'},
+        'body': fda_records.dumps(body),
+    }
+
+
+@utils.flushing_logs
+def handler(event, context):
+    """
+    Serve FDA enrichment lookups from the warm metadata snapshot.
+
+    Path parameters select one application (`application_no`), or one of
+    its submission documents (`submission_no` and `docs_type_id` as well);
+    POST bodies carry a batch of such lookups. Unknown applications are
+    answered with 404, malformed requests with 400.
+    """
+    try:
+        ## Parameter Store values (cached between invocations) override the environment
+        configuration.update(utils.load_ssm_parameters())
+        return response(200, route(event))
+    except LookupRequestError as e:
+        return response(e.status_code, {'error': str(e)})
+    except Exception:
+        logger.exception("lookup failed")
+        return response(500, {'error': "internal error"})
+
+
+def build_snapshot(metadata_loc, path, s3_uri=""):
+    """Load the metadata, index it for lookups and write the snapshot the endpoint serves
+
+    Returns:
+        str: path of the snapshot
+    """
+    api = FDAAPI(S3_metadata_loc=metadata_loc, **({} if metadata_loc.startswith("s3://") else {'test': True}))
+    try:
+        api.create_lookup_indexes()
+        api.create_name_index()
+        if os.path.exists(path):
+            os.remove(path)
+        api.snapshot(path)
+    finally:
+        api.close()
+
+    ## stored compressed, with the codec the uri names or gzip
+    if s3_uri:
+        import aws_clients
+
+        bucket_name, key, _ = utils.split_s3_url(s3_uri)
+        compressed = compression.compress_file(path, path + ".upload",
+                                               codec=compression.codec_of(key) or compression.DEFAULT_CODEC)
+        try:
+            aws_clients.s3().upload_file(compressed, bucket_name, key)
+        finally:
+            os.remove(compressed)
+        logger.info(f"lookup snapshot uploaded to {s3_uri}")
+    return path
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build the metadata snapshot served by the lookup endpoint")
+    parser.add_argument("--metadata", required=True, help="local folder or s3:// prefix of the FDA metadata")
+    parser.add_argument("--output", default=DEFAULT_SNAPSHOT_PATH, help="snapshot file to write")
+    parser.add_argument("--s3-uri", default="", help="upload the snapshot to this s3 uri")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    build_snapshot(args.metadata, args.output, args.s3_uri)
+    print(args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+Versioned store of the daily FDA metadata drops.
+
+Every table of FDAAPI is kept once in a SQLite file, each row with the day
+it appeared (`valid_from`) and the day it stopped being in the drops
+(`valid_to`, NULL while it still is). The first drop ingested is the base
+snapshot; every later drop only adds the rows that changed and closes the
+rows that went away, so the store grows with the amount of change, not
+with the number of days. `FDAAPI(snapshot=<store>, as_of=<date>)` enriches
+against the metadata as it was on that day.
+
+Example:
+    python metadata_store.py --store /tmp/metadata.db --metadata data/metadata --date 2020-09-02
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import sqlite3
+from collections import Counter
+from datetime import date, datetime
+
+import compression
+from fda_api import FDAAPI
+
+DATE_FORMAT = "%Y-%m-%d"
+
+## columns added to every versioned table
+VALID_FROM = 'valid_from'
+VALID_TO = 'valid_to'
+VERSION_COLUMNS = (VALID_FROM, VALID_TO)
+
+## one row per ingested drop
+DROPS_TABLE = 'metadata_drops'
+
+logger = logging.getLogger(__name__)
+
+
+def as_of_date(value):
+    """`YYYY-MM-DD` of a date, datetime or date string; raises ValueError for anything else"""
+    if isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        return value.strftime(DATE_FORMAT)
+    return datetime.strptime(str(value), DATE_FORMAT).strftime(DATE_FORMAT)
+
+
+def table_columns(conn, table, schema='main'):
+    """(name, declared type) of the columns of a table, in order"""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    return [(row[1], row[2]) for row in cursor.execute("PRAGMA %s.table_info(%s)" % (schema, table))]
+
+
+def valid_on(day):
+    """SQL condition selecting the versions of rows that were valid on a day"""
+    day = as_of_date(day)
+    return "%s <= '%s' AND (%s IS NULL OR %s > '%s')" % (VALID_FROM, day, VALID_TO, VALID_TO, day)
+
+
+class MetadataStore(object):
+    """
+    SQLite file of versioned FDA metadata tables.
+
+    Args:
+        path (str): store file, created on the first ingest
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS %s (drop_date TEXT PRIMARY KEY, source TEXT, "
+                          "rows_added INTEGER, rows_removed INTEGER, ingest_seconds REAL)" % DROPS_TABLE)
+        self.conn.commit()
+        self.apis = {}
+
+    def close(self):
+        self.close_apis()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def drop_dates(self):
+        return [row[0] for row in self.conn.execute("SELECT drop_date FROM %s ORDER BY drop_date" % DROPS_TABLE)]
+
+    def create_table(self, table, columns):
+        """Versioned copy of an FDAAPI table, indexed for current rows and application lookups"""
+        names = [name for name, _ in columns]
+        self.conn.execute("CREATE TABLE IF NOT EXISTS %s (%s, %s TEXT NOT NULL, %s TEXT)" % (
+            table, ", ".join("%s %s" % (name, kind) for name, kind in columns), VALID_FROM, VALID_TO))
+        self.conn.execute("CREATE INDEX IF NOT EXISTS %s_current ON %s (%s)" % (table, table, VALID_TO))
+        if 'applNo' in names:
+            self.conn.execute("CREATE INDEX IF NOT EXISTS %s_applNo ON %s (applNo, %s)" % (table, table, VALID_FROM))
+
+    def ingest_table(self, table, drop_conn, day):
+        """Close the current rows missing from the drop and add the drop's new rows
+
+        Rows are compared on all their columns, duplicates included, so the
+        rows valid after the drop are exactly the rows of the drop.
+
+        Returns:
+            tuple: (rows added, rows removed)
+        """
+        names = [name for name, _ in table_columns(drop_conn, table)]
+
+        incoming = Counter(tuple(row) for row in drop_conn.execute("SELECT %s FROM %s" % (", ".join(names), table)))
+        current = {}
+        for row in self.conn.execute("SELECT rowid, %s FROM %s WHERE %s IS NULL" % (", ".join(names), table, VALID_TO)):
+            current.setdefault(tuple(row[1:]), []).append(row[0])
+
+        removed = []
+        for values, rowids in current.items():
+            extra = len(rowids) - incoming.get(values, 0)
+            if extra > 0:
+                removed.extend(rowids[:extra])
+
+        added = []
+        for values, count in incoming.items():
+            missing = count - len(current.get(values, ()))
+            if missing > 0:
+                added.extend([values + (day, None)] * missing)
+
+        self.conn.executemany("UPDATE %s SET %s = ? WHERE rowid = ?" % (table, VALID_TO),
+                              [(day, rowid) for rowid in removed])
+        self.conn.executemany("INSERT INTO %s VALUES (%s)" % (table, ", ".join("?" * (len(names) + 2))), added)
+        return (len(added), len(removed))
+
+    def ingest(self, metadata_loc, drop_date):
+        """Add the drop of a day, read from a local folder or an s3:// metadata prefix
+
+        Drops are ingested in date order; a drop older than the latest one
+        would rewrite history and is refused. Tables of files missing from a
+        local folder are left as they were.
+
+        Returns:
+            dict: rows added and removed per table
+        """
+        day = as_of_date(drop_date)
+        dates = self.drop_dates()
+        if dates and day <= dates[-1]:
+            raise ValueError(f"drop of {day} is not after the latest drop ingested ({dates[-1]})")
+
+        start = time.perf_counter()
+        is_local = not metadata_loc.startswith("s3://")
+        drop = FDAAPI(S3_metadata_loc=metadata_loc, **({'test': True} if is_local else {}))
+        changes = {}
+        try:
+            with self.conn:
+                for item, _ in drop.metadata_tables():
+                    self.create_table(item.tablename, table_columns(drop.conn, item.tablename))
+
+                    ## files missing from a local folder leave their table as it was
+                    if is_local and compression.local_variant(os.path.join(metadata_loc, item.filename)) is None:
+                        logger.warning(f"drop of {day} has no {item.filename}, {item.tablename} is kept as it was")
+                        changes[item.tablename] = (0, 0)
+                        continue
+                    changes[item.tablename] = self.ingest_table(item.tablename, drop.conn, day)
+
+                added = sum(change[0] for change in changes.values())
+                removed = sum(change[1] for change in changes.values())
+                self.conn.execute("INSERT INTO %s VALUES (?, ?, ?, ?, ?)" % DROPS_TABLE,
+                                  (day, metadata_loc, added, removed, time.perf_counter() - start))
+        finally:
+            drop.close()
+
+        self.close_apis()
+        logger.info(f"metadata drop of {day} ingested from {metadata_loc}: {added} rows added, {removed} removed")
+        return dict((table, {'added': change[0], 'removed': change[1]}) for table, change in changes.items())
+
+    def close_apis(self):
+        for api in self.apis.values():
+            api.close()
+        self.apis = {}
+
+    def api(self, as_of):
+        """FDAAPI enriching against the metadata as of a day, one per day"""
+        day = as_of_date(as_of)
+        if day not in self.apis:
+            self.apis[day] = FDAAPI(snapshot=self.path, as_of=day)
+        return self.apis[day]
+
+    def stats(self):
+        """Drops ingested, rows stored and rows current per table"""
+        tables = {}
+        for (table,) in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name != ? "
+                                          "ORDER BY name", (DROPS_TABLE,)).fetchall():
+            stored, current = self.conn.execute("SELECT count(*), count(*) - count(%s) FROM %s"
+                                                % (VALID_TO, table)).fetchone()
+            tables[table] = {'stored_rows': stored, 'current_rows': current}
+
+        return {
+            'drops': self.drop_dates(),
+            'stored_rows': sum(table['stored_rows'] for table in tables.values()),
+            'current_rows': sum(table['current_rows'] for table in tables.values()),
+            'tables': tables,
+            'size_bytes': os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+        }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest a daily FDA metadata drop into a versioned store")
+    parser.add_argument("--store", required=True, help="store file")
+    parser.add_argument("--metadata", default="", help="local folder or s3:// prefix of the drop")
+    parser.add_argument("--date", default="", help="day of the drop, YYYY-MM-DD")
+    args = parser.parse_args(argv)
+    if bool(args.metadata) != bool(args.date):
+        parser.error("--metadata and --date go together")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    store = MetadataStore(args.store)
+    try:
+        if args.metadata:
+            store.ingest(args.metadata, args.date)
+        print(json.dumps(store.stats(), indent=2))
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
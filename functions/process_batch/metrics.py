@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+import math
+import time
+import logging
+import threading
+import contextlib
+
+## CloudWatch namespace and dimensions of the embedded metric format documents
+DEFAULT_NAMESPACE = "ProcessBatchFDA"
+DIMENSION_KEYS = ["Function", "Stage"]
+
+## CloudWatch accepts at most 100 metrics per metric directive
+EMF_MAX_METRICS = 100
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(int(math.ceil(pct / 100.0 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class StageMetrics(object):
+    """
+    Collects stage timings and counters during one invocation and emits
+    them, aggregated, as a single CloudWatch embedded metric format (EMF)
+    log line.
+
+    Every timing sample of a stage is kept until `emit`, so count, sum,
+    p50, p99 and max can be computed exactly; samples can be recorded from
+    several threads.
+
+    Args:
+        namespace (str): CloudWatch metric namespace
+        dimensions (dict): dimension values, keyed by DIMENSION_KEYS
+    """
+
+    def __init__(self, namespace=DEFAULT_NAMESPACE, dimensions=None):
+        self.namespace = namespace
+        self.dimensions = dimensions or {}
+        self.samples = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.samples.setdefault(stage, []).append(seconds * 1000.0)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """Time the body of a with block as one sample of `stage`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def timed(self, stage, fn):
+        """Wrap fn so every call is recorded as a sample of `stage`"""
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return wrapper
+
+    def record_load_timings(self, load_timings):
+        """Record FDAAPI.load_timings as metadata read, convert and insert samples, one per table"""
+        for timing in load_timings.values():
+            self.record('metadata_read', timing['read_seconds'])
+            self.record('metadata_convert', timing['convert_seconds'])
+            self.record('sqlite_insert', timing['insert_seconds'])
+            self.count('metadata_rows', timing['rows'])
+
+    def summary(self):
+        """Aggregated values and units, keyed by metric name"""
+        with self.lock:
+            samples = dict((stage, list(values)) for stage, values in self.samples.items())
+            counters = dict(self.counters)
+
+        values = {}
+        for stage, timings in sorted(samples.items()):
+            values[f"{stage}.count"] = (len(timings), "Count")
+            values[f"{stage}.sum_ms"] = (round(sum(timings), 3), "Milliseconds")
+            values[f"{stage}.p50_ms"] = (round(percentile(timings, 50), 3), "Milliseconds")
+            values[f"{stage}.p99_ms"] = (round(percentile(timings, 99), 3), "Milliseconds")
+            values[f"{stage}.max_ms"] = (round(max(timings), 3), "Milliseconds")
+        for name, value in sorted(counters.items()):
+            values[name] = (value, "Count")
+
+        return values
+
+    def to_emf(self, timestamp=None):
+        """Build the embedded metric format document of the collected metrics"""
+        values = self.summary()
+        names = list(values)
+        dimension_keys = [key for key in DIMENSION_KEYS if key in self.dimensions]
+
+        document = dict((name, value) for name, (value, _) in values.items())
+        document.update(self.dimensions)
+        document['_aws'] = {
+            'Timestamp': int((timestamp if timestamp is not None else time.time()) * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': self.namespace,
+                'Dimensions': [dimension_keys],
+                'Metrics': [{'Name': name, 'Unit': values[name][1]}
+                            for name in names[i:i + EMF_MAX_METRICS]]
+            } for i in range(0, len(names), EMF_MAX_METRICS)]
+        }
+        return document
+
+    def emit(self):
+        """Log the collected metrics as one EMF document and start over"""
+        if not self.samples and not self.counters:
+            return None
+
+        document = self.to_emf()
+        self.logger.info("stage metrics", extra={'emf': document})
+
+        with self.lock:
+            self.samples = {}
+            self.counters = {}
+        return document
+
+
+def get_stage_metrics(configuration, stage=""):
+    """Build the StageMetrics of an invocation from the environment configuration
+
+    Args:
+        configuration (dict): environment variables (METRICS_NAMESPACE)
+        stage (str): deployment stage, used as a dimension
+
+    Returns:
+        StageMetrics
+    """
+    dimensions = {'Function': configuration.get("AWS_LAMBDA_FUNCTION_NAME", "") or "local"}
+    if stage:
+        dimensions['Stage'] = stage
+
+    return StageMetrics(namespace=configuration.get("METRICS_NAMESPACE", "") or DEFAULT_NAMESPACE,
+                        dimensions=dimensions)
@@ -1,10 +1,10 @@
 import json
-import boto3
 import time
 import urllib
 import os
 
-sns = boto3.client('sns')
+import aws_clients
+import run_summary
 
 
 class ProcessBatchFDAStateMachineFailedException(Exception):
@@ -17,13 +17,11 @@ def handler(event, context):
     stage = os.environ['STAGE']
     request_id = context.aws_request_id
 
-    metadata_path = event["s3_metadata_file_path"]
-    delta_file_path = event["s3_delta_file_path"]
+    ## the run summary, with the caught error, not the event: the event carries every chunk of delta records
+    email_subject = run_summary.notification_subject('Job Failed : Process Batch FDA : ', event)
+    email_body = run_summary.notification_message(event)
 
-    email_subject = 'Job Failed : Process Batch FDA : ' + delta_file_path
-    email_body = json.dumps(event, indent=2)
-
-    sns.publish(
+    aws_clients.sns().publish(
         TopicArn=operations_notification_arn,
         Message=email_body,
         Subject=email_subject
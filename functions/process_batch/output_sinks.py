@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+
+import io
+import os
+import gzip
+import time
+import logging
+import datetime
+
+import utils
+import aws_clients
+import claim_check
+import fda_records
+
+## Sink types selectable through OUTPUT_SINK
+EVENTBRIDGE_SINK = "eventbridge"
+S3_SINK = "s3"
+FILE_SINK = "file"
+NULL_SINK = "null"
+
+## EventBridge accepts at most 10 entries and 256 KB per put_events request
+EVENTBRIDGE_MAX_ENTRIES = 10
+EVENTBRIDGE_MAX_REQUEST_BYTES = 256 * 1024
+
+## entries failed with these error codes are retried, with exponential backoff, up to EVENTBRIDGE_MAX_ATTEMPTS times
+EVENTBRIDGE_RETRYABLE_ERRORS = ('ThrottlingException', 'InternalFailure', 'InternalException', 'ServiceUnavailable')
+EVENTBRIDGE_MAX_ATTEMPTS = 5
+EVENTBRIDGE_RETRY_DELAY_SECONDS = 0.1
+
+## S3 rejects multipart parts smaller than 5 MB (except the last one)
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+EVENT_SOURCE = 'process_batch_fda'
+EVENT_DETAIL_TYPE = 'process batch event submitted'
+
+
+class OutputSinkException(Exception):
+    pass
+
+
+class OutputSink(object):
+    """
+    Base class for the destinations enrichment payloads are written to.
+
+    Payloads are buffered and handed to `write_batch` once `buffer_size`
+    records are pending, or when `flush` is called at the end of a chunk.
+
+    Args:
+        buffer_size (int): number of payloads to buffer before writing
+        log_payloads (bool): log every payload written to the sink
+        metrics (StageMetrics, optional): records the time of every write_batch as `publish`
+    """
+
+    name = None
+
+    def __init__(self, buffer_size=100, log_payloads=False, metrics=None):
+        self.buffer_size = max(int(buffer_size), 1)
+        self.log_payloads = log_payloads
+        self.metrics = metrics
+        self.buffer = []
+        self.records_written = 0
+        ## payloads the destination refused for good, not counted as written
+        self.records_failed = 0
+        self.logger = logging.getLogger(__name__)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def write(self, payload):
+        """Add a payload to the sink
+
+        Args:
+            payload (dict): enrichment payload built by FDAAPI.format_response
+        """
+        if self.log_payloads:
+            self.logger.info(utils.pretty_print_json(payload))
+
+        self.buffer.append(payload)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered payloads to the destination"""
+        if not self.buffer:
+            return
+
+        batch, self.buffer = self.buffer, []
+        failed = self.records_failed
+        if self.metrics is None:
+            self.write_batch(batch)
+        else:
+            with self.metrics.timer('publish'):
+                self.write_batch(batch)
+        self.records_written += len(batch) - (self.records_failed - failed)
+
+    def close(self):
+        """Flush pending payloads and release the destination"""
+        self.flush()
+
+    def abort(self):
+        """Discard pending payloads after a failure"""
+        self.buffer = []
+
+    def write_batch(self, payloads):
+        raise NotImplementedError()
+
+
+class NullSink(OutputSink):
+    """
+    Sink that drops every payload, used for dry runs and profiling
+    """
+    name = NULL_SINK
+
+    def write_batch(self, payloads):
+        pass
+
+
+class EventBridgeSink(OutputSink):
+    """
+    Publish each payload as an EventBridge event, batching entries into
+    put_events requests of at most 10 entries and 256 KB.
+
+    An event over the size limit is skipped and counted in `records_failed`
+    rather than failing the request it would share with valid entries, and
+    so are entries EventBridge refuses for good. Entries throttled or failed by an internal error are retried with
+    exponential backoff; an OutputSinkException is raised when they still
+    fail after `max_attempts` requests.
+
+    Args:
+        events_client: boto3 events client
+        claim_check (ClaimCheck, optional): offloads oversized payloads to S3
+        max_attempts (int): put_events requests per entry
+        retry_delay (float): seconds before the first retry, doubled for every next one
+    """
+    name = EVENTBRIDGE_SINK
+
+    def __init__(self, events_client=None, claim_check=None, max_attempts=EVENTBRIDGE_MAX_ATTEMPTS,
+                 retry_delay=EVENTBRIDGE_RETRY_DELAY_SECONDS, **kwargs):
+        kwargs.setdefault('buffer_size', EVENTBRIDGE_MAX_ENTRIES)
+        super(EventBridgeSink, self).__init__(**kwargs)
+        self.client = events_client if events_client is not None else aws_clients.events()
+        self.claim_check = claim_check
+        self.max_attempts = max(int(max_attempts), 1)
+        self.retry_delay = retry_delay
+
+    def make_entry(self, payload):
+        detail = fda_records.event_detail(payload)
+        if self.claim_check is not None and len(detail.encode('utf-8')) > self.claim_check.threshold:
+            detail = fda_records.event_detail(self.claim_check.check(payload))
+
+        return {
+            'Time': datetime.datetime.now(),
+            'Source': EVENT_SOURCE,
+            'DetailType': EVENT_DETAIL_TYPE,
+            'Detail': detail
+        }
+
+    @staticmethod
+    def entry_size(entry):
+        """Entry size as computed by EventBridge (the timestamp counts as 14 bytes)"""
+        return 14 + sum(len(entry[field].encode('utf-8')) for field in ('Source', 'DetailType', 'Detail'))
+
+    def write_batch(self, payloads):
+        batch, batch_size = [], 0
+
+        for payload in payloads:
+            entry = self.make_entry(payload)
+            size = self.entry_size(entry)
+            if size > EVENTBRIDGE_MAX_REQUEST_BYTES:
+                self.logger.error(
+                    f"event for {payload.get('s3_raw', '')} is {size} bytes and exceeds the EventBridge limit, "
+                    "it is not published")
+                self.records_failed += 1
+                continue
+
+            if batch and (len(batch) == EVENTBRIDGE_MAX_ENTRIES or
+                          batch_size + size > EVENTBRIDGE_MAX_REQUEST_BYTES):
+                self.put_events(batch)
+                batch, batch_size = [], 0
+
+            batch.append(entry)
+            batch_size += size
+
+        if batch:
+            self.put_events(batch)
+
+    def put_events(self, entries):
+        """Publish entries, retrying those throttled or failed by an internal error"""
+        for attempt in range(self.max_attempts):
+            if attempt:
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+            response = self.client.put_events(Entries=entries)
+            if not response.get('FailedEntryCount', 0):
+                return
+
+            ## results are in the order of the entries
+            retry = []
+            for entry, result in zip(entries, response.get('Entries', [])):
+                if 'ErrorCode' not in result:
+                    continue
+                if result['ErrorCode'] in EVENTBRIDGE_RETRYABLE_ERRORS:
+                    retry.append((entry, result['ErrorCode']))
+                else:
+                    self.records_failed += 1
+                    self.logger.error(f"event was not published: {result['ErrorCode']} {result.get('ErrorMessage', '')}")
+
+            if not retry:
+                return
+            self.logger.warning(f"{len(retry)} of {len(entries)} events failed with "
+                                f"{sorted(set(code for _, code in retry))}, attempt {attempt + 1} of {self.max_attempts}")
+            entries = [entry for entry, _ in retry]
+
+        self.records_failed += len(entries)
+        raise OutputSinkException(f"{len(entries)} events were still not published after {self.max_attempts} attempts")
+
+
+class LocalFileSink(OutputSink):
+    """
+    Write payloads as JSON Lines to a local file, gzip compressed when the
+    path ends with .gz
+
+    Args:
+        path (str): output file path
+    """
+    name = FILE_SINK
+
+    def __init__(self, path, **kwargs):
+        super(LocalFileSink, self).__init__(**kwargs)
+        self.path = path
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        if path.endswith(".gz"):
+            self.fh = gzip.open(path, 'wt', encoding='utf-8')
+        else:
+            self.fh = open(path, 'w', encoding='utf-8')
+
+    def write_batch(self, payloads):
+        self.fh.write("".join(fda_records.dumps(payload) + "\n" for payload in payloads))
+        self.fh.flush()
+
+    def close(self):
+        super(LocalFileSink, self).close()
+        self.fh.close()
+
+    def abort(self):
+        super(LocalFileSink, self).abort()
+        self.fh.close()
+
+
+class S3JsonLinesSink(OutputSink):
+    """
+    Stream payloads to a single gzip compressed JSON Lines object on S3.
+
+    Compressed output is uploaded as multipart parts as soon as `part_size`
+    bytes are available, so memory use stays bounded regardless of how many
+    records are written. Outputs smaller than one part are written with a
+    single put_object on close.
+
+    Args:
+        s3_uri (str): destination object (s3://bucket/key.jsonl.gz)
+        s3_client: boto3 s3 client
+        part_size (int): multipart part size in bytes (minimum 5 MB)
+    """
+    name = S3_SINK
+
+    def __init__(self, s3_uri, s3_client=None, part_size=S3_DEFAULT_PART_SIZE, **kwargs):
+        kwargs.setdefault('buffer_size', 1000)
+        super(S3JsonLinesSink, self).__init__(**kwargs)
+        self.client = s3_client if s3_client is not None else aws_clients.s3()
+        self.s3_uri = s3_uri
+        self.bucket_name, self.key, _ = utils.split_s3_url(s3_uri)
+        self.part_size = max(int(part_size), S3_MIN_PART_SIZE)
+
+        self.upload_id = None
+        self.parts = []
+
+        # compressed bytes waiting to be uploaded
+        self.compressed = io.BytesIO()
+        self.compressor = gzip.GzipFile(fileobj=self.compressed, mode='wb')
+
+    def write_batch(self, payloads):
+        self.compressor.write(
+            "".join(fda_records.dumps(payload) + "\n" for payload in payloads).encode('utf-8'))
+
+        if self.compressed.tell() >= self.part_size:
+            self.upload_part()
+
+    def upload_part(self):
+        if self.upload_id is None:
+            response = self.client.create_multipart_upload(
+                Bucket=self.bucket_name, Key=self.key, ContentType='application/x-ndjson',
+                ContentEncoding='gzip')
+            self.upload_id = response['UploadId']
+
+        part_number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=self.compressed.getvalue())
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+
+        self.compressed.seek(0)
+        self.compressed.truncate()
+
+    def close(self):
+        super(S3JsonLinesSink, self).close()
+        self.compressor.close()
+
+        from botocore.exceptions import ClientError
+
+        try:
+            if self.upload_id is None:
+                self.client.put_object(
+                    Bucket=self.bucket_name, Key=self.key, Body=self.compressed.getvalue(),
+                    ContentType='application/x-ndjson', ContentEncoding='gzip')
+            else:
+                if self.compressed.tell() > 0:
+                    self.upload_part()
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id,
+                    MultipartUpload={'Parts': self.parts})
+        except ClientError:
+            self.logger.exception(f"failed to write output to: {self.s3_uri}")
+            self.abort()
+            raise
+
+        self.logger.info(f"{self.records_written} records written to: {self.s3_uri}")
+
+    def abort(self):
+        super(S3JsonLinesSink, self).abort()
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+
+
+def make_output_key(prefix, suffix=".jsonl.gz"):
+    """Build a unique, date partitioned object key below prefix
+
+    Args:
+        prefix (str): s3 uri or local folder
+    """
+    now = datetime.datetime.utcnow()
+    return "{}/{}/{}{}".format(prefix.rstrip("/"), now.strftime("%Y/%m/%d"),
+                               utils.make_unique_id(), suffix)
+
+
+def get_output_sink(configuration, parameters=None, events_client=None, s3_client=None, metrics=None):
+    """Build the output sink selected by configuration
+
+    The sink type is read from `output_sink` in the event parameters, falling
+    back to the OUTPUT_SINK setting (default: eventbridge).
+
+    Args:
+        configuration (dict): environment configuration
+        parameters (dict, optional): event parameters overriding configuration
+        events_client (optional): boto3 events client for the eventbridge sink
+        s3_client (optional): boto3 s3 client for the s3 sink
+        metrics (StageMetrics, optional): records publish timings
+
+    Returns:
+        OutputSink: configured sink
+    """
+    parameters = parameters or {}
+
+    def setting(key, default=""):
+        return parameters.get(key.lower(), configuration.get(key, default))
+
+    sink_type = str(setting("OUTPUT_SINK", EVENTBRIDGE_SINK)).lower()
+    log_payloads = str(setting("LOG_PAYLOADS", "false")).lower() in ("1", "true", "yes")
+
+    kwargs = {'log_payloads': log_payloads, 'metrics': metrics}
+    buffer_size = setting("OUTPUT_BUFFER_SIZE", "")
+    if buffer_size:
+        kwargs['buffer_size'] = int(buffer_size)
+
+    if sink_type == EVENTBRIDGE_SINK:
+        return EventBridgeSink(events_client=events_client,
+                               claim_check=claim_check.get_claim_check(configuration, s3_client=s3_client),
+                               **kwargs)
+
+    if sink_type == S3_SINK:
+        s3_uri = setting("OUTPUT_S3_URI")
+        if not s3_uri:
+            raise OutputSinkException("OUTPUT_S3_URI is required for the s3 output sink")
+        if not s3_uri.endswith(".gz"):
+            s3_uri = make_output_key(s3_uri)
+        part_size = setting("OUTPUT_S3_PART_SIZE", S3_DEFAULT_PART_SIZE)
+        return S3JsonLinesSink(s3_uri, s3_client=s3_client, part_size=part_size, **kwargs)
+
+    if sink_type == FILE_SINK:
+        path = setting("OUTPUT_FILE_PATH")
+        if not path:
+            raise OutputSinkException("OUTPUT_FILE_PATH is required for the file output sink")
+        return LocalFileSink(path, **kwargs)
+
+    if sink_type == NULL_SINK:
+        return NullSink(**kwargs)
+
+    raise OutputSinkException(f"unknown output sink: {sink_type}")
@@ -1,22 +1,18 @@
 #!/usr/bin/env python
 from __future__ import print_function
 
-import boto3
-import json
 import time
-import os
 import logging
 import warnings
-import csv
-import datetime
-
-from botocore.exceptions import ClientError
-
-from urllib.parse import unquote_plus
-import traceback
-import re
 
 import utils
+import metrics
+import profiling
+import delta_file
+import claim_check
+import output_sinks
+import enrichment_pipeline
+import run_summary
 from fda_api import FDAAPI
 
 # ignore warnings
@@ -29,15 +25,11 @@ logger = utils.load_log_config()
 configuration = utils.load_osenv()
 logging.info(f"read configuration:{len(configuration)}")
 
-
-# initialize AWS services
-S3_CLIENT = boto3.client('s3')
-S3_RESOURCE = boto3.resource('s3')
-
-# Create CloudWatchEvents client
-CLOUDWATCH_EVENTS = boto3.client('events')
+## event fields returned with the chunk's run summary; the summarizer reads the run's parameters and stats from them
+RESULT_KEYS = ('run_id', 'chunk_index', 'parameters', 'process_batch_stats')
 
 
+@profiling.profiled('process_batch')
 def handler(event, context):
     """
     Method trigger file and construct events 
@@ -55,21 +47,91 @@ def handler(event, context):
     ## check stats
     total_records_process = event['process_batch_stats']['number_of_records_to_process'] if 'process_batch_stats' in event else 0
     if total_records_process == 0:
-        ## notify to user process complete nothing to process
-        return {
-            "statusCode": 200,
-            "body": json.dumps({
-                "message": "no records to process"
-            })
-        }
+        ## nothing to process: the chunk still returns its (empty) summary for the summarizer
+        logging.info("no records to process")
+        return chunk_result(event, run_summary.RunSummary.from_dict(event.get('run_summary')))
+
+    ## Parameter Store values (cached between invocations) override the environment
+    configuration.update(utils.load_ssm_parameters())
 
     # else process the chunks.
     s3_metadata_file_path = event['parameters']['s3_metadata_file_path']
     logging.info(f"s3 path to the metadata file:{s3_metadata_file_path}")
 
-    delta_file_records = event['chunks']
+    ## chunks of large executions are passed by claim check, see load_parameters.fit_execution_input
+    delta_file_records = claim_check.resolve(event['chunks'])
     is_test = True if "test" in event else False
-    api = FDAAPI(S3_metadata_loc=s3_metadata_file_path, test=is_test)
+
+    ## stage timings are emitted once, as an EMF log line, at the end of the invocation
+    stage_metrics = metrics.get_stage_metrics(configuration, stage)
+    chunk_start = time.perf_counter()
+    try:
+        with stage_metrics.timer('metadata_load'), profiling.stage('metadata_load'):
+            api = FDAAPI(S3_metadata_loc=s3_metadata_file_path, test=is_test, metrics=stage_metrics)
+        stage_metrics.record_load_timings(api.load_timings)
+
+        ## records with a drug name but no usable ApplNo are resolved through the product name index
+        with stage_metrics.timer('resolve_names'):
+            delta_file_records, unresolved = api.resolve_records(delta_file_records)
+        stage_metrics.count('records_resolved_by_name',
+                            sum(1 for record in delta_file_records if 'application_no_source' in record))
+        stage_metrics.count('records_unresolved', len(unresolved))
+
+        with profiling.stage('enrich_records'):
+            enrich_records(api, delta_file_records, event['parameters'], stage_metrics)
+
+        ## a constant size summary is returned instead of the records
+        summary = summarize_chunk(event, delta_file_records, unresolved, stage_metrics,
+                                  time.perf_counter() - chunk_start)
+    finally:
+        stage_metrics.emit()
+
+    return chunk_result(event, summary)
+
+
+def chunk_result(event, summary):
+    """Output of a chunk for the summarizer: the run's identity, parameters and stats and the chunk's summary
+
+    The chunk's records are left out, so the output of a Map state over the
+    chunks does not grow with the delta file.
+    """
+    result = dict((key, event[key]) for key in RESULT_KEYS if key in event)
+    result['run_summary'] = summary.to_dict()
+    return result
+
+
+def summarize_chunk(event, records, unresolved, stage_metrics, seconds):
+    """Summary of this chunk, merged into the summary the event already carries
+
+    The keys of every unresolved record and the stage metrics are written in
+    full to RUN_SUMMARY_S3_URI, when set in the configuration; the summary keeps a sample and a
+    pointer to them.
+    """
+    summary = run_summary.RunSummary.from_dict(event.get('run_summary'))
+    chunk = str(event.get('chunk_index', run_summary.record_key(records[0]) if records else ''))
+    failed_keys = [run_summary.record_key(record) for record in unresolved]
+    stage_values = stage_metrics.summary()
+
+    summary.add_stage_metrics(stage_values)
+    summary.add_chunk(chunk, seconds, len(records) + len(unresolved))
+    summary.add_failed_keys(failed_keys)
+
+    try:
+        detail_uri = run_summary.write_detail(
+            {'chunk': chunk, 'seconds': seconds, 'failed_keys': failed_keys,
+             'stage_metrics': dict((name, value) for name, (value, _) in stage_values.items())},
+            configuration.get(run_summary.RUN_SUMMARY_S3_URI_ENV, ""), event.get('run_id', '') or 'unknown-run',
+            "chunk-" + str(event['chunk_index'] if 'chunk_index' in event else utils.make_unique_id()))
+        if detail_uri:
+            summary.details['chunks'] = detail_uri
+    except Exception:
+        logging.exception("failed to write the chunk detail")
+
+    return summary
+
+
+def enrich_records(api, delta_file_records, parameters, stage_metrics):
+    """Enrich the delta records and write the payloads to the configured sink"""
 
     '''
      'appplication_docs_type_id': row[0],
@@ -80,24 +142,33 @@ def handler(event, context):
             'drug_name': row[5],
             's3_path': row[6]
     '''
-    for row in delta_file_records:
-        fda_metadata = api.format_response(
-            application_no=int(row['application_no']), submission_no=int(row['submission_no']),
-            application_doc_type_id=int(row['appplication_docs_type_id']),
-            submission_type=row['submission_type'], s3_raw=row['s3_path'], url=row['application_docs_url'])
-
-        ## Put an event
-        
-        response = CLOUDWATCH_EVENTS.put_events(
-            Entries=[
-                {
-                    'Time': datetime.datetime.now(),
-                    'Source': 'process_batch_fda',
-                    'DetailType': 'process batch event submitted',
-                    'Detail': json.dumps({"metadata": fda_metadata})
-                },
-            ]
-        )
-        print(json.dumps(fda_metadata, indent=4))
-
-    return event
+    ## payloads are written to the configured sink (eventbridge, s3, file or null)
+    sink = output_sinks.get_output_sink(configuration, parameters, metrics=stage_metrics)
+    ## overlap enrichment with publishing; more than one worker copies the metadata to a file snapshot
+    ## in /tmp, so concurrent enrichment is opt-in
+    workers = int(configuration.get("ENRICHMENT_WORKERS", "") or 1)
+    queue_size = int(configuration.get("ENRICHMENT_QUEUE_SIZE", "") or 100)
+    ## cProfile only sees the calling thread
+    if profiling.active():
+        workers = 1
+    if workers > 1:
+        api.enable_concurrent_reads()
+
+    ## records sharing an enrichment key, chunked together by load_parameters, are enriched once
+    enrich = enrichment_pipeline.SharedEnrichment(stage_metrics.timed('enrich_record', api.format_record),
+                                                  delta_file.enrichment_key, FDAAPI.document_fields)
+    try:
+        with sink:
+            enrichment_pipeline.run_pipeline(enrich, delta_file_records, sink, workers=workers, queue_size=queue_size)
+
+            ## flush on chunk boundary
+            sink.flush()
+    finally:
+        api.close()
+
+    stage_metrics.count('records_written', sink.records_written)
+    stage_metrics.count('records_failed', sink.records_failed)
+    stage_metrics.count('records_shared_enrichment', enrich.shared_count)
+    logging.info(f"{sink.records_written} records written to the {sink.name} sink")
+    if sink.records_failed:
+        logging.error(f"{sink.records_failed} records were not written to the {sink.name} sink")
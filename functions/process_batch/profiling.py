@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+import io
+import os
+import json
+import time
+import cProfile
+import logging
+import datetime
+import functools
+import contextlib
+import tracemalloc
+
+import utils
+
+## profiling is switched on per invocation by an event flag or for every invocation by PROFILE_HANDLERS
+PROFILE_EVENT_KEY = "profile"
+PROFILE_ENV = "PROFILE_HANDLERS"
+
+## where reports are written: PROFILE_S3_URI (s3://bucket/prefix) or PROFILE_DIR (default /tmp/profiles)
+PROFILE_S3_URI_ENV = "PROFILE_S3_URI"
+PROFILE_DIR_ENV = "PROFILE_DIR"
+DEFAULT_PROFILE_DIR = "/tmp/profiles"
+
+DEFAULT_TOP = 25
+TRACEMALLOC_FRAMES = 1
+
+TRUE_VALUES = ("1", "true", "yes")
+
+## session of the invocation being profiled, None when profiling is off
+_session = None
+_NO_STAGE = contextlib.nullcontext()
+
+
+def is_enabled(event):
+    """Whether the invocation of this event should be profiled"""
+    if isinstance(event, dict):
+        flag = event.get(PROFILE_EVENT_KEY, (event.get('parameters') or {}).get(PROFILE_EVENT_KEY))
+        if flag is not None:
+            return str(flag).lower() in TRUE_VALUES
+    return os.environ.get(PROFILE_ENV, "").lower() in TRUE_VALUES
+
+
+def active():
+    return _session is not None
+
+
+class StageProfile(object):
+    """cProfile and tracemalloc results of one stage, accumulated over every entry"""
+
+    def __init__(self, name):
+        self.name = name
+        self.profiler = cProfile.Profile()
+        self.seconds = 0.0
+        self.calls = 0
+        self.peak_bytes = 0
+        self.allocations = {}
+        self.start = None
+        self.snapshot = None
+
+    def top_functions(self, top):
+        import pstats
+
+        stats = pstats.Stats(self.profiler, stream=io.StringIO()).stats
+        rows = sorted(stats.items(), key=lambda item: -item[1][3])[:top]
+        return [{'function': func, 'file': filename, 'line': line, 'calls': nc,
+                 'tottime': round(tt, 6), 'cumtime': round(ct, 6)}
+                for (filename, line, func), (cc, nc, tt, ct, callers) in rows]
+
+    def top_allocations(self, top):
+        rows = sorted(self.allocations.items(), key=lambda item: -item[1][0])[:top]
+        return [{'site': site, 'size_bytes': size, 'count': count} for site, (size, count) in rows]
+
+    def to_dict(self, top):
+        return {
+            'entries': self.calls,
+            'seconds': round(self.seconds, 6),
+            'peak_traced_bytes': self.peak_bytes,
+            'top_functions': self.top_functions(top),
+            'top_allocations': self.top_allocations(top),
+        }
+
+
+class ProfileSession(object):
+    """
+    Profiles one handler invocation, split into stages.
+
+    Each stage has its own cProfile profiler, so time spent in a nested
+    stage is not counted again in the enclosing one. Memory is traced with
+    tracemalloc: the peak traced size while the stage ran, and the
+    allocation sites that grew the most between entering and leaving it.
+
+    Args:
+        name (str): handler name, the outermost stage
+        top (int): number of functions and allocation sites reported per stage
+    """
+
+    def __init__(self, name, top=DEFAULT_TOP):
+        self.name = name
+        self.top = top
+        self.stages = {}
+        self.stack = []
+        self.started = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def enter(self, name):
+        if self.stack:
+            parent = self.stack[-1]
+            parent.profiler.disable()
+            parent.peak_bytes = max(parent.peak_bytes, tracemalloc.get_traced_memory()[1])
+
+        stage = self.stages.setdefault(name, StageProfile(name))
+        stage.calls += 1
+        stage.snapshot = tracemalloc.take_snapshot()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        self.stack.append(stage)
+        stage.start = time.perf_counter()
+        stage.profiler.enable()
+
+    def exit(self):
+        stage = self.stack.pop()
+        stage.profiler.disable()
+        stage.seconds += time.perf_counter() - stage.start
+        stage.peak_bytes = max(stage.peak_bytes, tracemalloc.get_traced_memory()[1])
+
+        for diff in tracemalloc.take_snapshot().compare_to(stage.snapshot, 'lineno'):
+            if diff.size_diff <= 0:
+                continue
+            frame = diff.traceback[0]
+            site = f"{frame.filename}:{frame.lineno}"
+            size, count = stage.allocations.get(site, (0, 0))
+            stage.allocations[site] = (size + diff.size_diff, count + diff.count_diff)
+        stage.snapshot = None
+
+        if self.stack:
+            parent = self.stack[-1]
+            parent.peak_bytes = max(parent.peak_bytes, stage.peak_bytes)
+            parent.profiler.enable()
+
+    def report(self, request_id):
+        return {
+            'handler': self.name,
+            'request_id': request_id,
+            'started': self.started,
+            'stages': dict((name, stage.to_dict(self.top)) for name, stage in self.stages.items()),
+        }
+
+
+@contextlib.contextmanager
+def _profile_stage(name):
+    _session.enter(name)
+    try:
+        yield
+    finally:
+        _session.exit()
+
+
+def stage(name):
+    """Profile the body of a with block as a stage of the active session; a no-op otherwise"""
+    if _session is None:
+        return _NO_STAGE
+    return _profile_stage(name)
+
+
+def write_report(report, s3_client=None):
+    """Write a profile report to PROFILE_S3_URI, or to PROFILE_DIR locally
+
+    Returns:
+        str: s3 uri or path of the report
+    """
+    filename = "{}/{}.json".format(report['handler'], report['request_id'])
+    body = json.dumps(report, indent=2)
+
+    s3_uri = os.environ.get(PROFILE_S3_URI_ENV, "")
+    if s3_uri:
+        if s3_client is None:
+            import aws_clients
+            s3_client = aws_clients.s3()
+        bucket_name, prefix, _ = utils.split_s3_url(s3_uri.rstrip("/") + "/" + filename)
+        s3_client.put_object(Bucket=bucket_name, Key=prefix, Body=body.encode('utf-8'),
+                             ContentType='application/json')
+        return utils.make_s3_uri(bucket_name, prefix)
+
+    path = os.path.join(os.environ.get(PROFILE_DIR_ENV, "") or DEFAULT_PROFILE_DIR, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(body)
+    return path
+
+
+def profiled(name):
+    """Decorate a Lambda handler so invocations flagged for profiling run under a ProfileSession
+
+    Handlers not flagged are called directly. The report is written when the
+    handler returns or raises, tagged with the Lambda request id. Either way
+    queued log records are flushed before returning (utils.flush_logs).
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            global _session
+            if _session is not None or not is_enabled(event):
+                return handler(event, context)
+
+            logger = logging.getLogger(__name__)
+            request_id = getattr(context, 'aws_request_id', '') or utils.make_unique_id()
+            top = int(os.environ.get("PROFILE_TOP", "") or DEFAULT_TOP)
+
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            _session = ProfileSession(name, top=top)
+            try:
+                with stage(name):
+                    return handler(event, context)
+            finally:
+                session, _session = _session, None
+                if started_tracing:
+                    tracemalloc.stop()
+                try:
+                    location = write_report(session.report(request_id))
+                    logger.info(f"profile of {name} written to: {location}")
+                except Exception:
+                    logger.exception(f"failed to write the profile of {name}")
+
+        ## queued log records, the report's and the EMF metrics among them, are written before returning
+        return utils.flushing_logs(wrapper)
+    return decorator
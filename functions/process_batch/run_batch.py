@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+Run the process_batch enrichment outside Lambda.
+
+Reads a local or s3 delta file, shards the records across a pool of worker
+processes that each build their own FDAAPI from the metadata folder, and
+writes the payloads to the selected output sink.
+
+Example:
+    python run_batch.py --delta data/deltafile.csv --metadata data/metadata \\
+        --sink file --output /tmp/fda.jsonl.gz --workers 4
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import multiprocessing
+
+import utils
+import delta_file
+import output_sinks
+from fda_api import FDAAPI
+
+## FDAAPI of the worker process, built once by init_worker
+WORKER_API = None
+
+
+def is_s3_path(path):
+    return path.startswith("s3://")
+
+
+def init_worker(metadata_loc):
+    global WORKER_API
+    utils.load_log_config()
+
+    kwargs = {} if is_s3_path(metadata_loc) else {'test': True}
+    WORKER_API = FDAAPI(S3_metadata_loc=metadata_loc, **kwargs)
+
+
+def enrich_chunk(records):
+    """Enrich one shard of delta records in a worker process
+
+    Args:
+        records (list): delta records
+
+    Returns:
+        tuple: (payloads, number of records that failed)
+    """
+    records, unresolved = WORKER_API.resolve_records(records)
+    payloads = []
+    failed = len(unresolved)
+    for record in records:
+        try:
+            payloads.append(WORKER_API.format_record(record))
+        except ValueError:
+            logging.exception(f"failed to enrich record: {record.get('s3_path', '')}")
+            failed += 1
+
+    return (payloads, failed)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Enrich an FDA delta file outside Lambda")
+    parser.add_argument("--delta", required=True, help="local path or s3 url of the delta csv")
+    parser.add_argument("--metadata", required=True, help="local folder or s3 url of the FDA metadata files")
+    parser.add_argument("--sink", default=output_sinks.NULL_SINK,
+                        choices=[output_sinks.EVENTBRIDGE_SINK, output_sinks.S3_SINK,
+                                 output_sinks.FILE_SINK, output_sinks.NULL_SINK],
+                        help="output sink (default: null)")
+    parser.add_argument("--output", default="", help="output file path (file sink) or s3 url (s3 sink)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: cpu count)")
+    parser.add_argument("--chunk-size", type=int, default=100, help="records per shard (default: 100)")
+    parser.add_argument("--log-payloads", action="store_true", help="log every payload")
+    return parser.parse_args(argv)
+
+
+def run(args):
+    """Enrich the delta file and write the payloads to the sink
+
+    Returns:
+        dict: run statistics
+    """
+    logger = logging.getLogger(__name__)
+
+    records = delta_file.load_local_records(args.delta, is_local=not is_s3_path(args.delta))
+    shards = delta_file.chunk_records(records, args.chunk_size)
+    workers = max(1, min(args.workers, len(shards)))
+    logger.info(f"{len(records)} records in {len(shards)} shards, {workers} workers")
+
+    parameters = {
+        'output_sink': args.sink,
+        'output_file_path': args.output,
+        'output_s3_uri': args.output,
+        'log_payloads': "true" if args.log_payloads else "false"
+    }
+    sink = output_sinks.get_output_sink(utils.load_osenv(), parameters)
+
+    start = time.time()
+    failed = 0
+    with sink:
+        if workers == 1:
+            init_worker(args.metadata)
+            results = map(enrich_chunk, shards)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=(args.metadata,))
+            results = pool.imap_unordered(enrich_chunk, shards)
+
+        try:
+            for payloads, shard_failed in results:
+                for payload in payloads:
+                    sink.write(payload)
+                sink.flush()
+                failed += shard_failed
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    elapsed = time.time() - start
+    stats = {
+        'records': len(records),
+        'written': sink.records_written,
+        'failed': failed,
+        'workers': workers,
+        'seconds': round(elapsed, 3),
+        'records_per_second': round(sink.records_written / elapsed, 2) if elapsed > 0 else 0.0
+    }
+    logger.info(f"run complete: {stats}")
+    return stats
+
+
+def main(argv=None):
+    utils.load_log_config()
+    stats = run(parse_args(argv))
+    print("{written} records written ({failed} failed) in {seconds}s: {records_per_second} records/sec "
+          "with {workers} workers".format(**stats))
+    return 0 if stats['failed'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
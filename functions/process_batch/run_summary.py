@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+import json
+import logging
+
+import utils
+
+## bounds of a summary, so it stays the same size however many chunks and records a run has
+DEFAULT_TOP_CHUNKS = 5
+DEFAULT_FAILED_KEYS_SAMPLE = 10
+DEFAULT_ERRORS_SAMPLE = 3
+MAX_ERROR_LENGTH = 500
+
+## SNS subjects must be shorter than 100 characters
+MAX_SUBJECT_LENGTH = 99
+
+## full per chunk detail is written under RUN_SUMMARY_S3_URI/<run id>/ when set
+RUN_SUMMARY_S3_URI_ENV = "RUN_SUMMARY_S3_URI"
+
+## per stage values of StageMetrics.summary that can be added up across chunks
+MERGED_STAGE_VALUES = ('count', 'sum_ms', 'max_ms')
+
+logger = logging.getLogger(__name__)
+
+
+def record_key(record):
+    """Key of a delta record in summaries: application/submission:s3 path"""
+    return "{}/{}:{}".format(record.get('application_no', ''), record.get('submission_no', ''),
+                             record.get('s3_path', ''))
+
+
+def truncate(text, length):
+    text = str(text)
+    return text if len(text) <= length else text[:length - 3] + "..."
+
+
+class RunSummary(object):
+    """
+    Constant size summary of a run, built up as its chunks complete.
+
+    Keeps counts by outcome, per stage timings (count, sum and max, which
+    add up across chunks), the slowest chunks, a sample of failed record
+    keys and errors, and pointers to the full detail in S3. Summaries of
+    chunks merge in any order, so they can be combined one chunk at a time
+    or all at once from the output of a Map state.
+
+    Args:
+        top_chunks (int): slowest chunks kept
+        failed_keys_sample (int): failed record keys kept
+    """
+
+    def __init__(self, top_chunks=DEFAULT_TOP_CHUNKS, failed_keys_sample=DEFAULT_FAILED_KEYS_SAMPLE):
+        self.top_chunks = top_chunks
+        self.failed_keys_sample = failed_keys_sample
+        self.outcomes = {}
+        self.stages = {}
+        self.slowest_chunks = []
+        self.failed_keys = []
+        self.errors = []
+        self.details = {}
+
+    def count(self, outcome, value=1):
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + value
+
+    def add_stage(self, stage, count, sum_ms, max_ms):
+        timing = self.stages.setdefault(stage, {'count': 0, 'sum_ms': 0.0, 'max_ms': 0.0})
+        timing['count'] += count
+        timing['sum_ms'] = round(timing['sum_ms'] + sum_ms, 3)
+        timing['max_ms'] = max(timing['max_ms'], max_ms)
+
+    def add_stage_metrics(self, values):
+        """Add a StageMetrics.summary(): stage timings, and counters as outcomes"""
+        stages = {}
+        for name, (value, _) in values.items():
+            stage, _, field = name.rpartition('.')
+            if stage and field in MERGED_STAGE_VALUES:
+                stages.setdefault(stage, {})[field] = value
+            elif not stage:
+                self.count(name, value)
+
+        for stage, timing in stages.items():
+            self.add_stage(stage, timing.get('count', 0), timing.get('sum_ms', 0.0), timing.get('max_ms', 0.0))
+
+    def add_chunk(self, chunk, seconds, records):
+        """Record a completed chunk, keeping it if it is one of the slowest"""
+        self.count('chunks_completed')
+        self.slowest_chunks.append({'chunk': chunk, 'seconds': round(seconds, 3), 'records': records})
+        self.slowest_chunks = sorted(self.slowest_chunks, key=lambda c: -c['seconds'])[:self.top_chunks]
+
+    def add_failed_keys(self, keys):
+        keys = list(keys)
+        self.count('records_failed', len(keys))
+        room = self.failed_keys_sample - len(self.failed_keys)
+        if room > 0:
+            self.failed_keys.extend(keys[:room])
+
+    def add_error(self, error):
+        if len(self.errors) < DEFAULT_ERRORS_SAMPLE:
+            self.errors.append(truncate(error, MAX_ERROR_LENGTH))
+
+    def merge(self, other):
+        for outcome, value in other.outcomes.items():
+            self.count(outcome, value)
+        for stage, timing in other.stages.items():
+            self.add_stage(stage, timing['count'], timing['sum_ms'], timing['max_ms'])
+        self.slowest_chunks = sorted(self.slowest_chunks + other.slowest_chunks,
+                                     key=lambda c: -c['seconds'])[:self.top_chunks]
+        room = self.failed_keys_sample - len(self.failed_keys)
+        if room > 0:
+            self.failed_keys.extend(other.failed_keys[:room])
+        for error in other.errors:
+            self.add_error(error)
+        for name, uri in other.details.items():
+            self.details.setdefault(name, uri)
+        return self
+
+    def to_dict(self):
+        return {
+            'outcomes': dict(self.outcomes),
+            'stages': dict((stage, dict(timing)) for stage, timing in self.stages.items()),
+            'slowest_chunks': list(self.slowest_chunks),
+            'failed_keys_sample': list(self.failed_keys),
+            'errors_sample': list(self.errors),
+            'details': dict(self.details),
+        }
+
+    @classmethod
+    def from_dict(cls, data, **kwargs):
+        summary = cls(**kwargs)
+        if data:
+            other = cls(**kwargs)
+            other.outcomes = dict(data.get('outcomes', {}))
+            other.stages = dict((stage, dict(timing)) for stage, timing in data.get('stages', {}).items())
+            other.slowest_chunks = list(data.get('slowest_chunks', []))
+            other.failed_keys = list(data.get('failed_keys_sample', []))
+            other.errors = list(data.get('errors_sample', []))
+            other.details = dict(data.get('details', {}))
+            summary.merge(other)
+        return summary
+
+
+def write_detail(detail, s3_uri, run_id, name, s3_client=None):
+    """Write the full detail of a chunk under <s3_uri>/<run id>/
+
+    Args:
+        s3_uri (str): the RUN_SUMMARY_S3_URI setting; nothing is written when empty
+
+    Returns:
+        str: s3 uri of the run's detail prefix, or None when s3_uri is not set
+    """
+    if not s3_uri:
+        return None
+
+    if s3_client is None:
+        import aws_clients
+        s3_client = aws_clients.s3()
+
+    prefix = "{}/{}/".format(s3_uri.rstrip("/"), run_id)
+    bucket_name, key, _ = utils.split_s3_url(prefix + name + ".json")
+    s3_client.put_object(Bucket=bucket_name, Key=key, Body=json.dumps(detail, default=str).encode('utf-8'),
+                         ContentType='application/json')
+    return prefix
+
+
+def summarize_results(results):
+    """Merge the outputs of a run's chunks into one summary
+
+    Args:
+        results (list): chunk outputs, each a process_batch result with a
+            `run_summary`, or a caught error ({"Error", "Cause"})
+
+    Returns:
+        RunSummary
+    """
+    summary = RunSummary()
+    for result in results:
+        if not isinstance(result, dict):
+            continue
+        if 'run_summary' in result:
+            summary.merge(RunSummary.from_dict(result['run_summary']))
+        error = result['error'] if isinstance(result.get('error'), dict) else result
+        if 'Error' in error:
+            summary.count('chunks_failed')
+            summary.add_error("{}: {}".format(error.get('Error', ''), error.get('Cause', '')))
+    return summary
+
+
+def notification_subject(prefix, event):
+    """SNS subject naming the run's delta file, cut to the SNS limit"""
+    parameters = event.get('parameters') or {}
+    delta_file_path = event.get('s3_delta_file_path') or parameters.get('s3_delta_file_path', '')
+    return truncate(prefix + delta_file_path, MAX_SUBJECT_LENGTH)
+
+
+def notification_message(event):
+    """Compact notification body: where the run came from and its summary, never its records"""
+    parameters = event.get('parameters') or {}
+    stats = dict((event.get('fda') or {}).get('process_batch_stats') or event.get('process_batch_stats') or {})
+
+    summary = RunSummary.from_dict(event.get('run_summary'))
+    if 'error' in event:
+        summary.merge(summarize_results([{'error': event['error']}]))
+
+    message = {
+        'run_id': event.get('run_id', ''),
+        'stage': parameters.get('stage', ''),
+        's3_delta_file_path': event.get('s3_delta_file_path') or parameters.get('s3_delta_file_path', ''),
+        's3_metadata_file_path': event.get('s3_metadata_file_path') or parameters.get('s3_metadata_file_path', ''),
+        'number_of_records_to_process': stats.get('number_of_records_to_process'),
+        'delta_validation': stats.get('delta_validation'),
+        'process_batch_start_timestamp': stats.get('process_batch_start_timestamp'),
+        'run_summary': summary.to_dict(),
+    }
+    return json.dumps(message, indent=2, default=str)
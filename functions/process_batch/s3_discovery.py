@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+import logging
+import threading
+
+import utils
+import aws_clients
+
+## concurrent listings; each one paginates sequentially
+DEFAULT_LISTING_WORKERS = 16
+
+
+class S3Discovery(object):
+    """
+    Lists S3 prefixes on a bounded thread pool, caching each listing.
+
+    One instance is used per invocation, so a prefix listed twice (the same
+    cfm folder in several delta rows, or a retried discovery) costs one
+    listing, and nothing is served stale across invocations.
+
+    Args:
+        s3_client (optional): boto3 s3 client
+        workers (int): maximum number of concurrent listings
+    """
+
+    def __init__(self, s3_client=None, workers=DEFAULT_LISTING_WORKERS):
+        self.client = s3_client if s3_client is not None else aws_clients.s3()
+        self.workers = max(int(workers), 1)
+        self.listings = {}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def list_prefix(self, bucket, prefix):
+        """Every key under a prefix, following continuation tokens"""
+        with self.lock:
+            keys = self.listings.get((bucket, prefix))
+        if keys is not None:
+            return keys
+
+        keys = []
+        kwargs = {'Bucket': bucket, 'Prefix': prefix}
+        while True:
+            response = self.client.list_objects_v2(**kwargs)
+            keys.extend(obj['Key'] for obj in response.get('Contents', []))
+            if not response.get('IsTruncated'):
+                break
+            kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+        with self.lock:
+            self.listings[(bucket, prefix)] = keys
+        return keys
+
+    def list_keys(self, bucket, prefix, suffix=''):
+        """Keys under a prefix ending with suffix, or one of a tuple of suffixes (compared case-insensitively)"""
+        suffix = suffix.lower() if isinstance(suffix, str) else tuple(item.lower() for item in suffix)
+        return [key for key in self.list_prefix(bucket, prefix) if key.lower().endswith(suffix)]
+
+    def list_many(self, listings):
+        """Run list_keys for several (bucket, prefix, suffix) tuples concurrently
+
+        Returns:
+            list: the keys of every listing, in the order given
+        """
+        listings = list(listings)
+        if len(listings) <= 1 or self.workers == 1:
+            return [self.list_keys(*listing) for listing in listings]
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(listings)),
+                                thread_name_prefix="s3-list") as executor:
+            futures = [executor.submit(self.list_keys, *listing) for listing in listings]
+            return [future.result() for future in futures]
+
+    def expand_cfm_rows(self, rows, is_cfm_folder):
+        """Replace every cfm folder row by one row per pdf inside it
+
+        Args:
+            rows (list): delta rows, with an `s3_path`
+            is_cfm_folder (callable): whether a row is a cfm folder
+
+        Returns:
+            list: rows in their original order, cfm folders expanded in place
+        """
+        def folder(row):
+            bucket_name, key, _ = utils.split_s3_url(row['s3_path'])
+            return (bucket_name, key.rstrip("/") + "/", ".pdf")
+
+        ## each folder is listed once, however many rows point at it
+        folders = list(dict.fromkeys(folder(row) for row in rows if is_cfm_folder(row)))
+        listings = dict(zip(folders, self.list_many(folders)))
+
+        expanded = []
+        for row in rows:
+            if not is_cfm_folder(row):
+                expanded.append(row)
+                continue
+
+            bucket_name, prefix, suffix = folder(row)
+            pdfs = listings[(bucket_name, prefix, suffix)]
+            if not pdfs:
+                self.logger.warning("no pdfs found in the cfm folder: %s", row['s3_path'])
+            for key in pdfs:
+                new_row = row.copy()
+                new_row['s3_path'] = utils.make_s3_uri(bucket_name, key)
+                expanded.append(new_row)
+
+        return expanded
@@ -0,0 +1,174 @@
+#! /usr/bin/env python3
+
+import warnings
+from datetime import datetime
+from urllib.parse import unquote_plus
+
+import utils
+import metrics
+import aws_clients
+import profiling
+import s3_discovery
+import backfill
+import load_parameters
+
+warnings.filterwarnings("ignore")
+
+# Initialize globals
+logger = utils.load_log_config()
+
+## shared with load_parameters, so Parameter Store values reach start_batch
+configuration = load_parameters.configuration
+
+## execution names are unique per state machine, so a partition is started once
+EXECUTION_NAME_FORMAT = "process-batch-{}"
+
+## trigger outcomes, per partition
+STARTED = "started"
+WAITING = "waiting"
+DUPLICATE = "duplicate"
+
+
+@profiling.profiled('s3_trigger')
+def handler(event, context):
+    """
+    Start the state machine when an object-created notification completes a partition.
+
+    Every delta and metadata file written to `<prefix>/YYYY/MM/DD/` invokes
+    the trigger; it waits (returns without starting anything) until the
+    partition has its delta file and all NUM_METADATA_FILES metadata files,
+    so only the notifications arriving after the last file start an
+    execution. Those racing notifications claim the partition with a
+    conditional put to TRIGGER_TABLE_NAME and start the execution under a
+    name derived from the date, so exactly one of them starts it.
+
+    Accepts S3 event notifications and EventBridge "Object Created" events.
+    """
+    configuration.update(utils.load_ssm_parameters())
+
+    stage_metrics = metrics.get_stage_metrics(configuration, configuration.get("STAGE", "dev"))
+    try:
+        return trigger_partitions(event, stage_metrics)
+    finally:
+        stage_metrics.emit()
+
+
+def trigger_partitions(event, stage_metrics):
+    delta_prefix = configuration.get("DELTA_FILE_PATH", "")
+    metadata_prefix = configuration.get("METADATA_FILE_PATH", "")
+
+    partitions = []
+    for bucket_name, key in object_keys(event):
+        partition_date = partition_of(key, delta_prefix, metadata_prefix)
+        if partition_date is None:
+            logger.info("ignoring object outside the delta and metadata partitions: s3://%s/%s", bucket_name, key)
+        elif partition_date not in partitions:
+            partitions.append(partition_date)
+
+    discovery = s3_discovery.S3Discovery(workers=configuration.get("S3_LISTING_WORKERS", "") or
+                                         s3_discovery.DEFAULT_LISTING_WORKERS)
+
+    results = {}
+    for partition_date in partitions:
+        with stage_metrics.timer('trigger_partition'):
+            outcome = trigger_partition(partition_date, discovery, stage_metrics)
+        stage_metrics.count(f"partitions_{outcome}")
+        results[partition_date] = outcome
+
+    return {'partitions': results}
+
+
+def trigger_partition(partition_date, discovery, stage_metrics):
+    """Start the partition's execution once it is complete and not claimed
+
+    Returns:
+        str: STARTED, WAITING or DUPLICATE
+    """
+    ready, paths = load_parameters.validate_get_paths(
+        configuration.get("DELTA_FILE_PATH", ""), configuration.get("METADATA_FILE_PATH", ""),
+        discovery=discovery, partition_date=datetime.strptime(partition_date, load_parameters.PARTITION_DATE_FORMAT))
+    if not ready:
+        logger.info("partition %s is not complete: %s", partition_date, paths)
+        return WAITING
+
+    name = EXECUTION_NAME_FORMAT.format(partition_date)
+    table_name = configuration.get("TRIGGER_TABLE_NAME", "")
+    if table_name and not claim_partition(table_name, name):
+        logger.info("partition %s was already claimed", partition_date)
+        return DUPLICATE
+
+    from botocore.exceptions import ClientError
+
+    try:
+        event = load_parameters.start_batch({'partition_date': partition_date, 'execution_name': name},
+                                            stage_metrics, discovery=discovery)
+    except Exception as e:
+        if isinstance(e, ClientError) and e.response['Error']['Code'] == 'ExecutionAlreadyExists':
+            logger.info("execution %s was already started", name)
+            return DUPLICATE
+        ## let a later notification or a retry start the partition
+        if table_name:
+            release_partition(table_name, name)
+        raise
+
+    if table_name:
+        record_execution(table_name, name, event.get('execution_arn', ''))
+    logger.info("started execution %s for partition %s", name, partition_date)
+    return STARTED
+
+
+def object_keys(event):
+    """(bucket, key) of every object in an S3 notification or EventBridge event"""
+    for record in event.get('Records', []):
+        if 's3' in record:
+            yield (record['s3']['bucket']['name'], unquote_plus(record['s3']['object']['key']))
+
+    detail = event.get('detail') or {}
+    if 'bucket' in detail and 'object' in detail:
+        yield (detail['bucket']['name'], detail['object']['key'])
+
+
+def partition_of(key, delta_prefix, metadata_prefix):
+    """Day (YYYY-MM-DD) of a key under `<delta or metadata prefix>/YYYY/MM/DD/`
+
+    Returns:
+        str: or None for keys outside both prefixes
+    """
+    for prefix in (delta_prefix, metadata_prefix):
+        partition_date = backfill.partition_date_of(key, prefix)
+        if partition_date is not None:
+            return partition_date.strftime(backfill.DATE_FORMAT)
+    return None
+
+
+def claim_partition(table_name, name):
+    """Conditionally create the partition's item; False when another trigger created it first"""
+    from botocore.exceptions import ClientError
+
+    try:
+        aws_clients.dynamodb().put_item(
+            TableName=table_name,
+            Item={'id': {'S': name}, 'status': {'S': 'starting'},
+                  'claimed_at': {'S': datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")}},
+            ConditionExpression="attribute_not_exists(id)")
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+    return True
+
+
+def record_execution(table_name, name, execution_arn):
+    aws_clients.dynamodb().update_item(
+        TableName=table_name,
+        Key={'id': {'S': name}},
+        UpdateExpression="SET #status = :status, execution_arn = :arn",
+        ExpressionAttributeNames={'#status': 'status'},
+        ExpressionAttributeValues={':status': {'S': STARTED}, ':arn': {'S': execution_arn}})
+
+
+def release_partition(table_name, name):
+    try:
+        aws_clients.dynamodb().delete_item(TableName=table_name, Key={'id': {'S': name}})
+    except Exception:
+        logger.exception("failed to release the claim on %s", name)
@@ -0,0 +1,39 @@
+#! /usr/bin/env python3
+
+import utils
+import run_summary
+
+# Initialize globals
+logger = utils.load_log_config()
+
+
+@utils.flushing_logs
+def handler(event, context):
+    """
+    Reduce the results of a run's chunks into one compact event for the notifications.
+
+    Runs after the state that processes the chunks. Accepts the output of a
+    Map state over the chunks (a list of process_batch results or caught
+    errors), or the run event with those results under `results`. The
+    returned event keeps the run's parameters and stats and its merged
+    `run_summary`, without the chunks of delta records.
+    """
+    if isinstance(event, list):
+        results = event
+        run = next((result for result in results if isinstance(result, dict) and 'parameters' in result), {})
+    else:
+        ## the run event itself may carry a summary or a caught error
+        results = list(event.get('results', [])) + [event]
+        run = event
+
+    summary = run_summary.summarize_results(results)
+
+    compact = dict((key, value) for key, value in run.items()
+                   if key not in ('results', 'chunks', 'fda', 'run_summary', 'error'))
+    stats = (run.get('fda') or {}).get('process_batch_stats') or run.get('process_batch_stats')
+    if stats is not None:
+        compact['process_batch_stats'] = stats
+    compact['run_summary'] = summary.to_dict()
+
+    logger.info("run summary", extra={'run_summary': compact['run_summary']})
+    return compact
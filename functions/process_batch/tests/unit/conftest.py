@@ -6,6 +6,8 @@ import boto3
 from moto import mock_stepfunctions, mock_s3, mock_sns
 import pytest
 
+import aws_clients
+
 
 @pytest.fixture(scope='module')
 def aws_credentials():
@@ -40,3 +42,34 @@ def stepfunctions_client(aws_credentials):
         conn = boto3.client("stepfunctions", region_name='us-east-2')
 
 
+class RecordingEventsClient(object):
+    """events client stand-in that records put_events requests"""
+
+    def __init__(self):
+        self.requests = []
+
+    def put_events(self, Entries):
+        self.requests.append(Entries)
+        return {'FailedEntryCount': 0, 'Entries': [{'EventId': str(i)} for i in range(len(Entries))]}
+
+
+@pytest.fixture()
+def events_client():
+    return RecordingEventsClient()
+
+
+@pytest.fixture()
+def s3(request):
+    """
+    s3 mock client with the test module's BUCKET created
+
+    The aws_clients registry is reset around the test, so code under test
+    builds its clients inside the mock.
+    """
+    with mock_s3():
+        aws_clients.reset()
+        client = boto3.client('s3', region_name='us-east-2')
+        client.create_bucket(Bucket=request.module.BUCKET,
+                             CreateBucketConfiguration={'LocationConstraint': 'us-east-2'})
+        yield client
+        aws_clients.reset()
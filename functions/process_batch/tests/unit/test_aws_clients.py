@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import aws_clients
+
+
+def test_clients_are_shared_and_configured(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-2")
+    monkeypatch.setenv("AWS_MAX_POOL_CONNECTIONS", "17")
+    aws_clients.reset()
+
+    s3 = aws_clients.s3()
+
+    assert aws_clients.get_client(aws_clients.S3) is s3
+    assert aws_clients.events() is not s3
+    assert s3.meta.config.max_pool_connections == 17
+    assert s3.meta.config.retries['mode'] == aws_clients.DEFAULT_RETRY_MODE
+
+    aws_clients.reset()
+    assert aws_clients.s3() is not s3
+
+
+def test_client_config_reads_settings():
+    config = aws_clients.client_config({"AWS_RETRY_MODE": "standard", "AWS_READ_TIMEOUT": "3"})
+
+    assert config.retries == {'mode': 'standard', 'max_attempts': aws_clients.DEFAULT_MAX_ATTEMPTS}
+    assert config.read_timeout == 3
+    assert config.max_pool_connections == aws_clients.DEFAULT_MAX_POOL_CONNECTIONS
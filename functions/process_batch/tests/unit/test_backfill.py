@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import json
+from datetime import date
+
+import boto3
+import pytest
+from moto import mock_s3, mock_stepfunctions
+
+import aws_clients
+import backfill
+import claim_check
+import load_parameters
+
+BUCKET = "backfill-test"
+DELTA = "mdit/fda/delta"
+METADATA = "mdit/fda/metadata"
+DELTA_LINES = [
+    "ApplicationDocsTypeID,ApplNo,SubmissionType,SubmissionNo,ApplicationDocsURL,DrugName,S3Path",
+    "1,4782,SUPPL,125,http://www.accessdata.fda.gov/4782.pdf,PREMARIN,s3://raw/premarin/4782/suppl/125/",
+    "1,5378,SUPPL,30,http://www.accessdata.fda.gov/5378.pdf,DESOXYN,s3://raw/desoxyn/5378/suppl/30/",
+]
+
+
+def day(n):
+    return date(2020, 9, n)
+
+
+def test_partition_date_of():
+    assert backfill.partition_date_of(f"{METADATA}/2020/09/02/Products.txt", METADATA + "/") == day(2)
+    assert backfill.partition_date_of(f"{METADATA}/2020/13/02/Products.txt", METADATA) is None
+    assert backfill.partition_date_of(f"{DELTA}/2020/09/02/deltafile.csv", METADATA) is None
+
+
+def test_days_are_grouped_by_the_latest_earlier_snapshot():
+    partitions = dict((day(n), f"delta/{n}.csv") for n in [1, 2, 3, 5, 6, 7, 8])
+    snapshots = [day(2), day(6)]
+
+    groups, unmatched = backfill.group_by_snapshot(partitions, snapshots, max_days=3)
+
+    assert unmatched == [day(1)]
+    assert [(group['snapshot'], group['days']) for group in groups] == [
+        (day(2), [day(2), day(3), day(5)]),
+        (day(6), [day(6), day(7), day(8)])]
+    assert groups[0]['delta_keys'] == ["delta/2.csv", "delta/3.csv", "delta/5.csv"]
+
+    groups, _ = backfill.group_by_snapshot(partitions, snapshots, max_days=2)
+    assert [group['days'] for group in groups] == [[day(2), day(3)], [day(5)], [day(6), day(7)], [day(8)]]
+
+
+def test_schedule_bounds_running_executions():
+    groups, _ = backfill.group_by_snapshot(dict((day(n), "") for n in range(1, 6)), [day(1)], max_days=1)
+    names = [backfill.execution_name(group) for group in groups]
+    assert names[0] == "process-batch-backfill-2020-09-01-2020-09-01-2020-09-01"
+
+    to_start, pending, started = backfill.schedule(groups, {names[0]: 'RUNNING'}, max_concurrency=3)
+
+    assert started == groups[:1]
+    assert to_start == groups[1:3]
+    assert pending == groups[3:]
+
+    ## finished executions are not started again and do not take a slot
+    to_start, pending, started = backfill.schedule(
+        groups, {names[0]: 'SUCCEEDED', names[1]: 'FAILED', names[2]: 'RUNNING'}, max_concurrency=2)
+
+    assert started == groups[:3]
+    assert to_start == groups[3:4]
+    assert pending == groups[4:]
+
+
+@pytest.fixture()
+def aws(monkeypatch):
+    ## the code under test builds its clients through aws_clients, in the ambient region
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-2')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with mock_s3(), mock_stepfunctions():
+        aws_clients.reset()
+        s3 = boto3.client('s3', region_name='us-east-2')
+        s3.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': 'us-east-2'})
+        sfn = boto3.client('stepfunctions', region_name='us-east-2')
+        state_machine = sfn.create_state_machine(
+            name="process-batch", definition=json.dumps({"StartAt": "Done", "States": {"Done": {"Type": "Succeed"}}}),
+            roleArn="arn:aws:iam::123456789012:role/process-batch")
+
+        for key, value in [("BUCKET_NAME", BUCKET), ("DELTA_FILE_PATH", DELTA), ("METADATA_FILE_PATH", METADATA),
+                           ("NUM_METADATA_FILES", "2"), ("DEFAULT_CHUNK_SIZE", "3"),
+                           ("STATE_MACHINE_ARN", state_machine['stateMachineArn'])]:
+            monkeypatch.setitem(load_parameters.configuration, key, value)
+        yield s3, sfn, state_machine['stateMachineArn']
+        aws_clients.reset()
+
+
+def test_backfill_starts_one_execution_per_snapshot(aws):
+    s3, sfn, arn = aws
+    ## metadata dropped on the last day of August and on the 4th; the 3rd has an incomplete snapshot
+    for partition in ["2020/08/31", "2020/09/04"]:
+        for name in ["Products.txt", "Submissions.txt"]:
+            s3.put_object(Bucket=BUCKET, Key=f"{METADATA}/{partition}/{name}", Body=b"")
+    s3.put_object(Bucket=BUCKET, Key=f"{METADATA}/2020/09/03/Products.txt", Body=b"")
+    for n in [1, 2, 3, 4, 6]:
+        s3.put_object(Bucket=BUCKET, Key=f"{DELTA}/2020/09/{n:02d}/deltafile.csv",
+                      Body="\n".join(DELTA_LINES).encode())
+
+    result = load_parameters.handler({'backfill': {'start': "2020-09-01", 'end': "2020-09-07"}}, None)
+
+    assert [(execution['snapshot'], execution['partition_dates'], execution['status'])
+            for execution in result['executions']] == [
+        ("2020-08-31", ["2020-09-01", "2020-09-02", "2020-09-03"], "started"),
+        ("2020-09-04", ["2020-09-04", "2020-09-06"], "started")]
+
+    executions = sfn.list_executions(stateMachineArn=arn)['executions']
+    assert len(executions) == 2
+    first = [execution for execution in executions if execution['name'] == result['executions'][0]['execution_name']]
+    execution_input = json.loads(sfn.describe_execution(executionArn=first[0]['executionArn'])['input'])
+    assert execution_input['parameters']['s3_metadata_file_path'] == f"s3://{BUCKET}/{METADATA}/2020/08/31"
+    assert len(execution_input['parameters']['s3_delta_file_paths']) == 3
+    assert execution_input['fda']['process_batch_stats']['number_of_records_to_process'] == 6
+    assert [len(chunk) for chunk in execution_input['fda']['chunks']] == [3, 3]
+
+
+def test_backfill_respects_max_concurrency(aws):
+    s3, sfn, arn = aws
+    for name in ["Products.txt", "Submissions.txt"]:
+        s3.put_object(Bucket=BUCKET, Key=f"{METADATA}/2020/09/01/{name}", Body=b"")
+    for n in [1, 2, 3]:
+        s3.put_object(Bucket=BUCKET, Key=f"{DELTA}/2020/09/{n:02d}/deltafile.csv",
+                      Body="\n".join(DELTA_LINES).encode())
+    event = {'backfill': {'start': "2020-09-01", 'end': "2020-09-03",
+                          'max_concurrency': 2, 'max_days_per_execution': 1}}
+
+    result = load_parameters.handler(dict(event), None)
+
+    assert [execution['status'] for execution in result['executions']] == ["started", "started", "pending"]
+    assert len(sfn.list_executions(stateMachineArn=arn)['executions']) == 2
+
+    ## invoking the backfill again while both executions run starts nothing more
+    result = load_parameters.handler(dict(event), None)
+
+    assert [execution['status'] for execution in result['executions']] == ["running", "running", "pending"]
+    assert len(sfn.list_executions(stateMachineArn=arn)['executions']) == 2
+
+
+def test_backfill_resumes_after_executions_finish(aws):
+    s3, sfn, arn = aws
+    for name in ["Products.txt", "Submissions.txt"]:
+        s3.put_object(Bucket=BUCKET, Key=f"{METADATA}/2020/09/01/{name}", Body=b"")
+    for n in [1, 2, 3]:
+        s3.put_object(Bucket=BUCKET, Key=f"{DELTA}/2020/09/{n:02d}/deltafile.csv",
+                      Body="\n".join(DELTA_LINES).encode())
+    event = {'backfill': {'start': "2020-09-01", 'end': "2020-09-03",
+                          'max_concurrency': 2, 'max_days_per_execution': 1}}
+
+    load_parameters.handler(dict(event), None)
+    for execution in sfn.list_executions(stateMachineArn=arn)['executions']:
+        sfn.stop_execution(executionArn=execution['executionArn'])
+
+    ## the groups that finished free their slots for the one left pending
+    result = load_parameters.handler(dict(event), None)
+
+    assert [execution['status'] for execution in result['executions']] == ["aborted", "aborted", "started"]
+    assert len(sfn.list_executions(stateMachineArn=arn)['executions']) == 3
+
+
+def test_groups_that_fail_to_start_are_retried_by_the_next_run(aws, monkeypatch):
+    s3, sfn, arn = aws
+    for name in ["Products.txt", "Submissions.txt"]:
+        s3.put_object(Bucket=BUCKET, Key=f"{METADATA}/2020/09/01/{name}", Body=b"")
+    for n in [1, 2]:
+        s3.put_object(Bucket=BUCKET, Key=f"{DELTA}/2020/09/{n:02d}/deltafile.csv",
+                      Body="\n".join(DELTA_LINES).encode())
+    event = {'backfill': {'start': "2020-09-01", 'end': "2020-09-02", 'max_days_per_execution': 1}}
+
+    start_execution = load_parameters.start_execution
+
+    def failing_start(execution_input, stage_metrics):
+        if execution_input['partition_dates'] == ["2020-09-02"]:
+            raise ValueError("execution input is too large")
+        return start_execution(execution_input, stage_metrics)
+
+    monkeypatch.setattr(load_parameters, 'start_execution', failing_start)
+    result = load_parameters.handler(dict(event), None)
+
+    assert [execution['status'] for execution in result['executions']] == ["started", "start_failed"]
+    assert result['executions'][1]['error'] == "ValueError: execution input is too large"
+
+    monkeypatch.setattr(load_parameters, 'start_execution', start_execution)
+    result = load_parameters.handler(dict(event), None)
+
+    assert [execution['status'] for execution in result['executions']] == ["running", "started"]
+
+
+def test_large_execution_inputs_pass_their_chunks_by_claim_check(aws, monkeypatch):
+    s3, _, _ = aws
+    chunks = [[{'application_no': str(n), 'drug_name': "x" * 1000} for n in range(i, i + 10)] for i in range(0, 300, 10)]
+    execution_input = {'execution_name': "run", 'fda': {'chunks': chunks}}
+
+    monkeypatch.setitem(load_parameters.configuration, 'CLAIM_CHECK_S3_URI', "")
+    with pytest.raises(ValueError, match="CLAIM_CHECK_S3_URI"):
+        load_parameters.fit_execution_input(dict(execution_input, fda={'chunks': list(chunks)}))
+
+    monkeypatch.setitem(load_parameters.configuration, 'CLAIM_CHECK_S3_URI', f"s3://{BUCKET}/claim-check")
+    load_parameters.fit_execution_input(execution_input)
+
+    assert len(json.dumps(execution_input)) <= load_parameters.MAX_EXECUTION_INPUT_BYTES
+    assert [claim_check.resolve(pointer) for pointer in execution_input['fda']['chunks']] == chunks
+    assert claim_check.resolve(chunks[0]) == chunks[0]
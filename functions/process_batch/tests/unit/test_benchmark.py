@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+from tools import benchmark
+
+
+def result(**metrics):
+    return {'meta': {}, 'metrics': metrics}
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert benchmark.percentile(values, 50) == 50
+    assert benchmark.percentile(values, 99) == 99
+    assert benchmark.percentile([], 50) == 0.0
+
+
+def test_compare_results_flags_regressions():
+    baseline = result(**{'fdaapi.construct.seconds': 1.0, 'format_response.p99_ms': 10.0,
+                         'fdaapi.product.rows': 100})
+    current = result(**{'fdaapi.construct.seconds': 1.5, 'format_response.p99_ms': 10.5,
+                        'fdaapi.product.rows': 1000})
+
+    regressions = benchmark.compare_results(baseline, current, 0.2)
+
+    assert [r[0] for r in regressions] == ['fdaapi.construct.seconds']
+
+
+def test_compare_results_ignores_noise():
+    baseline = result(**{'load_delta_file.seconds': 0.0002})
+    current = result(**{'load_delta_file.seconds': 0.0006})
+
+    assert benchmark.compare_results(baseline, current, 0.2) == []
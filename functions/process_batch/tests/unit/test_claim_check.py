@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import gzip
+import json
+
+import claim_check
+import output_sinks
+
+BUCKET = "claim-check-test"
+
+
+def make_payload(application_no, number_of_products):
+    products = [{"drug_name": "PREMARIN", "strength": f"{i}MG", "product_number": i}
+                for i in range(number_of_products)]
+    return {"s3_raw": f"s3://bucket/{application_no}.pdf", "last_updated": "2020-09-02", "drug_name": "PREMARIN",
+            "fda": {"application_no": application_no, "submission_no": 1, "submission_type_id": 1,
+                    "products": products}}
+
+
+def test_small_payload_is_unchanged(s3):
+    check = claim_check.ClaimCheck(f"s3://{BUCKET}/claims", s3_client=s3, threshold=10000)
+    payload = make_payload(4782, 2)
+
+    assert check.check(payload) is payload
+    assert check.offloaded_count == 0
+
+
+def test_large_payload_is_offloaded_once(s3):
+    check = claim_check.ClaimCheck(f"s3://{BUCKET}/claims", s3_client=s3, threshold=1024)
+    payload = make_payload(4782, 200)
+
+    slim = check.check(payload)
+    again = claim_check.ClaimCheck(f"s3://{BUCKET}/claims", s3_client=s3, threshold=1024).check(payload)
+
+    assert slim["claim_check"] == again["claim_check"]
+    assert slim["fda"] == {"application_no": 4782, "submission_no": 1, "submission_type_id": 1}
+    assert claim_check.serialized_size(slim) < 1024
+
+    keys = [o['Key'] for o in s3.list_objects_v2(Bucket=BUCKET)['Contents']]
+    assert len(keys) == 1
+    assert slim["claim_check"]["s3_uri"] == f"s3://{BUCKET}/{keys[0]}"
+
+    body = s3.get_object(Bucket=BUCKET, Key=keys[0])['Body'].read()
+    assert json.loads(gzip.decompress(body)) == payload
+
+
+def test_eventbridge_sink_splits_requests_by_size(s3, events_client):
+    sink = output_sinks.EventBridgeSink(events_client=events_client, buffer_size=100)
+    for i in range(6):
+        sink.write(make_payload(i, 1200))
+    sink.close()
+
+    for request in events_client.requests:
+        assert sum(sink.entry_size(e) for e in request) <= output_sinks.EVENTBRIDGE_MAX_REQUEST_BYTES
+    assert sum(len(r) for r in events_client.requests) == 6
+
+
+def test_eventbridge_sink_uses_claim_check(s3, events_client):
+    sink = output_sinks.get_output_sink({"CLAIM_CHECK_S3_URI": f"s3://{BUCKET}/claims",
+                                         "CLAIM_CHECK_THRESHOLD_BYTES": "4096"},
+                                        events_client=events_client, s3_client=s3)
+    with sink:
+        sink.write(make_payload(1, 500))
+        sink.write(make_payload(2, 1))
+
+    details = [json.loads(e['Detail'])["metadata"] for e in events_client.requests[0]]
+    assert "claim_check" in details[0]
+    assert "claim_check" not in details[1]
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+from tools import cold_start
+
+
+def test_handlers_do_not_import_boto3():
+    for module in ('process_batch', 'load_parameters'):
+        result = cold_start.measure_import(module)
+        assert result['loaded'] == []
+        assert result['import_ms'] > 0
+
+
+def test_check_budget_reports_slow_and_eager_modules():
+    results = {
+        'process_batch': {'median_ms': 40.0, 'max_ms': 45.0, 'loaded': []},
+        'load_parameters': {'median_ms': 180.0, 'max_ms': 200.0, 'loaded': ['boto3']},
+    }
+
+    failures = cold_start.check_budget(results, 100.0)
+
+    assert [module for module, _ in failures] == ['load_parameters', 'load_parameters']
+    assert 'boto3' in failures[1][1]
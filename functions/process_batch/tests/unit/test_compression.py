@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import io
+import bz2
+import gzip
+import lzma
+
+import pytest
+
+import lookup
+import delta_file
+import compression
+import s3_discovery
+from fda_api import FDAAPI
+
+BUCKET = "compression-test"
+PRODUCTS = "\n".join([
+    "ApplNo\tProductNo\tForm\tStrength\tReferenceDrug\tDrugName\tActiveIngredient\tReferenceStandard",
+    "004782\t001\tTABLET;ORAL\t0.625MG\t1\tPREMARIN\tESTROGENS, CONJUGATED\t0",
+]) + "\r\n"
+DELTA = "\n".join([
+    "ApplicationDocsTypeID,ApplNo,SubmissionType,SubmissionNo,ApplicationDocsURL,DrugName,S3Path",
+    "1,4782,SUPPL,125,http://www.accessdata.fda.gov/4782.pdf,PREMARIN,s3://raw/premarin/4782/suppl/125/label.pdf",
+]) + "\n"
+
+
+class CountingStream(object):
+    """binary stream recording the size of every read"""
+
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+        self.reads = []
+
+    def read(self, size=-1):
+        self.reads.append(size)
+        return self.stream.read(size)
+
+
+@pytest.mark.parametrize('codec', [None, gzip, bz2, lzma])
+def test_streams_are_decompressed_whatever_their_codec(codec):
+    data = DELTA.encode('utf-8') * 1000
+    stream = CountingStream(codec.compress(data) if codec else data)
+
+    with compression.open_stream(stream, 'utf-8') as f:
+        assert f.read() == DELTA * 1000
+
+    ## read in chunks, never as a whole
+    assert -1 not in stream.reads and max(stream.reads) <= compression.CHUNK_SIZE
+
+
+def test_compressed_local_metadata_and_delta_are_found_by_their_plain_name(tmp_path):
+    (tmp_path / "Products.txt.gz").write_bytes(gzip.compress(PRODUCTS.encode('windows-1252')))
+    (tmp_path / "deltafile.csv.xz").write_bytes(lzma.compress(DELTA.encode('utf-8')))
+
+    api = FDAAPI(S3_metadata_loc=str(tmp_path), test=True)
+    try:
+        assert [product.drug_name for product in api.get_products(4782)] == ["PREMARIN"]
+    finally:
+        api.close()
+    assert delta_file.load_local_records(str(tmp_path / "deltafile.csv"))[0]['application_no'] == "4782"
+
+
+def test_compressed_s3_objects_are_read_and_listed(s3):
+    for item in [FDAAPI.ACTION_TYPE, FDAAPI.APPLICATION_DOC, FDAAPI.APPLICATION, FDAAPI.APPLICATION_DOC_TYPE,
+                 FDAAPI.MARKETING_STATUS, FDAAPI.MARKETING_STATUS_LOOKUP, FDAAPI.SUBMISSION_CLASS,
+                 FDAAPI.SUBMISSION_PROPERTY_TYPE, FDAAPI.SUBMISSION, FDAAPI.TE]:
+        s3.put_object(Bucket=BUCKET, Key=f"metadata/{item.filename}", Body=b"")
+    s3.put_object(Bucket=BUCKET, Key="metadata/Products.txt.gz", Body=gzip.compress(PRODUCTS.encode('windows-1252')))
+    s3.put_object(Bucket=BUCKET, Key="delta/deltafile.csv", Body=bz2.compress(DELTA.encode('utf-8')))
+
+    api = FDAAPI(S3_metadata_loc=f"s3://{BUCKET}/metadata")
+    try:
+        assert api.load_timings['product']['rows'] == 1
+        assert api.load_timings['te']['rows'] == 0
+    finally:
+        api.close()
+
+    rows = list(delta_file.parse_delta_rows(delta_file.read_delta_lines(f"s3://{BUCKET}/delta/deltafile.csv")))
+    assert rows[0]['drugname'] == "PREMARIN"
+
+    discovery = s3_discovery.S3Discovery(s3_client=s3)
+    assert "metadata/Products.txt.gz" in discovery.list_keys(BUCKET, "metadata/", compression.suffixes(".txt"))
+
+
+def test_lookup_snapshots_are_stored_compressed(s3, tmp_path):
+    (tmp_path / "Products.txt").write_text(PRODUCTS, encoding='windows-1252')
+    uri = f"s3://{BUCKET}/lookup/fda_lookup.db.xz"
+    path = lookup.build_snapshot(str(tmp_path), str(tmp_path / "fda_lookup.db"), uri)
+
+    stored = s3.get_object(Bucket=BUCKET, Key="lookup/fda_lookup.db.xz")['Body'].read()
+    assert compression.detect(stored) == '.xz'
+
+    lookup.download_snapshot(uri, str(tmp_path / "downloaded.db"))
+    with open(path, 'rb') as built, open(tmp_path / "downloaded.db", 'rb') as downloaded:
+        assert built.read() == downloaded.read()
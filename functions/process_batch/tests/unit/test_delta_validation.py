@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import delta_file
+import s3_discovery
+import load_parameters
+import enrichment_pipeline
+from fda_api import FDAAPI
+
+BUCKET = "delta-validation-test"
+DELTA = "\n".join([
+    "ApplicationDocsTypeID,ApplNo,SubmissionType,SubmissionNo,ApplicationDocsURL,DrugName,S3Path",
+    "2,4782,SUPPL  ,125,http://fda/4782/label.pdf,PREMARIN,s3://raw/premarin/4782/suppl/125",
+    "2,4782,SUPPL  ,125,http://fda/4782/label.pdf,PREMARIN,s3://raw/premarin/4782/suppl/125",
+    "2,,SUPPL,,http://fda/none/label.pdf,PREMARIN,s3://raw/premarin/none/suppl",
+    "2,11111,ORIG,1,http://fda/11111/label.pdf,OTHER,s3://raw/other/11111/orig/1",
+    "2,004782,SUPPL,125,http://fda/4782/letter.pdf,PREMARIN,s3://raw/premarin/4782/suppl/125",
+]) + "\n"
+
+
+def record(application_no="4782", submission_no="125", docs_type_id="2", drug_name="PREMARIN",
+           url="http://fda/4782/label.pdf"):
+    return {'appplication_docs_type_id': docs_type_id, 'application_no': application_no,
+            'submission_type': "SUPPL  ", 'submission_no': submission_no, 'application_docs_url': url,
+            'drug_name': drug_name, 's3_path': "s3://raw/premarin/4782/suppl/125"}
+
+
+def test_invalid_records_are_rejected_with_their_reasons():
+    records, rejected, duplicates = delta_file.coalesce_records([
+        record(submission_no=" "),
+        record(docs_type_id="2a"),
+        record(application_no="", drug_name=""),
+        record(application_no="", drug_name="premarin"),
+    ])
+
+    assert [reject['reasons'] for reject in rejected] == [
+        ["submission_no is blank"],
+        ["appplication_docs_type_id is not a number: '2a'"],
+        ["application_no is not a number and there is no drug_name to resolve it from"],
+    ]
+    assert len(records) == 1 and duplicates == 0
+    assert records[0]['submission_type'] == "SUPPL"
+
+
+def test_exact_duplicates_are_dropped_and_documents_of_a_key_grouped():
+    records, rejected, duplicates = delta_file.coalesce_records([
+        record(),
+        record(application_no="11111"),
+        record(),
+        ## another document in the same submission folder
+        record(application_no="004782", url="http://fda/4782/letter.pdf"),
+    ])
+
+    assert not rejected and duplicates == 1
+    assert [(r['application_no'], r['application_docs_url']) for r in records] == [
+        ("4782", "http://fda/4782/label.pdf"),
+        ("004782", "http://fda/4782/letter.pdf"),
+        ("11111", "http://fda/4782/label.pdf"),
+    ]
+    assert delta_file.enrichment_key(records[0]) == delta_file.enrichment_key(records[1])
+
+
+def test_chunks_keep_the_records_of_a_key_together():
+    records = ["a", "b", "b", "c", "c", "c", "d", "d", "d", "d", "d"]
+
+    chunks = delta_file.chunk_records(records, 4, key=lambda r: r)
+
+    assert chunks == [["a", "b", "b"], ["c", "c", "c"], ["d", "d", "d", "d"], ["d"]]
+    assert delta_file.chunk_records(records, 4) == [records[0:4], records[4:8], records[8:]]
+
+
+def test_shared_enrichment_computes_each_key_once():
+    calls = []
+
+    def enrich(r):
+        calls.append(r['application_docs_url'])
+        time.sleep(0.05)
+        return {'application_no': r['application_no'], 'source_url': r['application_docs_url']}
+
+    shared = enrichment_pipeline.SharedEnrichment(
+        enrich, delta_file.enrichment_key, lambda r: {'source_url': r['application_docs_url']})
+    records = [record(url=f"http://fda/4782/{i}.pdf") for i in range(6)] + [record(application_no="11111")]
+
+    with ThreadPoolExecutor(4) as executor:
+        payloads = list(executor.map(shared, records))
+
+    assert len(calls) == 2 and shared.shared_count == 5
+    assert [payload['source_url'] for payload in payloads] == [r['application_docs_url'] for r in records]
+    assert payloads[5]['application_no'] == "4782" and payloads[6]['application_no'] == "11111"
+
+
+def test_shared_enrichment_shares_failures():
+    lock = threading.Lock()
+    calls = []
+
+    def enrich(r):
+        with lock:
+            calls.append(r)
+        raise ValueError("no such application")
+
+    shared = enrichment_pipeline.SharedEnrichment(enrich, delta_file.enrichment_key, FDAAPI.document_fields)
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            shared(record())
+    assert len(calls) == 1
+
+
+def test_load_delta_file_writes_rejects(s3, monkeypatch):
+    s3.put_object(Bucket=BUCKET, Key="delta/deltafile.csv", Body=DELTA.encode('utf-8'))
+    monkeypatch.setitem(load_parameters.configuration, 'DELTA_REJECTS_S3_URI', f"s3://{BUCKET}/rejects/")
+    monkeypatch.setitem(load_parameters.configuration, 'DEFAULT_CHUNK_SIZE', "2")
+    chunks, total, validation = load_parameters.load_delta_file(
+        f"s3://{BUCKET}/delta/deltafile.csv", discovery=s3_discovery.S3Discovery(s3_client=s3), run_id="run-1")
+
+    assert total == 3
+    assert validation == {'rejected': 1, 'duplicates': 1,
+                          'rejects_uri': f"s3://{BUCKET}/rejects/run-1/rejects.jsonl"}
+    ## both documents of application 4782 are enriched in one chunk
+    assert [[r['application_docs_url'] for r in chunk] for chunk in chunks] == [
+        ["http://fda/4782/label.pdf", "http://fda/4782/letter.pdf"], ["http://fda/11111/label.pdf"]]
+
+    body = s3.get_object(Bucket=BUCKET, Key="rejects/run-1/rejects.jsonl")['Body'].read().decode('utf-8')
+    rejects = [json.loads(line) for line in body.splitlines()]
+    assert rejects[0]['reasons'] == ["submission_no is blank"]
+    assert rejects[0]['record']['application_docs_url'] == "http://fda/none/label.pdf"
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import os
+
+import pytest
+
+import metrics
+import delta_file
+import process_batch
+import output_sinks
+import enrichment_pipeline
+from fda_api import FDAAPI
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+class CollectingSink(output_sinks.NullSink):
+
+    def __init__(self, **kwargs):
+        super(CollectingSink, self).__init__(**kwargs)
+        self.payloads = []
+
+    def write_batch(self, payloads):
+        self.payloads.extend(payloads)
+
+
+class FailingSink(output_sinks.NullSink):
+
+    def write_batch(self, payloads):
+        raise IOError("sink unavailable")
+
+
+@pytest.fixture(scope='module')
+def api():
+    api = FDAAPI(S3_metadata_loc=os.path.join(DATA_DIR, 'metadata'), test=True)
+    yield api
+    api.close()
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_pipeline_preserves_order(workers):
+    sink = CollectingSink(buffer_size=3)
+    with sink:
+        count = enrichment_pipeline.run_pipeline(lambda x: x * 2, range(50), sink,
+                                                 workers=workers, queue_size=2)
+
+    assert count == 50
+    assert sink.payloads == [x * 2 for x in range(50)]
+
+
+def test_pipeline_raises_sink_errors():
+    with pytest.raises(IOError):
+        enrichment_pipeline.run_pipeline(lambda x: x, range(10), FailingSink(buffer_size=1), workers=2)
+
+
+def test_concurrent_reads_match_sequential(api):
+    records = delta_file.load_local_records(os.path.join(DATA_DIR, 'deltafile.csv'))
+
+    sequential = [api.format_record(record) for record in records]
+
+    snapshot = api.enable_concurrent_reads()
+    assert os.path.exists(snapshot)
+
+    sink = CollectingSink()
+    with sink:
+        enrichment_pipeline.run_pipeline(api.format_record, records, sink, workers=4)
+
+    assert sink.payloads == sequential
+
+    snapshot_api = FDAAPI(snapshot=snapshot)
+    assert snapshot_api.format_record(records[0]) == sequential[0]
+
+    api.close()
+    assert not os.path.exists(snapshot)
+
+
+def test_records_are_enriched_without_a_snapshot_by_default(monkeypatch):
+    api = FDAAPI(S3_metadata_loc=os.path.join(DATA_DIR, 'metadata'), test=True)
+    records = delta_file.load_local_records(os.path.join(DATA_DIR, 'deltafile.csv'))
+    monkeypatch.delitem(process_batch.configuration, "ENRICHMENT_WORKERS", raising=False)
+    monkeypatch.setattr(api, 'enable_concurrent_reads', lambda: pytest.fail("snapshot taken"))
+
+    stage_metrics = metrics.StageMetrics()
+    process_batch.enrich_records(api, records, {'output_sink': output_sinks.NULL_SINK}, stage_metrics)
+
+    assert api.snapshot_loc is None
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import json
+import pickle
+
+import pytest
+
+import fda_records
+from fda_api import FDAAPI
+
+PRODUCTS = [
+    ("ApplNo", "ProductNo", "Form", "Strength", "ReferenceDrug", "DrugName", "ActiveIngredient", "ReferenceStandard"),
+    ("004782", "001", "TABLET;ORAL", "0.625MG", "1", "PREMARIN", "ESTROGENS, CONJUGATED", "0"),
+    ("004782", "002", "TABLET;ORAL", "1.25MG", "1", "PREMARIN", "ESTROGENS, CONJUGATED", "0"),
+]
+APPLICATIONS = [
+    ("ApplNo", "ApplType", "ApplPublicNotes", "SponsorName"),
+    ("004782", "NDA", "", "WYETH PHARMS"),
+]
+
+
+@pytest.fixture(scope='module')
+def api(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("metadata")
+    for name, rows in [("Products.txt", PRODUCTS), ("Applications.txt", APPLICATIONS)]:
+        (folder / name).write_text("\n".join("\t".join(row) for row in rows) + "\n", encoding='windows-1252')
+    api = FDAAPI(S3_metadata_loc=str(folder), test=True)
+    yield api
+    api.close()
+
+
+def test_records_are_built_from_row_tuples():
+    product = fda_records.Product.from_row(("PREMARIN", "ESTROGENS", "1MG", "TABLET", None, "None", "Yes", "No", 1))
+
+    assert product.marketing_status == []
+    assert product.to_dict()['drug_name'] == "PREMARIN"
+    assert list(product.to_dict()) == list(fda_records.Product.FIELDS)
+    assert not hasattr(product, '__dict__')
+    assert pickle.loads(pickle.dumps(product)) == product
+
+
+def test_missing_fields_and_empty_records_read_as_empty_strings():
+    submission = fda_records.Submission.empty()
+
+    assert submission.approvalType == '' and submission.get('approvalType') == ''
+    assert fda_records.Application.empty().get('documentTypeDesc') == ''
+
+
+def test_serializer_matches_json_dumps():
+    payload = {'s3_raw': "s3://raw/é.pdf", 'drug_name': ["A", "B"], 'fda': {'application_no': 4782, 'notes': None}}
+
+    assert fda_records.dumps(payload) == json.dumps(payload)
+    assert fda_records.event_detail(payload) == json.dumps({"metadata": payload})
+
+
+def test_lookups_return_typed_records(api):
+    products = api.get_products(4782)
+    application = api.get_application(4782)
+
+    assert [product.product_number for product in products] == [1, 2]
+    assert application.sponsorName == "WYETH PHARMS"
+    assert application.documentType == "New Drug Application"
+    assert api.get_application(1) == fda_records.Application.empty()
+    assert api.get_submission(4782, 1, 125) == fda_records.Submission.empty()
+
+
+def test_payload_is_built_from_the_records(api):
+    payload = api.format_response(application_no=4782, submission_no=125, application_doc_type_id=1,
+                                  s3_raw="s3://raw/label.pdf", url="http://fda/label.pdf")
+
+    assert payload['drug_name'] == "PREMARIN"
+    assert sorted(payload['strength']) == ["0.625MG", "1.25MG"]
+    assert payload['route_of_administration'] == payload['dosage_form'] == ["TABLET;ORAL"]
+    assert payload['license_holder'] == "WYETH PHARMS"
+    assert payload['year_of_authorization'] == '' and payload['fda']['submission_status'] == ''
+    assert payload['fda']['products'][0] == {
+        'drug_name': "PREMARIN", 'active_substance': "ESTROGENS, CONJUGATED", 'strength': "0.625MG",
+        'dosage_form': "TABLET;ORAL", 'marketing_status': [], 'therapeutic_equivalence_codes': "None",
+        'reference_drug': "Yes", 'reference_standard': "No", 'product_number': 1}
+    json.loads(fda_records.dumps(payload))
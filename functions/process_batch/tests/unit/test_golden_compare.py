@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import os
+
+from tools import golden_compare
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def test_canonical_ignores_order_and_last_updated():
+    a = {'last_updated': '2020-01-01', 'products': [{'form': ['b', 'a']}, {'form': 'c'}]}
+    b = {'last_updated': '2021-01-01', 'products': [{'form': 'c'}, {'form': ['a', 'b']}]}
+
+    assert golden_compare.canonical(a) == golden_compare.canonical(b)
+
+
+def test_comparison_reports_fields_with_examples():
+    comparison = golden_compare.Comparison(max_examples=1)
+    comparison.add('1/1', {'fda': {'sponsor_name': 'X', 'application_no': 1}},
+                   {'fda': {'sponsor_name': 'Y', 'application_no': 1}})
+    comparison.add('2/1', {'fda': {'sponsor_name': 'X'}}, {'fda': {'sponsor_name': 'Z'}})
+    comparison.add('3/1', {'drug_name': 'A'}, {'drug_name': 'A'})
+
+    report = comparison.to_dict()
+
+    assert report['records'] == 3
+    assert report['different_records'] == 2
+    assert report['fields']['fda.sponsor_name']['count'] == 2
+    assert report['fields']['fda.sponsor_name']['examples'] == [{'key': '1/1', 'a': 'X', 'b': 'Y'}]
+
+
+def test_engines_agree_and_replay_golden(tmp_path):
+    golden = str(tmp_path / "golden.jsonl.gz")
+    common = ['--metadata', os.path.join(DATA, 'metadata'), '--delta', os.path.join(DATA, 'deltafile.csv'),
+              '--workers', '1', '--limit', '3']
+
+    assert golden_compare.main(common + ['--write-golden', golden]) == 0
+    assert golden_compare.main(common + ['--engine-a', 'golden:' + golden, '--engine-b', 'snapshot']) == 0
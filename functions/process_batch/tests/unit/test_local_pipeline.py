@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import os
+import json
+from datetime import date
+
+import pytest
+
+import aws_clients
+import load_parameters
+import process_batch
+import notify_job_complete
+from tools import local_pipeline
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+
+@pytest.fixture()
+def environment(monkeypatch):
+    ## the runner points the environment and the handlers' configuration at its stand-ins
+    for key in list(local_pipeline.DEFAULT_ENVIRONMENT) + ['BUCKET_NAME', 'DELTA_FILE_PATH', 'METADATA_FILE_PATH',
+                                                           'NUM_METADATA_FILES', 'STATE_MACHINE_ARN',
+                                                           'OPERATIONS_NOTIFICATION_ARN', 'OUTPUT_SINK',
+                                                           'DEFAULT_CHUNK_SIZE']:
+        monkeypatch.delenv(key, raising=False)
+    saved = [(module, dict(module.configuration)) for module in (load_parameters, process_batch, notify_job_complete)]
+    yield
+    for module, configuration in saved:
+        module.configuration.clear()
+        module.configuration.update(configuration)
+    aws_clients.reset()
+
+
+def test_pipeline_runs_end_to_end(environment):
+    report = local_pipeline.run(os.path.join(DATA, "deltafile.csv"), os.path.join(DATA, "metadata"),
+                                partition_date=date(2020, 9, 2), chunk_size=5)
+
+    assert report['records'] == 10 and report['chunks'] == 2
+    assert report['records_written'] == 10 and report['chunks_failed'] == 0
+    assert report['records_per_second'] > 0
+    assert set(report['stages']) == {'load_parameters', 'process_batch', 'summarize_run', 'notify'}
+    assert report['run_summary']['stages']['enrich_record']['count'] == 10
+    json.dumps(report)
+
+
+def test_main_writes_the_report(environment, tmp_path):
+    output = tmp_path / "pipeline.json"
+
+    exit_code = local_pipeline.main(["--synthetic-scale", "0.01", "--delta-rows", "20", "--chunk-size", "10",
+                                     "--sink", "null", "--trace-memory", "--date", "2020-09-02",
+                                     "--output", str(output)])
+
+    report = json.loads(output.read_text())
+    assert exit_code == 0
+    assert report['records'] == 20 and report['chunks'] == 2
+    assert report['stages']['process_batch']['count'] == 2
+    assert report['stages']['process_batch']['peak_traced_mb'] > 0
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import json
+import logging
+import sys
+
+import pytest
+
+import utils
+from custom_log_formatter import CustomLogFormatter
+
+
+@pytest.fixture()
+def root_logger(monkeypatch):
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    monkeypatch.setattr(utils, '_log_pid', None)
+    yield root
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def test_load_log_config_configures_once(root_logger, monkeypatch):
+    monkeypatch.setenv(utils.LOG_LEVEL_ENV, "warning")
+
+    utils.load_log_config()
+    handlers = list(root_logger.handlers)
+    root_logger.setLevel(logging.ERROR)
+    utils.load_log_config()
+
+    assert root_logger.handlers == handlers
+    assert root_logger.level == logging.ERROR
+    assert isinstance(handlers[0].formatter, CustomLogFormatter)
+
+
+def test_load_log_config_level_from_environment(root_logger, monkeypatch):
+    monkeypatch.setenv(utils.LOG_LEVEL_ENV, "warning")
+    assert utils.load_log_config().level == logging.WARNING
+
+    monkeypatch.setattr(utils, '_log_pid', None)
+    monkeypatch.setenv(utils.LOG_LEVEL_ENV, "nonsense")
+    assert utils.load_log_config().level == logging.INFO
+
+
+def test_formatter_builds_json_with_exception():
+    formatter = CustomLogFormatter('%(asctime)s', '%Y-%m-%dT%H:%M:%S')
+    try:
+        raise ValueError("bad row")
+    except ValueError:
+        record = logging.LogRecord('fda', logging.ERROR, __file__, 1, "failed %s", ("row",), sys.exc_info())
+    record.created = 0.25
+    record.msecs = 250
+
+    line = json.loads(formatter.format(record))
+
+    assert line['message'] == "failed row"
+    assert line['time'] == "1970-01-01T00:00:00.250Z"
+    assert "ValueError: bad row" in line['exception']
+
+
+def test_queued_records_are_written_before_the_handler_returns(root_logger, monkeypatch):
+    import time
+
+    class SlowHandler(logging.Handler):
+        def __init__(self):
+            super(SlowHandler, self).__init__()
+            self.messages = []
+
+        def emit(self, record):
+            time.sleep(0.02)
+            self.messages.append(record.getMessage())
+
+    slow = SlowHandler()
+    root_logger.handlers[:] = [slow]
+    monkeypatch.setenv(utils.LOG_QUEUE_ENV, "true")
+    monkeypatch.setattr(utils, '_log_listener', None)
+    utils.load_log_config()
+    listener = utils._log_listener
+
+    @utils.flushing_logs
+    def handler(event, context):
+        for n in range(5):
+            logging.getLogger(__name__).warning("record %s", n)
+        return "done"
+
+    try:
+        assert handler({}, None) == "done"
+        assert slow.messages == ["record %s" % n for n in range(5)]
+    finally:
+        import atexit
+
+        atexit.unregister(listener.stop)
+        listener.stop()
+        monkeypatch.setattr(utils, '_log_pid', None)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import json
+
+import pytest
+
+import lookup
+from tools import load_test_lookup
+
+PRODUCTS = [
+    ("ApplNo", "ProductNo", "Form", "Strength", "ReferenceDrug", "DrugName", "ActiveIngredient", "ReferenceStandard"),
+    ("004782", "001", "TABLET;ORAL", "0.625MG", "1", "PREMARIN", "ESTROGENS, CONJUGATED", "0"),
+]
+APPLICATIONS = [
+    ("ApplNo", "ApplType", "ApplPublicNotes", "SponsorName"),
+    ("004782", "NDA", "", "WYETH PHARMS"),
+]
+APPLICATION_DOCS = [
+    ("ApplicationDocsID", "ApplicationDocsTypeID", "ApplNo", "SubmissionType", "SubmissionNo", "ApplicationDocsTitle",
+     "ApplicationDocsURL", "ApplicationDocsDate"),
+    ("1", "2", "004782", "SUPPL", "125", "", "http://fda/label.pdf", "2012-03-01 00:00:00"),
+]
+SUBMISSIONS = [
+    ("ApplNo", "SubmissionClassCodeID", "SubmissionType", "SubmissionNo", "SubmissionStatus", "SubmissionStatusDate",
+     "SubmissionsPublicNotes", "ReviewPriority"),
+    ("004782", "7", "SUPPL", "125", "AP", "2012-03-01 00:00:00", "", "STANDARD"),
+]
+DOCS_TYPES = [
+    ("ApplicationDocsType_Lookup_ID", "ApplicationDocsType_Lookup_Description"),
+    ("1", "Letter"),
+    ("2", "Label"),
+]
+
+
+@pytest.fixture(scope='module')
+def snapshot(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("metadata")
+    for name, rows in [("Products.txt", PRODUCTS), ("Applications.txt", APPLICATIONS),
+                       ("ApplicationDocs.txt", APPLICATION_DOCS), ("Submissions.txt", SUBMISSIONS),
+                       ("ApplicationsDocsType_Lookup.txt", DOCS_TYPES)]:
+        (folder / name).write_text("\n".join("\t".join(row) for row in rows) + "\n", encoding='windows-1252')
+    return lookup.build_snapshot(str(folder), str(tmp_path_factory.mktemp("snapshot") / "fda_lookup.db"))
+
+
+@pytest.fixture()
+def warm(snapshot):
+    lookup.configuration['LOOKUP_SNAPSHOT_S3_URI'] = ""
+    lookup.configuration['LOOKUP_SNAPSHOT_PATH'] = snapshot
+    lookup.reset()
+    yield
+    lookup.reset()
+
+
+def call(method, path_parameters=None, body=None):
+    result = lookup.handler({'httpMethod': method, 'pathParameters': path_parameters,
+                             'body': json.dumps(body) if body is not None else None}, None)
+    return result['statusCode'], json.loads(result['body'])
+
+
+def test_application_and_document_lookups(warm):
+    status, payload = call('GET', {'application_no': "4782"})
+    assert status == 200
+    assert payload['drug_name'] == "PREMARIN" and payload['license_holder'] == "WYETH PHARMS"
+
+    status, payload = call('GET', {'application_no': "4782", 'submission_no': "125", 'docs_type_id': "2"})
+    assert status == 200
+    assert payload['fda']['application_no'] == 4782
+    assert payload['document_type'] == "Label" and payload['fda']['submission_status'] == "AP"
+
+    ## one snapshot per container, reused by every request
+    api = lookup.WARM['api']
+    call('GET', {'application_no': "4782"})
+    assert lookup.WARM['api'] is api
+
+
+def test_unknown_and_malformed_lookups(warm):
+    assert call('GET', {'application_no': "999999"})[0] == 404
+    assert call('GET', {'application_no': "NDA"})[0] == 400
+    assert call('POST', body={'lookups': []})[0] == 400
+
+    lookup.configuration['LOOKUP_MAX_BATCH'] = "2"
+    try:
+        assert call('POST', body={'lookups': [{'application_no': 4782}] * 3})[0] == 413
+    finally:
+        lookup.configuration.pop('LOOKUP_MAX_BATCH')
+
+
+def test_parameter_store_values_override_the_environment(warm, monkeypatch):
+    import utils
+
+    monkeypatch.setattr(utils, 'load_ssm_parameters', lambda: {'LOOKUP_MAX_BATCH': "2"})
+    try:
+        assert call('POST', body={'lookups': [{'application_no': 4782}] * 3})[0] == 413
+    finally:
+        lookup.configuration.pop('LOOKUP_MAX_BATCH')
+
+
+def test_batch_reports_each_lookup(warm):
+    status, payload = call('POST', body={'lookups': [{'application_no': 4782}, {'application_no': 1}, "4782"]})
+
+    assert status == 200
+    results = payload['results']
+    assert results[0]['drug_name'] == "PREMARIN"
+    assert results[1]['status'] == 404 and results[2]['status'] == 400
+
+
+def test_refreshed_snapshots_close_their_read_connections(snapshot, tmp_path, monkeypatch):
+    import sqlite3
+    import shutil
+    from concurrent.futures import ThreadPoolExecutor
+
+    etags = iter(["v1", "v2", "v3"])
+    monkeypatch.setattr(lookup, 'snapshot_etag', lambda s3_uri: next(etags))
+    monkeypatch.setattr(lookup, 'download_snapshot', lambda s3_uri, path: shutil.copyfile(snapshot, path))
+    monkeypatch.setitem(lookup.configuration, 'LOOKUP_SNAPSHOT_S3_URI', "s3://bucket/fda_lookup.db")
+    monkeypatch.setitem(lookup.configuration, 'LOOKUP_SNAPSHOT_PATH', str(tmp_path / "fda_lookup.db"))
+    monkeypatch.setitem(lookup.configuration, 'LOOKUP_SNAPSHOT_TTL_SECONDS', "60")
+    lookup.reset()
+
+    connections = []
+    try:
+        for _ in range(3):
+            lookup.WARM['checked'] = float('-inf')
+            with ThreadPoolExecutor(4) as executor:
+                assert all(status == 200 for status, _ in executor.map(
+                    lambda _: call('GET', {'application_no': "4782"}), range(8)))
+            connections.append(list(lookup.WARM['api'].read_connections))
+    finally:
+        lookup.reset()
+
+    assert all(connections) and lookup.WARM['api'] is None
+    for conn in sum(connections, []):
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+
+def test_load_test_serves_every_request(snapshot):
+    report = load_test_lookup.run(snapshot, requests=40, concurrency=2, batch_size=3, p99_ms=10000.0)
+
+    assert report['statuses'] == {'200': 40}
+    assert report['overall']['requests'] == report['handler']['requests'] == 40
+    assert report['passed']
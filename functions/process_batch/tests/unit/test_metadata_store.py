@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+from datetime import date
+
+import pytest
+
+import metadata_store
+
+PRODUCTS = ("ApplNo", "ProductNo", "Form", "Strength", "ReferenceDrug", "DrugName", "ActiveIngredient",
+            "ReferenceStandard")
+APPLICATIONS = ("ApplNo", "ApplType", "ApplPublicNotes", "SponsorName")
+MARKETING_STATUS = ("MarketingStatusID", "ApplNo", "ProductNo")
+MARKETING_STATUS_LOOKUP = ("MarketingStatusID", "MarketingStatusDescription")
+TE = ("ApplNo", "ProductNo", "MarketingStatusID", "TECode")
+
+LOOKUPS = {
+    "MarketingStatus_Lookup.txt": [MARKETING_STATUS_LOOKUP, ("1", "Prescription"), ("3", "Discontinued")],
+}
+
+## the 2012 drop, and the 2020 drop where product 002 is discontinued, loses its TE code and 003 is added
+DROP_2012 = dict(LOOKUPS, **{
+    "Products.txt": [PRODUCTS, ("004782", "001", "TABLET;ORAL", "0.625MG", "1", "PREMARIN", "ESTROGENS", "0"),
+                     ("004782", "002", "TABLET;ORAL", "1.25MG", "1", "PREMARIN", "ESTROGENS", "0")],
+    "Applications.txt": [APPLICATIONS, ("004782", "NDA", "", "WYETH PHARMS")],
+    "MarketingStatus.txt": [MARKETING_STATUS, ("1", "004782", "001"), ("1", "004782", "002")],
+    "TE.txt": [TE, ("004782", "002", "1", "AB")],
+})
+DROP_2020 = dict(LOOKUPS, **{
+    "Products.txt": DROP_2012["Products.txt"] + [
+        ("004782", "003", "TABLET;ORAL", "2.5MG", "1", "PREMARIN", "ESTROGENS", "0")],
+    "Applications.txt": [APPLICATIONS, ("004782", "NDA", "", "PFIZER")],
+    "MarketingStatus.txt": [MARKETING_STATUS, ("1", "004782", "001"), ("3", "004782", "002"),
+                            ("1", "004782", "003")],
+    "TE.txt": [TE],
+})
+
+
+def write_drop(folder, files):
+    folder.mkdir()
+    for name, rows in files.items():
+        (folder / name).write_text("\n".join("\t".join(row) for row in rows) + "\n", encoding='windows-1252')
+    return str(folder)
+
+
+@pytest.fixture()
+def store(tmp_path):
+    store = metadata_store.MetadataStore(str(tmp_path / "metadata.db"))
+    store.ingest(write_drop(tmp_path / "2012", DROP_2012), date(2012, 3, 1))
+    store.ingest(write_drop(tmp_path / "2020", DROP_2020), "2020-09-02")
+    yield store
+    store.close()
+
+
+def products(api):
+    return dict((p['product_number'], (p['marketing_status'], p['therapeutic_equivalence_codes']))
+                for p in api.format_response(application_no=4782, submission_no=1, application_doc_type_id=1)['fda']['products'])
+
+
+def test_later_drops_store_only_the_changes(store):
+    stats = store.stats()
+
+    assert stats['drops'] == ["2012-03-01", "2020-09-02"]
+    ## product 003, its status, the new status of 002 and the new sponsor; 2 rows closed, 3 with the TE code
+    assert stats['tables']['product'] == {'stored_rows': 3, 'current_rows': 3}
+    assert stats['tables']['marketing_status'] == {'stored_rows': 4, 'current_rows': 3}
+    assert stats['tables']['te'] == {'stored_rows': 1, 'current_rows': 0}
+    assert stats['tables']['application'] == {'stored_rows': 2, 'current_rows': 1}
+
+
+def test_lookups_are_made_as_of_a_day(store):
+    assert products(store.api("2012-05-01")) == {1: ("Prescription", "None"), 2: ("Prescription", "AB")}
+    assert products(store.api("2020-09-02")) == {1: ("Prescription", "None"), 2: ("Discontinued", "None"),
+                                                 3: ("Prescription", "None")}
+    assert store.api(date(2019, 1, 1)).format_response(application_no=4782)['license_holder'] == "WYETH PHARMS"
+    assert store.api(date(2021, 1, 1)).format_response(application_no=4782)['license_holder'] == "PFIZER"
+    assert products(store.api("2011-12-31")) == {}
+
+
+def test_drops_are_ingested_in_order(store, tmp_path):
+    with pytest.raises(ValueError):
+        store.ingest(write_drop(tmp_path / "old", DROP_2012), "2015-01-01")
+    with pytest.raises(ValueError):
+        store.api("2020-13-01")
+
+
+def test_files_missing_from_a_drop_keep_their_table(store, tmp_path):
+    changes = store.ingest(write_drop(tmp_path / "partial", {"Applications.txt": DROP_2012["Applications.txt"]}),
+                           "2021-01-01")
+
+    assert changes['product'] == {'added': 0, 'removed': 0}
+    assert changes['application'] == {'added': 1, 'removed': 1}
+    assert len(products(store.api("2021-01-01"))) == 3
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import json
+import logging
+
+import metrics
+from custom_log_formatter import CustomLogFormatter
+
+
+def test_summary_aggregates_samples_and_counters():
+    stage_metrics = metrics.StageMetrics()
+    for ms in range(1, 101):
+        stage_metrics.record('enrich_record', ms / 1000.0)
+    stage_metrics.count('records_written', 60)
+    stage_metrics.count('records_written', 40)
+
+    values = stage_metrics.summary()
+
+    assert values['enrich_record.count'] == (100, 'Count')
+    assert values['enrich_record.sum_ms'] == (5050.0, 'Milliseconds')
+    assert values['enrich_record.p50_ms'] == (50.0, 'Milliseconds')
+    assert values['enrich_record.p99_ms'] == (99.0, 'Milliseconds')
+    assert values['records_written'] == (100, 'Count')
+
+
+def test_timed_records_every_call():
+    stage_metrics = metrics.StageMetrics()
+    double = stage_metrics.timed('double', lambda x: x * 2)
+
+    assert [double(i) for i in range(3)] == [0, 2, 4]
+    assert stage_metrics.summary()['double.count'][0] == 3
+
+
+def test_emit_logs_one_emf_document_through_the_formatter(caplog):
+    stage_metrics = metrics.get_stage_metrics({'AWS_LAMBDA_FUNCTION_NAME': 'process-batch'}, 'dev')
+    with stage_metrics.timer('metadata_load'):
+        pass
+
+    with caplog.at_level(logging.INFO, logger='metrics'):
+        stage_metrics.emit()
+        assert stage_metrics.emit() is None
+
+    assert len(caplog.records) == 1
+    line = json.loads(CustomLogFormatter('%(asctime)s', '%Y-%m-%dT%H:%M:%S').format(caplog.records[0]))
+
+    directive = line['_aws']['CloudWatchMetrics'][0]
+    assert directive['Namespace'] == metrics.DEFAULT_NAMESPACE
+    assert directive['Dimensions'] == [['Function', 'Stage']]
+    assert {'Name': 'metadata_load.p99_ms', 'Unit': 'Milliseconds'} in directive['Metrics']
+    assert line['Function'] == 'process-batch' and line['Stage'] == 'dev'
+    assert line['metadata_load.count'] == 1
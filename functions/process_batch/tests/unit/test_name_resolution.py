@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import pytest
+
+from fda_api import FDAAPI
+
+PRODUCTS = [
+    ("ApplNo", "ProductNo", "Form", "Strength", "ReferenceDrug", "DrugName", "ActiveIngredient", "ReferenceStandard"),
+    ("004782", "001", "TABLET;ORAL", "0.625MG", "1", "PREMARIN", "ESTROGENS, CONJUGATED", "0"),
+    ("010402", "001", "INJECTABLE;INJECTION", "25MG/VIAL", "1", "PREMARIN", "ESTROGENS, CONJUGATED", "0"),
+    ("005378", "001", "TABLET;ORAL", "5MG", "1", "DESOXYN", "METHAMPHETAMINE HYDROCHLORIDE", "0"),
+    ("020167", "001", "TABLET;ORAL", "1MG", "0", "ESTRACE", "ESTRADIOL", "0"),
+]
+SUBMISSIONS = [
+    ("ApplNo", "SubmissionClassCodeID", "SubmissionType", "SubmissionNo", "SubmissionStatus",
+     "SubmissionStatusDate", "SubmissionsPublicNotes", "ReviewPriority"),
+    ("004782", "7", "SUPPL", "125", "AP", "2003-02-28 00:00:00", "", "STANDARD"),
+    ("010402", "7", "SUPPL", "30", "AP", "2001-06-11 00:00:00", "", "STANDARD"),
+]
+
+
+def record(application_no, drug_name, submission_no="125"):
+    return {'appplication_docs_type_id': "1", 'application_no': application_no, 'submission_type': "SUPPL",
+            'submission_no': submission_no, 'application_docs_url': "", 'drug_name': drug_name,
+            's3_path': "s3://raw/label.pdf", 'url': ""}
+
+
+@pytest.fixture(scope='module')
+def api(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("metadata")
+    for name, rows in [("Products.txt", PRODUCTS), ("Submissions.txt", SUBMISSIONS)]:
+        (folder / name).write_text("\n".join("\t".join(row) for row in rows) + "\n", encoding='windows-1252')
+    api = FDAAPI(S3_metadata_loc=str(folder), test=True)
+    yield api
+    api.close()
+
+
+def test_names_resolve_to_scored_candidates(api):
+    candidates = api.resolve_application_numbers(["desoxyn", "Estradiol", "PREMARIN", "XY", ""])
+
+    assert [(c['application_no'], c['score']) for c in candidates["desoxyn"]] == [(5378, 1.0)]
+    assert candidates["Estradiol"][0]['application_no'] == 20167
+    assert [c['application_no'] for c in candidates["PREMARIN"]] == [4782, 10402]
+    assert candidates["XY"] == [] and candidates[""] == []
+
+
+def test_substrings_of_names_match(api):
+    candidates = api.resolve_application_numbers(["METHAMPHETAMINE"])
+
+    assert candidates["METHAMPHETAMINE"][0]['application_no'] == 5378
+    assert 0 < candidates["METHAMPHETAMINE"][0]['score'] < 1
+
+
+def test_records_without_application_no_are_resolved(api):
+    records = [record("4782", "PREMARIN"), record("", "DESOXYN"), record("N/A", "PREMARIN", "30"),
+               record("", "PREMARIN", "999"), record("", "")]
+
+    resolved, unresolved = api.resolve_records(records)
+
+    assert [(r['application_no'], r.get('application_no_source')) for r in resolved] == [
+        ("4782", None), ("5378", 'drug_name'), ("10402", 'drug_name')]
+    assert unresolved == records[3:]
+
+    payload = api.format_record(resolved[1])
+    assert payload['fda']['application_no'] == 5378
+    assert payload['drug_name'] == "DESOXYN"
+
+
+def test_snapshots_keep_the_name_index(api, tmp_path):
+    api.resolve_application_numbers(["DESOXYN"])
+    snapshot_api = FDAAPI(snapshot=api.snapshot(str(tmp_path / "metadata.db")))
+    try:
+        assert snapshot_api.resolve_application_numbers(["DESOXYN"])["DESOXYN"][0]['application_no'] == 5378
+    finally:
+        snapshot_api.close()
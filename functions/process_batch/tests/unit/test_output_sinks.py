@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import gzip
+import json
+import os
+
+import pytest
+
+import output_sinks
+
+BUCKET = "output-sink-test"
+
+
+def make_payload(i):
+    return {"s3_raw": f"s3://bucket/doc_{i}.pdf", "drug_name": "PREMARIN", "fda": {"application_no": i}}
+
+
+def read_jsonl(client, key):
+    body = client.get_object(Bucket=BUCKET, Key=key)['Body'].read()
+    return [json.loads(line) for line in gzip.decompress(body).decode('utf-8').splitlines()]
+
+
+def test_eventbridge_sink_batches_entries(events_client):
+    with output_sinks.EventBridgeSink(events_client=events_client) as sink:
+        for i in range(23):
+            sink.write(make_payload(i))
+
+    assert [len(r) for r in events_client.requests] == [10, 10, 3]
+    assert sink.records_written == 23
+    detail = json.loads(events_client.requests[0][0]['Detail'])
+    assert detail["metadata"]["fda"]["application_no"] == 0
+
+
+class FailingEventsClient(object):
+    """events client stand-in failing the first entries of its first requests with the given error codes"""
+
+    def __init__(self, failures):
+        self.requests = []
+        self.failures = list(failures)
+
+    def put_events(self, Entries):
+        self.requests.append(Entries)
+        codes = self.failures.pop(0) if self.failures else []
+        results = [{'ErrorCode': code, 'ErrorMessage': code} for code in codes]
+        results += [{'EventId': str(i)} for i in range(len(Entries) - len(codes))]
+        return {'FailedEntryCount': len(codes), 'Entries': results}
+
+
+def test_eventbridge_sink_skips_oversized_events(events_client):
+    with output_sinks.EventBridgeSink(events_client=events_client) as sink:
+        sink.write(make_payload(0))
+        sink.write(dict(make_payload(1), text="x" * output_sinks.EVENTBRIDGE_MAX_REQUEST_BYTES))
+        sink.write(make_payload(2))
+
+    assert [[json.loads(entry['Detail'])["metadata"]["fda"]["application_no"] for entry in request]
+            for request in events_client.requests] == [[0, 2]]
+    assert sink.records_written == 2 and sink.records_failed == 1
+
+
+def test_eventbridge_sink_retries_throttled_events():
+    client = FailingEventsClient([["ThrottlingException", "InternalFailure", "MalformedDetail"],
+                                  ["ThrottlingException"]])
+    with output_sinks.EventBridgeSink(events_client=client, retry_delay=0) as sink:
+        for i in range(5):
+            sink.write(make_payload(i))
+
+    ## the refused entry is not retried, the throttled ones until they are published
+    assert [len(request) for request in client.requests] == [5, 2, 1]
+    assert client.requests[1] == client.requests[0][:2]
+    assert sink.records_written == 4 and sink.records_failed == 1
+
+
+def test_eventbridge_sink_raises_once_retries_are_used_up():
+    client = FailingEventsClient([["ThrottlingException"]] * 3)
+    sink = output_sinks.EventBridgeSink(events_client=client, max_attempts=3, retry_delay=0)
+
+    with pytest.raises(output_sinks.OutputSinkException, match="after 3 attempts"):
+        with sink:
+            sink.write(make_payload(0))
+
+    assert len(client.requests) == 3 and sink.records_failed == 1
+
+
+def test_s3_sink_single_put(s3):
+    uri = f"s3://{BUCKET}/backfill/out.jsonl.gz"
+    with output_sinks.S3JsonLinesSink(uri, s3_client=s3, buffer_size=4) as sink:
+        for i in range(10):
+            sink.write(make_payload(i))
+        sink.flush()
+
+    assert sink.upload_id is None
+    records = read_jsonl(s3, "backfill/out.jsonl.gz")
+    assert [r["fda"]["application_no"] for r in records] == list(range(10))
+
+
+def test_s3_sink_multipart(s3):
+    uri = f"s3://{BUCKET}/backfill/large.jsonl.gz"
+    sink = output_sinks.S3JsonLinesSink(uri, s3_client=s3, buffer_size=50,
+                                        part_size=output_sinks.S3_MIN_PART_SIZE)
+    for i in range(2000):
+        payload = make_payload(i)
+        payload["noise"] = os.urandom(4096).hex()
+        sink.write(payload)
+    sink.close()
+
+    assert len(sink.parts) >= 2
+    records = read_jsonl(s3, "backfill/large.jsonl.gz")
+    assert len(records) == 2000
+    assert records[-1]["fda"]["application_no"] == 1999
+
+
+def test_local_file_sink(tmp_path):
+    path = str(tmp_path / "out" / "records.jsonl")
+    with output_sinks.LocalFileSink(path) as sink:
+        sink.write(make_payload(1))
+        sink.write(make_payload(2))
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[1])["fda"]["application_no"] == 2
+
+
+def test_get_output_sink_from_configuration(tmp_path):
+    sink = output_sinks.get_output_sink({"OUTPUT_SINK": "null"})
+    assert isinstance(sink, output_sinks.NullSink)
+    assert not sink.log_payloads
+
+    path = str(tmp_path / "records.jsonl.gz")
+    sink = output_sinks.get_output_sink({"OUTPUT_SINK": "eventbridge"},
+                                        {"output_sink": "file", "output_file_path": path, "log_payloads": "true"})
+    assert isinstance(sink, output_sinks.LocalFileSink)
+    assert sink.log_payloads
+    sink.close()
+
+    with pytest.raises(output_sinks.OutputSinkException):
+        output_sinks.get_output_sink({"OUTPUT_SINK": "s3"})
+
+    with pytest.raises(output_sinks.OutputSinkException):
+        output_sinks.get_output_sink({"OUTPUT_SINK": "kinesis"})
@@ -11,6 +11,7 @@ from botocore.exceptions import ClientError
 from contextlib import contextmanager
 
 from moto import mock_s3, mock_stepfunctions
+import run_summary
 from process_batch import handler
 
 EVENT_FILE = os.path.join(
@@ -53,4 +54,14 @@ def test_lambda_handler(event):
 
     assert ret is not None
     
-    
\ No newline at end of file
+    
+
+def test_lambda_handler_without_records_returns_an_empty_chunk_result(event):
+    event['process_batch_stats'] = {'number_of_records_to_process': 0}
+    event['chunk_index'] = 3
+
+    ret = handler(event, "")
+
+    assert set(ret) == {'chunk_index', 'parameters', 'process_batch_stats', 'run_summary'}
+    assert ret['chunk_index'] == 3 and 'chunks' not in ret
+    assert ret['run_summary'] == run_summary.RunSummary().to_dict()
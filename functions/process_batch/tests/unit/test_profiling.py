@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import json
+import os
+from types import SimpleNamespace
+
+import profiling
+
+
+def work(n):
+    return sum(len(str(i) * 10) for i in range(n))
+
+
+@profiling.profiled('test_handler')
+def handler(event, context):
+    with profiling.stage('load'):
+        data = [str(i) * 10 for i in range(20000)]
+    with profiling.stage('enrich'):
+        work(5000)
+    return {'active': profiling.active(), 'rows': len(data)}
+
+
+def test_disabled_handler_runs_unprofiled(tmp_path, monkeypatch):
+    monkeypatch.setenv(profiling.PROFILE_DIR_ENV, str(tmp_path))
+    monkeypatch.delenv(profiling.PROFILE_ENV, raising=False)
+
+    assert handler({}, None) == {'active': False, 'rows': 20000}
+    assert not os.listdir(str(tmp_path))
+
+
+def test_profiled_handler_writes_report_per_stage(tmp_path, monkeypatch):
+    monkeypatch.setenv(profiling.PROFILE_DIR_ENV, str(tmp_path))
+
+    result = handler({'profile': True}, SimpleNamespace(aws_request_id='req-1'))
+
+    assert result['active'] is True
+    assert not profiling.active()
+    with open(str(tmp_path / 'test_handler' / 'req-1.json')) as f:
+        report = json.load(f)
+
+    assert report['request_id'] == 'req-1'
+    assert set(report['stages']) == {'test_handler', 'load', 'enrich'}
+    enrich = report['stages']['enrich']
+    assert any(row['function'] == 'work' for row in enrich['top_functions'])
+    load = report['stages']['load']
+    assert load['peak_traced_bytes'] > 0
+    assert load['top_allocations'][0]['size_bytes'] > 0
+
+
+def test_is_enabled_reads_event_then_environment(monkeypatch):
+    monkeypatch.setenv(profiling.PROFILE_ENV, "true")
+    assert profiling.is_enabled({})
+    assert not profiling.is_enabled({'parameters': {'profile': 'false'}})
+
+    monkeypatch.delenv(profiling.PROFILE_ENV)
+    assert profiling.is_enabled({'parameters': {'profile': 'yes'}})
+    assert not profiling.is_enabled({})
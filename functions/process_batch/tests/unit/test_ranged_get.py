@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import os
+import time
+import threading
+
+import pytest
+
+import utils
+
+BUCKET = "ranged-get-test"
+DATA = os.urandom(5000)
+
+
+class CountingClient(object):
+    """s3 client wrapper that records get_object ranges and the most requests in flight"""
+
+    def __init__(self, client, delay=0.0):
+        self.client = client
+        self.delay = delay
+        self.ranges = []
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.lock = threading.Lock()
+
+    def get_object(self, **kwargs):
+        with self.lock:
+            self.ranges.append(kwargs.get('Range'))
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            return self.client.get_object(**kwargs)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+@pytest.fixture()
+def s3(s3, monkeypatch):
+    s3.put_object(Bucket=BUCKET, Key="large.bin", Body=DATA)
+    s3.put_object(Bucket=BUCKET, Key="empty.bin", Body=b"")
+    monkeypatch.setenv(utils.S3_RANGED_GET_PART_ENV, "700")
+    monkeypatch.setenv(utils.S3_RANGED_GET_WORKERS_ENV, "4")
+    return s3
+
+
+def test_small_objects_are_read_with_one_get(s3):
+    client = CountingClient(s3)
+
+    content = utils.read_ranges(client, BUCKET, "large.bin", 8000)
+    assert content['Body'].read() == DATA
+    assert client.ranges == ["bytes=0-7999"]
+
+    content = utils.read_ranges(client, BUCKET, "empty.bin", 8000)
+    assert content['Body'].read() == b"" and content['ContentLength'] == 0
+
+
+def test_large_objects_are_reassembled_from_concurrent_ranges(s3):
+    client = CountingClient(s3, delay=0.05)
+
+    content = utils.read_ranges(client, BUCKET, "large.bin", 1000)
+
+    assert content['ContentLength'] == len(DATA) and content['Parts'] == 7
+    assert content['Body'].read(10) + content['Body'].read() == DATA
+    assert client.ranges[1:] == ["bytes=%d-%d" % (start, min(start + 700, 5000) - 1)
+                                 for start in range(1000, 5000, 700)]
+    assert client.most_in_flight > 1
+
+
+def test_objects_above_the_spool_size_are_reassembled_in_a_file(s3, monkeypatch):
+    monkeypatch.setenv(utils.S3_RANGED_GET_SPOOL_ENV, "1000")
+
+    content = utils.read_ranges(s3, BUCKET, "large.bin", 1000)
+
+    assert not isinstance(content['Body'], utils.BufferBody)
+    assert content['Body'].read() == DATA
+    content['Body'].close()
+
+
+def test_read_obj_from_bucket_streams_unless_the_whole_object_is_asked_for(s3, monkeypatch):
+    monkeypatch.setenv(utils.S3_RANGED_GET_THRESHOLD_ENV, "1000")
+    content = utils.read_obj_from_bucket(f"s3://{BUCKET}/large.bin")
+    assert 'Parts' not in content and content['Body'].read() == DATA
+
+    content = utils.read_obj_from_bucket(f"s3://{BUCKET}/large.bin", whole=True)
+    assert content['Parts'] == 7 and content['Body'].read() == DATA
+
+    monkeypatch.setenv(utils.S3_RANGED_GET_THRESHOLD_ENV, "0")
+    content = utils.read_obj_from_bucket(f"s3://{BUCKET}/large.bin", whole=True)
+    assert 'Parts' not in content and content['Body'].read() == DATA
+
+
+def test_objects_known_to_be_small_are_read_without_a_range(s3):
+    client = CountingClient(s3)
+
+    content = utils.read_ranges(client, BUCKET, "large.bin", 8000, size=len(DATA))
+
+    assert content['Body'].read() == DATA
+    assert client.ranges == [None]
+
+
+def test_an_object_replaced_during_the_read_fails_it(s3):
+    class ReplacingClient(CountingClient):
+        def get_object(self, **kwargs):
+            response = super(ReplacingClient, self).get_object(**kwargs)
+            if len(self.ranges) == 1:
+                self.client.put_object(Bucket=BUCKET, Key="large.bin", Body=DATA[::-1])
+            return response
+
+    from botocore.exceptions import ClientError
+
+    with pytest.raises(ClientError, match="PreconditionFailed"):
+        utils.read_ranges(ReplacingClient(s3), BUCKET, "large.bin", 1000)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import gzip
+import json
+import os
+
+import delta_file
+import run_batch
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+DELTA_FILE = os.path.join(DATA_DIR, 'deltafile.csv')
+METADATA_DIR = os.path.join(DATA_DIR, 'metadata')
+
+
+def test_delta_headers_are_normalised():
+    lines = ["ApplicationDocsTypeID,ApplNo,SubmissionType,SubmissionNo,ApplicationDocsURL,DrugName,S3Path",
+             "1,4782,SUPPL     ,125,http://fda/ltr.pdf,PREMARIN,s3://bucket/premarin/4782/",
+             ",,,,,,",
+             ""]
+    records = [delta_file.map_row(row) for row in delta_file.parse_delta_rows(lines)]
+
+    assert len(records) == 1
+    assert records[0]['application_no'] == "4782"
+    assert records[0]['s3_path'] == "s3://bucket/premarin/4782/"
+    assert records[0]['application_docs_url'] == "http://fda/ltr.pdf"
+
+
+def test_chunk_records():
+    chunks = delta_file.chunk_records(list(range(7)), 3)
+    assert chunks == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_run_batch_to_file(tmp_path):
+    output = str(tmp_path / "fda.jsonl.gz")
+    args = run_batch.parse_args(["--delta", DELTA_FILE, "--metadata", METADATA_DIR,
+                                 "--sink", "file", "--output", output, "--workers", "1", "--chunk-size", "4"])
+    stats = run_batch.run(args)
+
+    assert stats['failed'] == 0
+    assert stats['written'] == stats['records'] == 10
+
+    with gzip.open(output, 'rt') as f:
+        payloads = [json.loads(line) for line in f]
+    assert payloads[0]['drug_name'] == "PREMARIN"
+    assert payloads[0]['fda']['application_no'] == 4782
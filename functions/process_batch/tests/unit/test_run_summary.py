@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import json
+
+import pytest
+
+import aws_clients
+import metrics
+import process_batch
+import run_summary
+import summarize_run
+import notify_job_complete
+import notify_failure_to_operations_user
+
+
+class RecordingSnsClient(object):
+    """sns client stand-in that records published messages"""
+
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, TopicArn, Message, Subject):
+        self.messages.append({'TopicArn': TopicArn, 'Message': Message, 'Subject': Subject})
+        return {'MessageId': str(len(self.messages))}
+
+
+@pytest.fixture()
+def sns(monkeypatch):
+    client = RecordingSnsClient()
+    monkeypatch.setattr(aws_clients, 'sns', lambda: client)
+    monkeypatch.setenv('OPERATIONS_NOTIFICATION_ARN', "arn:aws:sns:us-east-2:123456789012:operations")
+    monkeypatch.setenv('STAGE', "dev")
+    return client
+
+
+def record(n):
+    return {'application_no': str(n), 'submission_no': "1", 's3_path': f"s3://raw/{n}.pdf", 'drug_name': "PREMARIN"}
+
+
+def chunk_summary(n, records=10, failed=2):
+    stage_metrics = metrics.StageMetrics("test", {})
+    stage_metrics.record('enrich_record', 0.010 * (n + 1))
+    stage_metrics.count('records_written', records - failed)
+    event = {'run_id': "run-1", 'chunk_index': n}
+    unresolved = [record(n * 100 + i) for i in range(failed)]
+    summary = process_batch.summarize_chunk(event, [record(n * 100 + i) for i in range(records - failed)],
+                                            unresolved, stage_metrics, seconds=n + 1)
+    return summary.to_dict()
+
+
+def run_event(number_of_records, **extra):
+    records = [record(n) for n in range(number_of_records)]
+    event = {'run_id': "process-batch-2020-09-02",
+             'parameters': {'stage': "dev", 's3_delta_file_path': "s3://bucket/delta/2020/09/02/deltafile.csv",
+                            's3_metadata_file_path': "s3://bucket/metadata/2020/09/02"},
+             'fda': {'process_batch_stats': {'number_of_records_to_process': number_of_records},
+                     'chunks': [records[i:i + 10] for i in range(0, number_of_records, 10)]}}
+    event.update(extra)
+    return event
+
+
+def test_chunk_summaries_merge_into_a_bounded_summary():
+    results = [{'run_summary': chunk_summary(n)} for n in range(200)]
+    results.append({'Error': "States.TaskFailed", 'Cause': "x" * 10000})
+
+    summary = run_summary.summarize_results(results).to_dict()
+
+    assert summary['outcomes'] == {'records_written': 1600, 'chunks_completed': 200, 'records_failed': 400,
+                                   'chunks_failed': 1}
+    assert summary['stages']['enrich_record']['count'] == 200
+    assert summary['stages']['enrich_record']['max_ms'] == 2000.0
+    assert [chunk['chunk'] for chunk in summary['slowest_chunks']] == ["199", "198", "197", "196", "195"]
+    assert len(summary['failed_keys_sample']) == run_summary.DEFAULT_FAILED_KEYS_SAMPLE
+    assert summary['failed_keys_sample'][0] == "0/1:s3://raw/0.pdf"
+    assert len(summary['errors_sample'][0]) == run_summary.MAX_ERROR_LENGTH
+
+    ## merging in another order gives the same counts and timings
+    reversed_summary = run_summary.summarize_results(list(reversed(results))).to_dict()
+    assert reversed_summary['outcomes'] == summary['outcomes']
+    assert reversed_summary['stages'] == summary['stages']
+    assert reversed_summary['slowest_chunks'] == summary['slowest_chunks']
+
+
+class RecordingS3Client(object):
+    """s3 client stand-in that records put objects"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = json.loads(Body)
+
+
+def test_chunk_detail_goes_to_the_configured_uri(monkeypatch):
+    client = RecordingS3Client()
+    monkeypatch.setattr(aws_clients, 's3', lambda: client)
+    ## Parameter Store values are merged into the configuration, not the environment
+    monkeypatch.setitem(process_batch.configuration, 'RUN_SUMMARY_S3_URI', "s3://runs/summaries/")
+
+    summary = chunk_summary(3)
+
+    assert summary['details']['chunks'] == "s3://runs/summaries/run-1/"
+    assert client.objects[("runs", "summaries/run-1/chunk-3.json")]['failed_keys'] == ["300/1:s3://raw/300.pdf",
+                                                                                      "301/1:s3://raw/301.pdf"]
+
+
+def test_chunk_result_leaves_the_records_out():
+    event = dict(run_event(30), chunks=[record(n) for n in range(10)], chunk_index=2,
+                 process_batch_stats={'number_of_records_to_process': 10})
+
+    result = process_batch.chunk_result(event, run_summary.RunSummary.from_dict(chunk_summary(2)))
+
+    assert sorted(result) == ['chunk_index', 'parameters', 'process_batch_stats', 'run_id', 'run_summary']
+    assert result['parameters'] == event['parameters']
+
+
+def test_summarize_run_drops_the_records():
+    event = summarize_run.handler([dict(run_event(50), run_summary=chunk_summary(0)),
+                                   {'run_summary': chunk_summary(1)}], None)
+
+    assert 'fda' not in event and 'chunks' not in event
+    assert event['process_batch_stats'] == {'number_of_records_to_process': 50}
+    assert event['run_summary']['outcomes']['chunks_completed'] == 2
+
+
+def test_notifications_stay_the_same_size(sns):
+    for number_of_records in [10, 10000]:
+        notify_job_complete.handler(run_event(number_of_records, run_summary=chunk_summary(0)), None)
+
+    small, large = [len(message['Message']) for message in sns.messages]
+    assert abs(large - small) < 10
+    message = json.loads(sns.messages[-1]['Message'])
+    assert message['number_of_records_to_process'] == 10000
+    assert message['run_summary']['outcomes']['records_written'] == 8
+    assert sns.messages[-1]['Subject'] == "Job Completed : Process Batch FDA : s3://bucket/delta/2020/09/02/deltafile.csv"
+
+
+def test_failure_notification_includes_the_error(sns):
+    class Context(object):
+        aws_request_id = "request-1"
+
+    event = run_event(10000, error={'Error': "Exception", 'Cause': "Nothing to process, delta files not found!"})
+    event['parameters']['s3_delta_file_path'] = "s3://" + "b" * 200
+
+    with pytest.raises(notify_failure_to_operations_user.ProcessBatchFDAStateMachineFailedException):
+        notify_failure_to_operations_user.handler(event, Context())
+
+    message = json.loads(sns.messages[0]['Message'])
+    assert message['run_summary']['errors_sample'] == ["Exception: Nothing to process, delta files not found!"]
+    assert len(sns.messages[0]['Subject']) <= run_summary.MAX_SUBJECT_LENGTH
+    assert len(sns.messages[0]['Message']) < 2000
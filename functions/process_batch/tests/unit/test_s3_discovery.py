@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import delta_file
+import s3_discovery
+
+BUCKET = "s3-discovery-test"
+FOLDER = "mdit/fda/data/inbound/approved_drugs/premarin/4782/suppl/125/cfm"
+
+
+class CountingClient(object):
+    """s3 client wrapper that counts list_objects_v2 requests"""
+
+    def __init__(self, client):
+        self.client = client
+        self.requests = []
+
+    def list_objects_v2(self, **kwargs):
+        self.requests.append(kwargs)
+        return self.client.list_objects_v2(**kwargs)
+
+
+def row(s3_path):
+    return {'s3_path': s3_path, 'ApplNo': "4782", 'SubmissionNo': "125"}
+
+
+def test_empty_prefix_lists_nothing(s3):
+    discovery = s3_discovery.S3Discovery(s3_client=s3)
+
+    assert discovery.list_keys(BUCKET, "missing/", ".csv") == []
+
+
+def test_listing_follows_pages_and_is_cached(s3):
+    for i in range(1005):
+        s3.put_object(Bucket=BUCKET, Key=f"metadata/{i:04d}.txt", Body=b"")
+    client = CountingClient(s3)
+    discovery = s3_discovery.S3Discovery(s3_client=client)
+
+    keys = discovery.list_keys(BUCKET, "metadata/", ".TXT")
+    assert len(keys) == 1005
+    assert len(client.requests) == 2
+
+    assert discovery.list_keys(BUCKET, "metadata/", ".txt") == keys
+    assert len(client.requests) == 2
+
+
+def test_list_many_keeps_the_order_given(s3):
+    s3.put_object(Bucket=BUCKET, Key="delta/2020/09/02/deltafile.csv", Body=b"")
+    s3.put_object(Bucket=BUCKET, Key="metadata/2020/09/02/Products.txt", Body=b"")
+    discovery = s3_discovery.S3Discovery(s3_client=s3, workers=4)
+
+    delta, metadata = discovery.list_many([(BUCKET, "delta/2020/09/02", ".csv"),
+                                           (BUCKET, "metadata/2020/09/02", ".txt")])
+
+    assert delta == ["delta/2020/09/02/deltafile.csv"]
+    assert metadata == ["metadata/2020/09/02/Products.txt"]
+
+
+def test_cfm_folders_expand_in_place(s3):
+    for name in ["a.pdf", "b.PDF", "index.html"]:
+        s3.put_object(Bucket=BUCKET, Key=f"{FOLDER}/{name}", Body=b"")
+    client = CountingClient(s3)
+    discovery = s3_discovery.S3Discovery(s3_client=client)
+    rows = [row(f"s3://{BUCKET}/label/first.pdf"), row(f"s3://{BUCKET}/{FOLDER}"),
+            row(f"s3://{BUCKET}/label/last.pdf"), row(f"s3://{BUCKET}/{FOLDER}")]
+
+    expanded = discovery.expand_cfm_rows(rows, delta_file.is_cfm_folder)
+
+    assert [r['s3_path'] for r in expanded] == [
+        f"s3://{BUCKET}/label/first.pdf",
+        f"s3://{BUCKET}/{FOLDER}/a.pdf", f"s3://{BUCKET}/{FOLDER}/b.PDF",
+        f"s3://{BUCKET}/label/last.pdf",
+        f"s3://{BUCKET}/{FOLDER}/a.pdf", f"s3://{BUCKET}/{FOLDER}/b.PDF"]
+    assert all(r['ApplNo'] == "4782" for r in expanded)
+    assert rows[1]['s3_path'] == f"s3://{BUCKET}/{FOLDER}"
+    assert len(client.requests) == 1
+
+
+def test_empty_cfm_folder_is_dropped_with_a_warning(s3, caplog):
+    discovery = s3_discovery.S3Discovery(s3_client=s3)
+
+    expanded = discovery.expand_cfm_rows([row(f"s3://{BUCKET}/{FOLDER}")], delta_file.is_cfm_folder)
+
+    assert expanded == []
+    assert "no pdfs found in the cfm folder" in caplog.text
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import json
+
+import boto3
+import pytest
+from moto import mock_s3, mock_dynamodb, mock_stepfunctions
+
+import aws_clients
+import s3_trigger
+
+BUCKET = "s3-trigger-test"
+TABLE = "process-batch-triggers"
+DELTA = "mdit/fda/delta"
+METADATA = "mdit/fda/metadata"
+DELTA_LINES = [
+    "ApplicationDocsTypeID,ApplNo,SubmissionType,SubmissionNo,ApplicationDocsURL,DrugName,S3Path",
+    "1,4782,SUPPL,125,http://www.accessdata.fda.gov/4782.pdf,PREMARIN,s3://raw/premarin/4782/suppl/125/",
+]
+
+
+@pytest.fixture()
+def aws(monkeypatch):
+    with mock_s3(), mock_dynamodb(), mock_stepfunctions():
+        aws_clients.reset()
+        s3 = boto3.client('s3', region_name='us-east-2')
+        s3.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': 'us-east-2'})
+        boto3.client('dynamodb', region_name='us-east-2').create_table(
+            TableName=TABLE, KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+            ProvisionedThroughput={'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1})
+        sfn = boto3.client('stepfunctions', region_name='us-east-2')
+        state_machine = sfn.create_state_machine(
+            name="process-batch", definition=json.dumps({"StartAt": "Done", "States": {"Done": {"Type": "Succeed"}}}),
+            roleArn="arn:aws:iam::123456789012:role/process-batch")
+
+        for key, value in [("BUCKET_NAME", BUCKET), ("DELTA_FILE_PATH", DELTA), ("METADATA_FILE_PATH", METADATA),
+                           ("NUM_METADATA_FILES", "2"), ("TRIGGER_TABLE_NAME", TABLE),
+                           ("STATE_MACHINE_ARN", state_machine['stateMachineArn'])]:
+            monkeypatch.setitem(s3_trigger.configuration, key, value)
+        monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-2")
+        yield s3, sfn, state_machine['stateMachineArn']
+        aws_clients.reset()
+
+
+def notification(*keys):
+    return {'Records': [{'s3': {'bucket': {'name': BUCKET}, 'object': {'key': key}}} for key in keys]}
+
+
+def put(s3, key, body=b""):
+    s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+    return key
+
+
+def test_partition_of_keys():
+    assert s3_trigger.partition_of(f"{DELTA}/2020/09/02/deltafile.csv", DELTA, METADATA) == "2020-09-02"
+    assert s3_trigger.partition_of(f"{METADATA}/2020/09/02/Products.txt", DELTA + "/", METADATA) == "2020-09-02"
+    assert s3_trigger.partition_of("mdit/fda/other/2020/09/02/x.txt", DELTA, METADATA) is None
+
+
+def test_eventbridge_object_created():
+    event = {'detail-type': 'Object Created', 'detail': {'bucket': {'name': BUCKET}, 'object': {'key': "a/b.txt"}}}
+
+    assert list(s3_trigger.object_keys(event)) == [(BUCKET, "a/b.txt")]
+
+
+def test_waits_until_the_partition_is_complete(aws):
+    s3, sfn, arn = aws
+    delta = put(s3, f"{DELTA}/2020/09/02/deltafile.csv", "\n".join(DELTA_LINES).encode())
+    first = put(s3, f"{METADATA}/2020/09/02/Products.txt")
+
+    assert s3_trigger.handler(notification(delta, first), None) == {'partitions': {"2020-09-02": "waiting"}}
+    assert sfn.list_executions(stateMachineArn=arn)['executions'] == []
+
+    last = put(s3, f"{METADATA}/2020/09/02/Submissions.txt")
+    assert s3_trigger.handler(notification(last), None) == {'partitions': {"2020-09-02": "started"}}
+
+    executions = sfn.list_executions(stateMachineArn=arn)['executions']
+    assert [execution['name'] for execution in executions] == ["process-batch-2020-09-02"]
+    execution_input = json.loads(sfn.describe_execution(executionArn=executions[0]['executionArn'])['input'])
+    assert execution_input['parameters']['s3_delta_file_path'] == f"s3://{BUCKET}/{delta}"
+    assert execution_input['fda']['process_batch_stats']['number_of_records_to_process'] == 1
+
+
+def test_repeated_triggers_start_one_execution(aws):
+    s3, sfn, arn = aws
+    keys = [put(s3, f"{DELTA}/2020/09/02/deltafile.csv", "\n".join(DELTA_LINES).encode()),
+            put(s3, f"{METADATA}/2020/09/02/Products.txt"),
+            put(s3, f"{METADATA}/2020/09/02/Submissions.txt")]
+
+    outcomes = [s3_trigger.handler(notification(key), None)['partitions']["2020-09-02"] for key in keys]
+
+    assert outcomes == ["started", "duplicate", "duplicate"]
+    assert len(sfn.list_executions(stateMachineArn=arn)['executions']) == 1
+    item = boto3.client('dynamodb', region_name='us-east-2').get_item(
+        TableName=TABLE, Key={'id': {'S': "process-batch-2020-09-02"}})['Item']
+    assert item['status']['S'] == "started"
+
+
+def test_execution_name_dedupes_without_a_table(aws, monkeypatch):
+    s3, sfn, arn = aws
+    monkeypatch.setitem(s3_trigger.configuration, "TRIGGER_TABLE_NAME", "")
+    keys = [put(s3, f"{DELTA}/2020/09/02/deltafile.csv", "\n".join(DELTA_LINES).encode()),
+            put(s3, f"{METADATA}/2020/09/02/Products.txt"),
+            put(s3, f"{METADATA}/2020/09/02/Submissions.txt")]
+
+    assert s3_trigger.handler(notification(keys[2]), None)['partitions']["2020-09-02"] == "started"
+    assert s3_trigger.handler(notification(keys[1]), None)['partitions']["2020-09-02"] == "duplicate"
+    assert len(sfn.list_executions(stateMachineArn=arn)['executions']) == 1
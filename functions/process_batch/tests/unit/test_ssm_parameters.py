@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import os
+
+import utils
+
+LAYER = os.path.join(os.path.dirname(__file__), '..', '..', '..', '..', 'layers', 'layer_ssm_parameters', 'python')
+
+
+def test_load_ssm_parameters_without_prefix(monkeypatch):
+    monkeypatch.delenv(utils.SSM_PARAMETER_PREFIX_ENV, raising=False)
+    assert utils.load_ssm_parameters() == {}
+
+
+def test_load_ssm_parameters_from_cached_layer(monkeypatch):
+    monkeypatch.syspath_prepend(os.path.abspath(LAYER))
+    from ssm_parameter_cache import ParameterCache, LocalParameterStore
+
+    store = LocalParameterStore({'/regintel/process-batch/STATE_MACHINE_ARN': 'arn:aws:states:::stateMachine:x',
+                                 '/regintel/process-batch/DEFAULT_CHUNK_SIZE': '25'})
+    monkeypatch.setenv(utils.SSM_PARAMETER_PREFIX_ENV, '/regintel/process-batch')
+    monkeypatch.setattr(utils, '_parameter_cache',
+                        ParameterCache(prefix='/regintel/process-batch/', client=store))
+
+    for _ in range(3):
+        parameters = utils.load_ssm_parameters()
+
+    assert parameters == {'STATE_MACHINE_ARN': 'arn:aws:states:::stateMachine:x', 'DEFAULT_CHUNK_SIZE': '25'}
+    assert store.calls['get_parameters_by_path'] == 1
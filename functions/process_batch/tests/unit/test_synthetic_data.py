@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import filecmp
+import os
+
+import delta_file
+from fda_api import FDAAPI
+from tools import synthetic_data
+
+SOURCE = os.path.join(os.path.dirname(__file__), 'data', 'metadata')
+
+
+def test_generate_is_deterministic(tmp_path):
+    first = synthetic_data.generate(str(tmp_path / "a"), scale=0.01, seed=3, source=SOURCE, delta_rows=20)
+    second = synthetic_data.generate(str(tmp_path / "b"), scale=0.01, seed=3, source=SOURCE, delta_rows=20)
+
+    assert first['rows'] == second['rows']
+    for name in synthetic_data.HEADERS:
+        assert filecmp.cmp(os.path.join(first['metadata'], name), os.path.join(second['metadata'], name),
+                           shallow=False)
+    assert filecmp.cmp(first['deltas'][0], second['deltas'][0], shallow=False)
+
+
+def test_generated_files_load_and_enrich(tmp_path):
+    generated = synthetic_data.generate(str(tmp_path), scale=0.01, seed=1, source=SOURCE, delta_rows=15)
+
+    api = FDAAPI(S3_metadata_loc=generated['metadata'], test=True)
+    assert api.load_timings['application']['rows'] == generated['applications']
+    assert api.load_timings['submission']['rows'] == generated['rows']['Submissions.txt']
+
+    records = delta_file.load_local_records(generated['deltas'][0])
+    assert len(records) == 15
+
+    payload = api.format_record(records[0])
+    assert payload['fda']['application_no'] == int(records[0]['application_no'])
+    assert payload['drug_name'] == records[0]['drug_name']
+    assert payload['fda']['submission_status'] == 'AP'
+    api.close()
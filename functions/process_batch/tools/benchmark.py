@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+"""
+Benchmark the process_batch hot paths against local FDA metadata.
+
+Measures FDAAPI construction (per table read, convert and insert time),
+per-record format_response latency percentiles, delta file loading and
+chunking, and peak RSS. Results are written as JSON and can be compared with
+a previous run; the exit code is 1 when a metric regressed by more than the
+threshold.
+
+Run from functions/process_batch:
+    python -m tools.benchmark --output bench.json
+    python -m tools.benchmark --baseline bench.json --threshold 0.2
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import shutil
+import resource
+import tempfile
+import statistics
+import subprocess
+import datetime
+
+import delta_file
+from fda_api import FDAAPI
+from metrics import percentile
+from tools import synthetic_data
+
+FUNCTION_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_METADATA = os.path.join(FUNCTION_DIR, 'data', 'metadata')
+DEFAULT_DELTA = os.path.join(FUNCTION_DIR, 'data', 'deltafile.csv')
+
+## differences below these floors are treated as noise when comparing runs
+NOISE_FLOOR_SECONDS = 0.002
+NOISE_FLOOR_MS = 0.5
+NOISE_FLOOR_MB = 5.0
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else rss / 1024.0
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=FUNCTION_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def bench_construction(metadata, repeat):
+    """Build FDAAPI `repeat` times; report median total and per table timings"""
+    totals = []
+    tables = {}
+    api = None
+    for _ in range(repeat):
+        if api is not None:
+            api.close()
+
+        start = time.perf_counter()
+        api = FDAAPI(S3_metadata_loc=metadata, test=True)
+        totals.append(time.perf_counter() - start)
+
+        for table, timing in api.load_timings.items():
+            for key in ('read_seconds', 'convert_seconds', 'insert_seconds'):
+                tables.setdefault(table, {}).setdefault(key, []).append(timing[key])
+            tables[table]['rows'] = timing['rows']
+
+    metrics = {'fdaapi.construct.seconds': statistics.median(totals)}
+    for table, timing in tables.items():
+        metrics[f'fdaapi.{table}.rows'] = timing['rows']
+        for key in ('read_seconds', 'convert_seconds', 'insert_seconds'):
+            metrics[f'fdaapi.{table}.{key}'] = statistics.median(timing[key])
+
+    return api, metrics
+
+
+def bench_format_response(api, records, passes):
+    """Time format_record for every record, `passes` times over"""
+    latencies = []
+    for _ in range(passes):
+        for record in records:
+            start = time.perf_counter()
+            api.format_record(record)
+            latencies.append((time.perf_counter() - start) * 1000.0)
+
+    return {
+        'format_response.records': len(latencies),
+        'format_response.mean_ms': statistics.mean(latencies) if latencies else 0.0,
+        'format_response.p50_ms': percentile(latencies, 50),
+        'format_response.p90_ms': percentile(latencies, 90),
+        'format_response.p99_ms': percentile(latencies, 99),
+        'format_response.max_ms': max(latencies) if latencies else 0.0,
+    }
+
+
+def bench_delta_loading(delta, chunk_size, repeat):
+    """Time reading, parsing and chunking the delta file as load_delta_file does"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        records = [delta_file.map_row(row) for row in
+                   delta_file.parse_delta_rows(delta_file.read_delta_lines(delta, is_local=True))
+                   if not delta_file.is_cfm_folder(row)]
+        records, _, _ = delta_file.coalesce_records(records)
+        chunks = delta_file.chunk_records(records, chunk_size, key=delta_file.enrichment_key)
+        timings.append(time.perf_counter() - start)
+
+    return records, {
+        'load_delta_file.seconds': statistics.median(timings),
+        'load_delta_file.records': len(records),
+        'load_delta_file.chunks': len(chunks),
+    }
+
+
+def is_enrichable(record):
+    return all(record[key].strip().isdigit() for key in
+               ('application_no', 'submission_no', 'appplication_docs_type_id'))
+
+
+def run(args):
+    if args.synthetic_scale:
+        folder = tempfile.mkdtemp(prefix="fda_synthetic_")
+        try:
+            generated = synthetic_data.generate(folder, scale=args.synthetic_scale, seed=args.seed)
+            args.metadata, args.delta = generated['metadata'], generated['deltas'][0]
+            result = run_benchmarks(args)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+        result['meta']['synthetic_scale'] = args.synthetic_scale
+        result['meta']['seed'] = args.seed
+        return result
+
+    return run_benchmarks(args)
+
+
+def run_benchmarks(args):
+    metrics = {}
+
+    records, delta_metrics = bench_delta_loading(args.delta, args.chunk_size, args.repeat)
+    metrics.update(delta_metrics)
+
+    api, construct_metrics = bench_construction(args.metadata, args.repeat)
+    metrics.update(construct_metrics)
+
+    metrics.update(bench_format_response(api, [r for r in records if is_enrichable(r)], args.passes))
+    api.close()
+
+    metrics['peak_rss_mb'] = peak_rss_mb()
+
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'metadata': args.metadata,
+            'delta': args.delta,
+        },
+        'metrics': metrics
+    }
+
+
+def is_timing(name):
+    return name.endswith('_seconds') or name.endswith('.seconds') or name.endswith('_ms') or name.endswith('_mb')
+
+
+def noise_floor(name):
+    if name.endswith('_ms'):
+        return NOISE_FLOOR_MS
+    if name.endswith('_mb'):
+        return NOISE_FLOOR_MB
+    return NOISE_FLOOR_SECONDS
+
+
+def compare_results(baseline, current, threshold):
+    """Compare two benchmark results
+
+    Args:
+        baseline (dict): earlier benchmark result
+        current (dict): new benchmark result
+        threshold (float): allowed relative slowdown, 0.2 is 20%
+
+    Returns:
+        list: (metric, baseline value, current value, relative change) of regressions
+    """
+    regressions = []
+    for name, old in sorted(baseline['metrics'].items()):
+        new = current['metrics'].get(name)
+        if new is None or not is_timing(name) or old <= 0:
+            continue
+
+        change = (new - old) / old
+        if change > threshold and new - old > noise_floor(name):
+            regressions.append((name, old, new, change))
+
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the process_batch hot paths")
+    parser.add_argument("--metadata", default=DEFAULT_METADATA, help="local FDA metadata folder")
+    parser.add_argument("--delta", default=DEFAULT_DELTA, help="local delta csv")
+    parser.add_argument("--repeat", type=int, default=3, help="FDAAPI builds and delta loads to time")
+    parser.add_argument("--passes", type=int, default=3, help="passes over the delta records")
+    parser.add_argument("--chunk-size", type=int, default=10, help="records per chunk")
+    parser.add_argument("--synthetic-scale", type=float, default=0.0,
+                        help="benchmark generated metadata at this scale instead of --metadata/--delta")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated metadata")
+    parser.add_argument("--output", default="", help="write results to this JSON file")
+    parser.add_argument("--baseline", default="", help="compare with an earlier results file")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed relative slowdown before failing (default: 0.2)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = run(args)
+
+    output = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressions = compare_results(baseline, result, args.threshold)
+    for name, old, new, change in regressions:
+        sys.stderr.write(f"REGRESSION {name}: {old:.4f} -> {new:.4f} (+{change:.0%})\n")
+
+    if regressions:
+        return 1
+
+    sys.stderr.write(f"no regressions above {args.threshold:.0%} against {baseline['meta'].get('revision', '')}\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
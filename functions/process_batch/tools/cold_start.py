@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Measure the import time of the Lambda handler modules in fresh interpreters.
+
+Each module is imported `--repeat` times, every time in a new Python
+process, which is what a Lambda cold start pays before the first handler
+call. The median is compared with the budget, and modules that should only
+be imported on first use (boto3, botocore) must not be loaded by the
+import; the exit code is 1 when either check fails.
+
+Run from functions/process_batch:
+    python -m tools.cold_start
+    python -m tools.cold_start --budget-ms 100 --output cold_start.json
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+FUNCTION_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HANDLER_MODULES = ['process_batch', 'load_parameters', 's3_trigger', 'summarize_run', 'notify_job_complete',
+                   'notify_failure_to_operations_user', 'lookup']
+
+## loaded by aws_clients on first use, never at import
+DEFERRED_MODULES = ['boto3', 'botocore']
+
+DEFAULT_BUDGET_MS = 100.0
+
+MARKER = "COLD_START_RESULT "
+
+## runs in the fresh interpreter; the handlers log to stdout, so the result line is marked
+PROBE = """
+import sys, json, time
+start = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - start) * 1000.0
+deferred = [name for name in {deferred!r} if name in sys.modules]
+sys.stdout.write("\\n{marker}" + json.dumps({{'import_ms': elapsed, 'loaded': deferred}}) + "\\n")
+"""
+
+
+def measure_import(module, python=sys.executable):
+    """Import `module` in a new interpreter
+
+    Returns:
+        dict: import_ms, and the deferred modules the import loaded
+    """
+    env = dict(os.environ, LOG_LEVEL="WARNING", PYTHONDONTWRITEBYTECODE="1")
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    code = PROBE.format(module=module, deferred=DEFERRED_MODULES, marker=MARKER)
+    process = subprocess.run([python, "-c", code], cwd=FUNCTION_DIR, env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{process.stderr.decode()}")
+
+    output = process.stdout.decode()
+    for line in reversed(output.splitlines()):
+        if line.startswith(MARKER):
+            return json.loads(line[len(MARKER):])
+    raise RuntimeError(f"no result from importing {module}")
+
+
+def measure(modules, repeat):
+    results = {}
+    for module in modules:
+        runs = [measure_import(module) for _ in range(repeat)]
+        timings = [run['import_ms'] for run in runs]
+        results[module] = {
+            'median_ms': round(statistics.median(timings), 3),
+            'max_ms': round(max(timings), 3),
+            'loaded': sorted(set(name for run in runs for name in run['loaded'])),
+        }
+    return results
+
+
+def check_budget(results, budget_ms):
+    """Failures of the measured modules
+
+    Returns:
+        list: (module, reason) for every module over budget or loading a deferred module
+    """
+    failures = []
+    for module, result in sorted(results.items()):
+        if result['median_ms'] > budget_ms:
+            failures.append((module, f"import took {result['median_ms']:.1f} ms, budget {budget_ms:.1f} ms"))
+        if result['loaded']:
+            failures.append((module, "imported {} at module import".format(", ".join(result['loaded']))))
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the cold start import time of the handlers")
+    parser.add_argument("--modules", nargs="+", default=HANDLER_MODULES, help="modules to import")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per module")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help=f"allowed median import time per module (default: {DEFAULT_BUDGET_MS:.0f})")
+    parser.add_argument("--output", default="", help="write results to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = measure(args.modules, args.repeat)
+
+    output = json.dumps({'budget_ms': args.budget_ms, 'modules': results}, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    failures = check_budget(results, args.budget_ms)
+    for module, reason in failures:
+        sys.stderr.write(f"COLD START {module}: {reason}\n")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+"""
+Compare the event payloads of two enrichment engines.
+
+Both engines are built over the same metadata and run over the same delta
+records (or one record per application with --all-applications). Payloads
+are canonicalised before comparing: `last_updated` is dropped and lists,
+which are built from sets or unordered queries, are sorted. Differences are
+reported per field with example record keys; the exit code is 1 when any
+record differs.
+
+Engines are named in ENGINES, given as `module:callable` taking the
+metadata folder and returning an object with `format_record(record)`, or as
+`golden:<path>` to replay payloads recorded with --write-golden. Recording
+the reference engine once keeps repeated full corpus comparisons to the cost
+of the candidate engine alone.
+
+Run from functions/process_batch:
+    python -m tools.golden_compare --engine-a memory --engine-b snapshot
+    python -m tools.golden_compare --all-applications --write-golden golden.jsonl.gz
+    python -m tools.golden_compare --all-applications --engine-a golden:golden.jsonl.gz --workers 8
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import argparse
+import importlib
+import tempfile
+import multiprocessing
+
+import delta_file
+from fda_api import FDAAPI
+
+FUNCTION_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_METADATA = os.path.join(FUNCTION_DIR, 'data', 'metadata')
+DEFAULT_DELTA = os.path.join(FUNCTION_DIR, 'data', 'deltafile.csv')
+
+## fields that legitimately differ between runs
+IGNORED_FIELDS = ['last_updated']
+
+
+def memory_engine(metadata):
+    """FDAAPI as built by process_batch"""
+    return FDAAPI(S3_metadata_loc=metadata, test=True)
+
+
+def snapshot_engine(metadata):
+    """FDAAPI reading from a read-only snapshot file of the metadata"""
+    api = FDAAPI(S3_metadata_loc=metadata, test=True)
+    fd, path = tempfile.mkstemp(prefix="golden_", suffix=".db")
+    os.close(fd)
+    os.remove(path)
+    api.snapshot(path)
+    api.close()
+
+    snapshot_api = FDAAPI(snapshot=path)
+    snapshot_api.owns_snapshot = True  # removed by close()
+    return snapshot_api
+
+
+class GoldenEngine(object):
+    """Replays canonical payloads recorded by --write-golden"""
+
+    def __init__(self, path):
+        self.payloads = {}
+        with gzip.open(path, 'rt') as f:
+            for line in f:
+                item = json.loads(line)
+                self.payloads[item['key']] = item['payload']
+
+    def format_record(self, record):
+        key = record_key(record)
+        if key not in self.payloads:
+            raise KeyError(f"no golden payload for {key}")
+        return self.payloads[key]
+
+    def close(self):
+        pass
+
+
+ENGINES = {
+    'memory': memory_engine,
+    'snapshot': snapshot_engine,
+}
+
+
+def load_engine(name, metadata):
+    if name in ENGINES:
+        return ENGINES[name](metadata)
+    if name.startswith("golden:"):
+        return GoldenEngine(name[len("golden:"):])
+
+    module_name, _, attribute = name.partition(":")
+    if not attribute:
+        raise ValueError(f"unknown engine: {name}")
+    return getattr(importlib.import_module(module_name), attribute)(metadata)
+
+
+def canonical(value):
+    """Canonical form of a payload: ignored fields dropped, lists sorted"""
+    if isinstance(value, dict):
+        return dict((k, canonical(v)) for k, v in value.items() if k not in IGNORED_FIELDS)
+    if isinstance(value, (list, tuple, set)):
+        items = [canonical(v) for v in value]
+        return sorted(items, key=lambda v: json.dumps(v, sort_keys=True, default=str))
+    return value
+
+
+def diff_fields(a, b, path=""):
+    """Yield (field path, value a, value b) for every difference"""
+    if isinstance(a, dict) and isinstance(b, dict):
+        for key in sorted(set(a) | set(b), key=str):
+            field = f"{path}.{key}" if path else str(key)
+            if key not in a or key not in b:
+                yield (field, a.get(key, '<missing>'), b.get(key, '<missing>'))
+            else:
+                yield from diff_fields(a[key], b[key], field)
+    elif isinstance(a, list) and isinstance(b, list) and len(a) == len(b) and \
+            all(isinstance(v, dict) for v in a + b):
+        for x, y in zip(a, b):
+            yield from diff_fields(x, y, f"{path}[]")
+    elif a != b:
+        yield (path, a, b)
+
+
+def record_key(record):
+    return "{}/{}/{}:{}".format(record['application_no'], record['submission_no'],
+                                record['appplication_docs_type_id'], record['s3_path'])
+
+
+def enrich(engine, record):
+    try:
+        return canonical(engine.format_record(record))
+    except Exception as e:
+        return {'<error>': "{}: {}".format(type(e).__name__, e)}
+
+
+class Comparison(object):
+    """Per field differences between two engines, with a few example keys each"""
+
+    def __init__(self, max_examples=5):
+        self.max_examples = max_examples
+        self.records = 0
+        self.different_records = 0
+        self.fields = {}
+
+    def add(self, key, a, b):
+        self.records += 1
+        differences = list(diff_fields(a, b))
+        if not differences:
+            return
+
+        self.different_records += 1
+        for field, value_a, value_b in differences:
+            summary = self.fields.setdefault(field, {'count': 0, 'examples': []})
+            summary['count'] += 1
+            if len(summary['examples']) < self.max_examples:
+                summary['examples'].append({'key': key, 'a': value_a, 'b': value_b})
+
+    def merge(self, other):
+        self.records += other.records
+        self.different_records += other.different_records
+        for field, summary in other.fields.items():
+            mine = self.fields.setdefault(field, {'count': 0, 'examples': []})
+            mine['count'] += summary['count']
+            mine['examples'] = (mine['examples'] + summary['examples'])[:self.max_examples]
+
+    def to_dict(self):
+        return {
+            'records': self.records,
+            'different_records': self.different_records,
+            'fields': dict(sorted(self.fields.items(), key=lambda item: -item[1]['count']))
+        }
+
+
+## engines of the worker process, built once by init_worker
+WORKER_ENGINES = None
+
+
+def init_worker(engine_a, engine_b, metadata):
+    global WORKER_ENGINES
+    WORKER_ENGINES = (load_engine(engine_a, metadata), load_engine(engine_b, metadata) if engine_b else None)
+
+
+def compare_shard(records):
+    engine_a, engine_b = WORKER_ENGINES
+    comparison = Comparison()
+    for record in records:
+        comparison.add(record_key(record), enrich(engine_a, record), enrich(engine_b, record))
+    return comparison
+
+
+def record_shard(records):
+    engine_a = WORKER_ENGINES[0]
+    return [(record_key(record), enrich(engine_a, record)) for record in records]
+
+
+def map_shards(fn, shards, workers, initargs):
+    """Yield fn(shard) for every shard, in worker processes when workers > 1"""
+    if workers == 1:
+        init_worker(*initargs)
+        for shard in shards:
+            yield fn(shard)
+        return
+
+    pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=initargs)
+    try:
+        for result in pool.imap_unordered(fn, shards):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def application_records(metadata):
+    """One record per application in the metadata, for full corpus comparisons"""
+    api = FDAAPI(S3_metadata_loc=metadata, test=True)
+    rows = api.get_rows(
+        "select a.applNo applNo, coalesce(min(s.subNo), 1) subNo from %s a left join %s s on a.applNo = s.applNo "
+        "group by a.applNo order by a.applNo" % (FDAAPI.APPLICATION.tablename, FDAAPI.SUBMISSION.tablename))
+    api.close()
+
+    return [{'appplication_docs_type_id': '1', 'application_no': str(row['applNo']),
+             'submission_type': '', 'submission_no': str(row['subNo']), 'application_docs_url': '',
+             'drug_name': '', 's3_path': 's3://golden/%s/%s/' % (row['applNo'], row['subNo']), 'url': ''}
+            for row in rows]
+
+
+def run(args):
+    if args.all_applications:
+        records = application_records(args.metadata)
+    else:
+        records = delta_file.load_local_records(args.delta)
+    if args.limit:
+        records = records[:args.limit]
+
+    shards = delta_file.chunk_records(records, args.chunk_size)
+    workers = max(1, min(args.workers, len(shards)))
+
+    start = time.time()
+    if args.write_golden:
+        written = 0
+        with gzip.open(args.write_golden, 'wt') as f:
+            for outputs in map_shards(record_shard, shards, workers, (args.engine_a, None, args.metadata)):
+                for key, payload in outputs:
+                    f.write(json.dumps({'key': key, 'payload': payload}, default=str) + "\n")
+                    written += 1
+        return {'golden': args.write_golden, 'records': written, 'different_records': 0, 'fields': {},
+                'engines': [args.engine_a], 'seconds': round(time.time() - start, 3)}
+
+    comparison = Comparison()
+    for shard_comparison in map_shards(compare_shard, shards, workers,
+                                       (args.engine_a, args.engine_b, args.metadata)):
+        comparison.merge(shard_comparison)
+
+    report = comparison.to_dict()
+    report['engines'] = [args.engine_a, args.engine_b]
+    report['seconds'] = round(time.time() - start, 3)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the payloads of two enrichment engines")
+    parser.add_argument("--engine-a", default="memory", help="reference engine (default: memory)")
+    parser.add_argument("--engine-b", default="snapshot", help="candidate engine (default: snapshot)")
+    parser.add_argument("--metadata", default=DEFAULT_METADATA, help="local FDA metadata folder")
+    parser.add_argument("--delta", default=DEFAULT_DELTA, help="local delta csv")
+    parser.add_argument("--all-applications", action="store_true",
+                        help="compare one record per application instead of the delta")
+    parser.add_argument("--limit", type=int, default=0, help="compare at most this many records")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--chunk-size", type=int, default=200, help="records per shard")
+    parser.add_argument("--write-golden", default="",
+                        help="record engine A payloads to this .jsonl.gz file instead of comparing")
+    parser.add_argument("--output", default="", help="write the report to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+    if args.write_golden:
+        sys.stderr.write("{} payloads of {} recorded to {} ({}s)\n".format(
+            report['records'], args.engine_a, args.write_golden, report['seconds']))
+        return 0
+
+    sys.stderr.write("{} of {} records differ between {} and {} ({}s)\n".format(
+        report['different_records'], report['records'], args.engine_a, args.engine_b, report['seconds']))
+    for field, summary in report['fields'].items():
+        example = summary['examples'][0]
+        sys.stderr.write("  {}: {} records, e.g. {}: {!r} != {!r}\n".format(
+            field, summary['count'], example['key'], example['a'], example['b']))
+
+    return 1 if report['different_records'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
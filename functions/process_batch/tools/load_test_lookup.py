@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+"""
+Load test the lookup endpoint against a local stand-in of API Gateway.
+
+Builds (or opens) a lookup snapshot, serves `lookup.handler` from a local
+HTTP server that turns requests into API Gateway proxy events, and sends a
+mix of application, submission document and batched lookups from
+concurrent clients. Latencies are measured at the client, and in the
+handler alone; the report gives p50/p90/p99/max per kind of lookup and the
+exit code is 1 when the overall client p99 is above the target.
+
+Run from functions/process_batch:
+    python -m tools.load_test_lookup --synthetic-scale 0.1 --requests 5000 --concurrency 8
+    python -m tools.load_test_lookup --snapshot /tmp/fda_lookup.db --p99-ms 25 --output lookup.json
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+## the handler logs every snapshot table it reads at INFO
+os.environ.setdefault('LOG_LEVEL', "WARNING")
+
+import lookup
+import metrics
+
+FUNCTION_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_METADATA = os.path.join(FUNCTION_DIR, 'data', 'metadata')
+
+DEFAULT_P99_MS = 50.0
+
+## routes of the API in template.yml, with their path parameters
+ROUTES = [
+    (re.compile(r"^/fda/applications/(?P<application_no>[^/]+)/submissions/(?P<submission_no>[^/]+)"
+                r"/documents/(?P<docs_type_id>[^/]+)$"), 'GET'),
+    (re.compile(r"^/fda/applications/(?P<application_no>[^/]+)$"), 'GET'),
+    (re.compile(r"^/fda/lookups$"), 'POST'),
+]
+
+
+class ApiGatewayStandIn(BaseHTTPRequestHandler):
+    """Turns HTTP requests into API Gateway proxy events for lookup.handler"""
+
+    ## time spent in the handler, which is what the Lambda bills and reports as its duration
+    handler_ms = []
+
+    def handle_request(self, method):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8')
+        for pattern, route_method in ROUTES:
+            match = pattern.match(self.path)
+            if match and route_method == method:
+                event = {'httpMethod': method, 'path': self.path, 'pathParameters': match.groupdict() or None,
+                         'body': body or None}
+                start = time.perf_counter()
+                result = lookup.handler(event, None)
+                self.handler_ms.append((time.perf_counter() - start) * 1000.0)
+                break
+        else:
+            result = lookup.response(404, {'error': "no route"})
+
+        payload = result['body'].encode('utf-8')
+        self.send_response(result['statusCode'])
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def sample_keys(snapshot, limit=2000, seed=0):
+    """Application numbers and (application, submission, docs type) triples present in the snapshot"""
+    conn = sqlite3.connect(snapshot)
+    try:
+        applications = [row[0] for row in conn.execute(
+            "SELECT DISTINCT applNo FROM %s WHERE applNo != '' LIMIT ?" % lookup.FDAAPI.PRODUCT.tablename, (limit,))]
+        documents = [tuple(row) for row in conn.execute(
+            "SELECT DISTINCT applNo, submissionNo, docsTypeId FROM %s WHERE applNo != '' LIMIT ?"
+            % lookup.FDAAPI.APPLICATION_DOC.tablename, (limit,))]
+    finally:
+        conn.close()
+
+    if not applications:
+        raise ValueError(f"no applications in the snapshot: {snapshot}")
+    random.Random(seed).shuffle(applications)
+    return applications, documents
+
+
+def make_requests(count, applications, documents, batch_size, seed=0):
+    """(kind, path, body) of the requests, about 45% applications, 45% documents and 10% batches"""
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(count):
+        draw = rng.random()
+        if draw < 0.1 and batch_size:
+            lookups = [{'application_no': rng.choice(applications)} for _ in range(batch_size)]
+            requests.append(('batch', "/fda/lookups", json.dumps({'lookups': lookups})))
+        elif draw < 0.55 and documents:
+            application_no, submission_no, docs_type_id = rng.choice(documents)
+            requests.append(('document', "/fda/applications/{}/submissions/{}/documents/{}".format(
+                application_no, submission_no, docs_type_id), None))
+        else:
+            requests.append(('application', "/fda/applications/{}".format(rng.choice(applications)), None))
+    return requests
+
+
+def send(base_url, request):
+    kind, path, body = request
+    data = body.encode('utf-8') if body is not None else None
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(base_url + path, data=data), timeout=30) as reply:
+            reply.read()
+            status = reply.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return kind, status, (time.perf_counter() - start) * 1000.0
+
+
+def latency_report(latencies):
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(metrics.percentile(latencies, 50), 3),
+        'p90_ms': round(metrics.percentile(latencies, 90), 3),
+        'p99_ms': round(metrics.percentile(latencies, 99), 3),
+        'max_ms': round(max(latencies), 3) if latencies else 0.0,
+    }
+
+
+def run(snapshot, requests=2000, concurrency=4, batch_size=10, p99_ms=DEFAULT_P99_MS, seed=0):
+    """Serve the snapshot from the stand-in and send the requests
+
+    Returns:
+        dict: report with per kind latencies, status counts and throughput
+    """
+    lookup.configuration['LOOKUP_SNAPSHOT_S3_URI'] = ""
+    lookup.configuration['LOOKUP_SNAPSHOT_PATH'] = snapshot
+    lookup.reset()
+
+    applications, documents = sample_keys(snapshot, seed=seed)
+    planned = make_requests(requests, applications, documents, batch_size, seed=seed)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ApiGatewayStandIn)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = "http://127.0.0.1:{}".format(server.server_address[1])
+
+    try:
+        ## the first request loads the snapshot, as on a cold container
+        cold = send(base_url, ('application', "/fda/applications/{}".format(applications[0]), None))
+        ApiGatewayStandIn.handler_ms = []
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(lambda request: send(base_url, request), planned))
+        seconds = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+        lookup.reset()
+
+    by_kind, statuses = {}, {}
+    for kind, status, elapsed in results:
+        by_kind.setdefault(kind, []).append(elapsed)
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    overall = latency_report([elapsed for _, _, elapsed in results])
+    return {
+        'snapshot': snapshot,
+        'concurrency': concurrency,
+        'batch_size': batch_size,
+        'seconds': round(seconds, 3),
+        'requests_per_second': round(len(results) / seconds, 3) if seconds else 0.0,
+        'cold_request_ms': round(cold[2], 3),
+        'statuses': statuses,
+        'overall': overall,
+        'handler': latency_report(ApiGatewayStandIn.handler_ms),
+        'kinds': dict((kind, latency_report(latencies)) for kind, latencies in sorted(by_kind.items())),
+        'p99_target_ms': p99_ms,
+        'passed': overall['p99_ms'] <= p99_ms and set(statuses) <= {'200'},
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the lookup endpoint against a local stand-in")
+    parser.add_argument("--snapshot", default="", help="existing lookup snapshot")
+    parser.add_argument("--metadata", default=DEFAULT_METADATA, help="metadata folder to build the snapshot from")
+    parser.add_argument("--synthetic-scale", type=float, default=0.0,
+                        help="build the snapshot from synthetic metadata at this scale")
+    parser.add_argument("--requests", type=int, default=2000, help="requests sent (default: 2000)")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent clients (default: 4)")
+    parser.add_argument("--batch-size", type=int, default=10, help="lookups per batched request (default: 10)")
+    parser.add_argument("--p99-ms", type=float, default=DEFAULT_P99_MS,
+                        help="p99 latency target in ms (default: %s)" % DEFAULT_P99_MS)
+    parser.add_argument("--seed", type=int, default=0, help="seed of the request mix")
+    parser.add_argument("--output", default="", help="write the report to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="load_test_lookup_") as folder:
+        snapshot = args.snapshot
+        if not snapshot:
+            metadata = args.metadata
+            if args.synthetic_scale:
+                from tools import synthetic_data
+
+                metadata = synthetic_data.generate(folder, scale=args.synthetic_scale, seed=args.seed)['metadata']
+            snapshot = lookup.build_snapshot(metadata, os.path.join(folder, "fda_lookup.db"))
+
+        report = run(snapshot, requests=args.requests, concurrency=args.concurrency, batch_size=args.batch_size,
+                     p99_ms=args.p99_ms, seed=args.seed)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    return 0 if report['passed'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+"""
+Run the whole pipeline in process, against local stand-ins of the AWS services.
+
+The delta and metadata files are uploaded to an S3 partition served by
+moto, then the handlers run as the state machine runs them:
+load_parameters starts an execution, its input is read back from the Step
+Functions stand-in, every chunk goes through process_batch (payloads are
+published to the EventBridge stand-in), summarize_run reduces the chunk
+results and notify_job_complete (or notify_failure_to_operations_user)
+publishes to an SNS stand-in. The report gives end-to-end records/sec, the
+time of every stage, the bytes uploaded and the peak memory of the process.
+
+Metadata folders without some of the FDA files (like tests/unit/data/metadata)
+get empty ones, so their tables are left empty.
+
+Run from functions/process_batch:
+    python -m tools.local_pipeline --delta tests/unit/data/deltafile.csv --metadata tests/unit/data/metadata
+    python -m tools.local_pipeline --synthetic-scale 0.1 --chunk-size 50 --trace-memory --output pipeline.json
+    python -m tools.local_pipeline --synthetic-scale 0.1 --compress .gz
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import tempfile
+import contextlib
+import tracemalloc
+
+import metrics
+import compression
+from fda_api import FDAAPI
+
+BUCKET = "local-pipeline"
+DELTA_PREFIX = "fda/delta"
+METADATA_PREFIX = "fda/metadata"
+REGION = "us-east-2"
+
+METADATA_FILES = [item.filename for item in [
+    FDAAPI.ACTION_TYPE, FDAAPI.APPLICATION_DOC, FDAAPI.APPLICATION, FDAAPI.APPLICATION_DOC_TYPE,
+    FDAAPI.MARKETING_STATUS, FDAAPI.MARKETING_STATUS_LOOKUP, FDAAPI.PRODUCT, FDAAPI.SUBMISSION_CLASS,
+    FDAAPI.SUBMISSION_PROPERTY_TYPE, FDAAPI.SUBMISSION, FDAAPI.TE]]
+
+## state machine of the stand-in; the runner plays its states itself
+STATE_MACHINE_DEFINITION = {"StartAt": "Process Chunks", "States": {"Process Chunks": {"Type": "Succeed"}}}
+
+## environment of the handlers, on top of the stand-in resources
+DEFAULT_ENVIRONMENT = {
+    'AWS_ACCESS_KEY_ID': "testing",
+    'AWS_SECRET_ACCESS_KEY': "testing",
+    'AWS_SECURITY_TOKEN': "testing",
+    'AWS_SESSION_TOKEN': "testing",
+    'AWS_DEFAULT_REGION': REGION,
+    'STAGE': "local",
+    'LOG_LEVEL': "WARNING",
+}
+
+
+class LocalContext(object):
+    """Lambda context of a local invocation"""
+
+    def __init__(self, function_name):
+        self.function_name = function_name
+        self.aws_request_id = "local-{}-{}".format(function_name, int(time.time() * 1000))
+
+    def get_remaining_time_in_millis(self):
+        return 900000
+
+
+@contextlib.contextmanager
+def aws_stand_ins():
+    """moto stand-ins for S3, EventBridge, SNS and Step Functions"""
+    from moto import mock_s3, mock_events, mock_sns, mock_stepfunctions
+
+    with mock_s3(), mock_events(), mock_sns(), mock_stepfunctions():
+        yield
+
+
+def upload_inputs(s3, delta, metadata, partition_date, codec=None):
+    """Upload the delta file and every FDA metadata file to the day's partitions
+
+    With a codec (e.g. `.gz`), files are uploaded compressed under their
+    name plus the codec extension.
+
+    Returns:
+        tuple: (number of metadata files, bytes uploaded)
+    """
+    def put(key, body):
+        if codec:
+            body = compression.CODECS[codec][1].compress(body)
+            key += codec
+        s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+        return len(body)
+
+    day = partition_date.strftime("%Y/%m/%d")
+    with open(delta, 'rb') as f:
+        uploaded = put(f"{DELTA_PREFIX}/{day}/deltafile.csv", f.read())
+
+    for filename in METADATA_FILES:
+        path = os.path.join(metadata, filename)
+        body = b""
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                body = f.read()
+        uploaded += put(f"{METADATA_PREFIX}/{day}/{filename}", body)
+
+    return len(METADATA_FILES), uploaded
+
+
+def create_resources(delta, metadata, partition_date, sink, codec=None):
+    """Create the stand-in resources and return the handlers' configuration and the bytes uploaded"""
+    import boto3
+
+    s3 = boto3.client('s3', region_name=REGION)
+    s3.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': REGION})
+    number_of_metadata_files, uploaded = upload_inputs(s3, delta, metadata, partition_date, codec)
+
+    state_machine = boto3.client('stepfunctions', region_name=REGION).create_state_machine(
+        name="process-batch", definition=json.dumps(STATE_MACHINE_DEFINITION),
+        roleArn="arn:aws:iam::123456789012:role/process-batch")
+    topic = boto3.client('sns', region_name=REGION).create_topic(Name="operations")
+
+    configuration = dict(DEFAULT_ENVIRONMENT)
+    configuration.update({
+        'BUCKET_NAME': BUCKET,
+        'DELTA_FILE_PATH': DELTA_PREFIX,
+        'METADATA_FILE_PATH': METADATA_PREFIX,
+        'NUM_METADATA_FILES': str(number_of_metadata_files),
+        'STATE_MACHINE_ARN': state_machine['stateMachineArn'],
+        'OPERATIONS_NOTIFICATION_ARN': topic['TopicArn'],
+        'OUTPUT_SINK': sink,
+    })
+    if sink == "s3":
+        configuration['OUTPUT_S3_URI'] = f"s3://{BUCKET}/output"
+    return configuration, uploaded
+
+
+def configure_handlers(configuration, chunk_size):
+    """Point the handler modules at the stand-ins
+
+    The handlers read their configuration from the environment when they are
+    imported, so modules imported earlier get it updated in place.
+
+    Returns:
+        dict: handler modules by name
+    """
+    os.environ.update(configuration)
+    os.environ['DEFAULT_CHUNK_SIZE'] = str(chunk_size)
+
+    import aws_clients
+    import load_parameters
+    import process_batch
+    import summarize_run
+    import notify_job_complete
+    import notify_failure_to_operations_user
+
+    aws_clients.reset()
+    for module in (load_parameters, process_batch, notify_job_complete):
+        module.configuration.update(os.environ)
+
+    return {
+        'load_parameters': load_parameters,
+        'process_batch': process_batch,
+        'summarize_run': summarize_run,
+        'notify_job_complete': notify_job_complete,
+        'notify_failure_to_operations_user': notify_failure_to_operations_user,
+    }
+
+
+class StageRecorder(object):
+    """Wall time of every stage, and its peak traced memory when tracemalloc is on"""
+
+    def __init__(self, trace_memory=False):
+        self.metrics = metrics.StageMetrics("LocalPipeline", {})
+        self.trace_memory = trace_memory
+        self.peak_bytes = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.trace_memory and hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        try:
+            with self.metrics.timer(name):
+                yield
+        finally:
+            if self.trace_memory:
+                self.peak_bytes[name] = max(self.peak_bytes.get(name, 0), tracemalloc.get_traced_memory()[1])
+
+    def report(self):
+        stages = {}
+        for name, (value, _) in self.metrics.summary().items():
+            stage, _, field = name.rpartition('.')
+            if stage:
+                stages.setdefault(stage, {})[field] = value
+        for name, peak in self.peak_bytes.items():
+            stages.setdefault(name, {})['peak_traced_mb'] = round(peak / 1048576.0, 3)
+        return stages
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    ## kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 3)
+
+
+def run_chunks(handlers, execution_input, recorder):
+    """Map state over the chunks: one process_batch invocation per chunk, errors caught"""
+    results = []
+    for index, chunk in enumerate(execution_input['fda']['chunks']):
+        event = {
+            'run_id': execution_input.get('run_id', ''),
+            'parameters': execution_input['parameters'],
+            'process_batch_stats': {'number_of_records_to_process': len(chunk)},
+            'chunks': chunk,
+            'chunk_index': index,
+        }
+        try:
+            with recorder.stage('process_batch'):
+                result = handlers['process_batch'].handler(event, LocalContext('process_batch'))
+            results.append(result)
+        except Exception as e:
+            results.append({'Error': type(e).__name__, 'Cause': str(e)})
+    return results
+
+
+def run(delta, metadata, partition_date=None, chunk_size=10, sink="eventbridge", trace_memory=False, codec=None):
+    """Run the pipeline over a delta file and a metadata folder
+
+    Returns:
+        dict: report with records/sec, stage timings, memory and the run summary
+    """
+    partition_date = partition_date or datetime.date.today()
+    recorder = StageRecorder(trace_memory)
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+
+    try:
+        with aws_stand_ins():
+            configuration, input_bytes = create_resources(delta, metadata, partition_date, sink, codec)
+            handlers = configure_handlers(configuration, chunk_size)
+            import aws_clients
+
+            start = time.perf_counter()
+            with recorder.stage('load_parameters'):
+                started = handlers['load_parameters'].handler(
+                    {'partition_date': partition_date.strftime("%Y-%m-%d"),
+                     'execution_name': "local-{}".format(int(time.time()))}, LocalContext('load_parameters'))
+
+            ## the state machine hands the execution input to the next states
+            execution = aws_clients.stepfunctions().describe_execution(executionArn=started['execution_arn'])
+            execution_input = json.loads(execution['input'])
+
+            results = run_chunks(handlers, execution_input, recorder)
+
+            with recorder.stage('summarize_run'):
+                summary_event = handlers['summarize_run'].handler([execution_input] + results,
+                                                                  LocalContext('summarize_run'))
+
+            failed = summary_event['run_summary']['outcomes'].get('chunks_failed', 0)
+            with recorder.stage('notify'):
+                if failed:
+                    try:
+                        handlers['notify_failure_to_operations_user'].handler(
+                            summary_event, LocalContext('notify_failure_to_operations_user'))
+                    except handlers['notify_failure_to_operations_user'].ProcessBatchFDAStateMachineFailedException:
+                        pass
+                else:
+                    handlers['notify_job_complete'].handler(summary_event, LocalContext('notify_job_complete'))
+            seconds = time.perf_counter() - start
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+
+    outcomes = summary_event['run_summary']['outcomes']
+    records_written = outcomes.get('records_written', 0)
+    return {
+        'delta': delta,
+        'metadata': metadata,
+        'chunk_size': chunk_size,
+        'sink': sink,
+        'codec': codec,
+        'input_bytes': input_bytes,
+        'records': execution_input['fda']['process_batch_stats']['number_of_records_to_process'],
+        'records_written': records_written,
+        'chunks': len(execution_input['fda']['chunks']),
+        'chunks_failed': failed,
+        'seconds': round(seconds, 3),
+        'records_per_second': round(records_written / seconds, 3) if seconds else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': recorder.report(),
+        'run_summary': summary_event['run_summary'],
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the pipeline in process against AWS stand-ins")
+    parser.add_argument("--delta", default="", help="local delta csv")
+    parser.add_argument("--metadata", default="", help="local folder of FDA metadata files")
+    parser.add_argument("--synthetic-scale", type=float, default=0.0,
+                        help="generate synthetic metadata and delta at this scale instead")
+    parser.add_argument("--delta-rows", type=int, default=None, help="rows of the synthetic delta")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument("--date", default="", help="partition date, YYYY-MM-DD (default: today)")
+    parser.add_argument("--chunk-size", type=int, default=10, help="records per chunk (default: 10)")
+    parser.add_argument("--sink", default="eventbridge", choices=["eventbridge", "s3", "null"],
+                        help="output sink of process_batch (default: eventbridge)")
+    parser.add_argument("--trace-memory", action="store_true", help="peak traced memory per stage (slower)")
+    parser.add_argument("--compress", default=None, choices=sorted(compression.CODECS),
+                        help="upload the inputs compressed with this codec")
+    parser.add_argument("--output", default="", help="write the report to this JSON file")
+    args = parser.parse_args(argv)
+    if not args.synthetic_scale and not (args.delta and args.metadata):
+        parser.error("--delta and --metadata, or --synthetic-scale, are required")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    partition_date = datetime.datetime.strptime(args.date, "%Y-%m-%d").date() if args.date else None
+
+    with tempfile.TemporaryDirectory(prefix="local_pipeline_") as folder:
+        delta, metadata = args.delta, args.metadata
+        if args.synthetic_scale:
+            from tools import synthetic_data
+
+            generated = synthetic_data.generate(folder, scale=args.synthetic_scale, seed=args.seed,
+                                                delta_rows=args.delta_rows)
+            delta, metadata = generated['deltas'][0], generated['metadata']
+
+        report = run(delta, metadata, partition_date=partition_date, chunk_size=args.chunk_size,
+                     sink=args.sink, trace_memory=args.trace_memory, codec=args.compress)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    return 1 if report['chunks_failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
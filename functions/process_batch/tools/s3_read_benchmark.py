@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Time `utils.read_obj_from_bucket(whole=True)` on an S3 object, with one GET and with
+concurrent byte ranges on an increasing number of workers.
+
+Every setting reads the object `--repeat` times and reports the median
+seconds and MB/s, so the throughput of the ranged reads can be compared
+with the single GET they replace.
+
+Run from functions/process_batch, with credentials for the bucket:
+    python -m tools.s3_read_benchmark --s3-uri s3://bucket/fda/lookup/fda_lookup.db.gz
+    python -m tools.s3_read_benchmark --s3-uri s3://bucket/key --workers 1 4 16 --part-mb 16 --output reads.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+import utils
+
+
+def time_read(s3_uri, repeat):
+    seconds = []
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        content = utils.read_obj_from_bucket(s3_uri, whole=True)
+        while content['Body'].read(utils.RANGED_GET_READ_SIZE):
+            pass
+        seconds.append(time.perf_counter() - start)
+        size = content['ContentLength']
+
+    median = statistics.median(seconds)
+    return {
+        'requests': content.get('Parts', 1),
+        'median_seconds': round(median, 3),
+        'mb_per_second': round(size / median / 1e6, 3) if median else 0.0,
+    }
+
+
+def run(s3_uri, workers, part_mb, repeat=3):
+    """Median read time of the object with a single GET, then with ranges on each number of workers
+
+    Returns:
+        dict: bytes of the object and one result per setting
+    """
+    part = str(int(part_mb * 1024 * 1024))
+    settings = [("single", {utils.S3_RANGED_GET_THRESHOLD_ENV: "0"})]
+    settings.extend((f"workers={count}", {utils.S3_RANGED_GET_THRESHOLD_ENV: part, utils.S3_RANGED_GET_PART_ENV: part,
+                                          utils.S3_RANGED_GET_WORKERS_ENV: str(count)}) for count in workers)
+
+    saved = dict((key, os.environ.get(key)) for _, environment in settings for key in environment)
+    results = {}
+    try:
+        for name, environment in settings:
+            os.environ.update(environment)
+            results[name] = time_read(s3_uri, repeat)
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+    import aws_clients
+
+    bucket_name, key, _ = utils.split_s3_url(s3_uri)
+    size = aws_clients.s3().head_object(Bucket=bucket_name, Key=key)['ContentLength']
+    return {'s3_uri': s3_uri, 'bytes': size, 'part_mb': part_mb, 'results': results}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Time single and ranged S3 reads of an object")
+    parser.add_argument("--s3-uri", required=True, help="object to read")
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8, 16], help="ranged read workers")
+    parser.add_argument("--part-mb", type=float, default=8.0, help="MB per range (default: 8)")
+    parser.add_argument("--repeat", type=int, default=3, help="reads per setting (default: 3)")
+    parser.add_argument("--output", default="", help="write the report to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args.s3_uri, args.workers, args.part_mb, args.repeat)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+"""
+Generate synthetic FDA metadata and delta files at a chosen scale.
+
+Files use the FDA tab separated schemas and windows-1252 encoding read by
+FDAAPI. Products per application follow the fan-out observed in the source
+metadata folder (data/metadata by default), drug names, forms and sponsors
+are sampled from it, and submissions and documents per application follow a
+heavy tailed distribution so a few hot applications carry most of the
+history. Delta rows are drawn from the generated documents, weighted by how
+hot their application is. Output is deterministic for a given seed.
+
+Scale 1.0 produces as many applications as the source folder.
+
+Run from functions/process_batch:
+    python -m tools.synthetic_data --output /tmp/fda_x10 --scale 10 --seed 7
+    python -m tools.benchmark --metadata /tmp/fda_x10/metadata --delta /tmp/fda_x10/deltafile.csv
+"""
+
+import os
+import sys
+import csv
+import heapq
+import random
+import shutil
+import argparse
+import datetime
+from collections import Counter
+
+from fda_api import FDAAPI
+
+FUNCTION_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SOURCE = os.path.join(FUNCTION_DIR, 'data', 'metadata')
+
+ENCODING = 'windows-1252'
+
+HEADERS = {
+    FDAAPI.APPLICATION.filename: ['ApplNo', 'ApplType', 'ApplPublicNotes', 'SponsorName'],
+    FDAAPI.PRODUCT.filename: ['ApplNo', 'ProductNo', 'Form', 'Strength', 'ReferenceDrug', 'DrugName',
+                              'ActiveIngredient', 'ReferenceStandard'],
+    FDAAPI.MARKETING_STATUS.filename: ['MarketingStatusID', 'ApplNo', 'ProductNo'],
+    FDAAPI.TE.filename: ['ApplNo', 'ProductNo', 'MarketingStatusID', 'TECode'],
+    FDAAPI.SUBMISSION.filename: ['ApplNo', 'SubmissionClassCodeID', 'SubmissionType', 'SubmissionNo',
+                                 'SubmissionStatus', 'SubmissionStatusDate', 'SubmissionsPublicNotes',
+                                 'ReviewPriority'],
+    FDAAPI.SUBMISSION_PROPERTY_TYPE.filename: ['ApplNo', 'SubmissionType', 'SubmissionNo',
+                                               'SubmissionPropertyTypeCode', 'SubmissionPropertyTypeID'],
+    FDAAPI.APPLICATION_DOC.filename: ['ApplicationDocsID', 'ApplicationDocsTypeID', 'ApplNo', 'SubmissionType',
+                                      'SubmissionNo', 'ApplicationDocsTitle', 'ApplicationDocsURL',
+                                      'ApplicationDocsDate'],
+}
+
+## small reference tables are copied from the source folder when present
+LOOKUP_FILES = [FDAAPI.ACTION_TYPE.filename, FDAAPI.APPLICATION_DOC_TYPE.filename,
+                FDAAPI.MARKETING_STATUS_LOOKUP.filename, FDAAPI.SUBMISSION_CLASS.filename]
+
+DEFAULT_LOOKUPS = {
+    FDAAPI.ACTION_TYPE.filename: [
+        ['ActionTypes_LookupID', 'ActionTypes_LookupDescription', 'SupplCategoryLevel1Code',
+         'SupplCategoryLevel2Code'],
+        ['1', 'Bioequivalence', 'BIOEQUIV', ''], ['2', 'Efficacy', 'EFFICACY', 'NOT APPLICABLE']],
+    FDAAPI.APPLICATION_DOC_TYPE.filename: [
+        ['ApplicationDocsType_Lookup_ID', 'ApplicationDocsType_Lookup_Description'],
+        ['1', 'Letter'], ['2', 'Label'], ['3', 'Review']],
+    FDAAPI.MARKETING_STATUS_LOOKUP.filename: [
+        ['MarketingStatusID', 'MarketingStatusDescription'],
+        ['1', 'Prescription'], ['2', 'Over-the-counter'], ['3', 'Discontinued'], ['4', 'None (Tentative Approval)']],
+    FDAAPI.SUBMISSION_CLASS.filename: [
+        ['SubmissionClassCodeID', 'SubmissionClassCode', 'SubmissionClassCodeDescription'],
+        ['1', 'BIOEQUIV', 'Bioequivalence'], ['2', 'EFFICACY', 'Efficacy'], ['3', 'LABELING', 'Labeling']],
+}
+
+DELTA_HEADER = ['ApplicationDocsTypeID', 'ApplNo', 'SubmissionType', 'SubmissionNo', 'ApplicationDocsURL',
+                'DrugName', 'S3Path']
+
+APPLICATION_TYPES = (['NDA', 'ANDA', 'BLA'], [0.3, 0.65, 0.05])
+TE_CODES = ['AA', 'AB', 'AB1', 'AB2', 'AN', 'AO', 'AP', 'AT', 'BC', 'BX']
+REVIEW_PRIORITIES = ['STANDARD', 'PRIORITY', 'UNKNOWN']
+
+
+class Vocabulary(object):
+    """
+    Values and fan-out sampled from an existing metadata folder
+
+    Args:
+        source (str): metadata folder, may be missing or partial
+    """
+
+    def __init__(self, source):
+        self.products = []
+        self.sponsors = []
+        self.products_per_application = Counter()
+
+        products_file = os.path.join(source, FDAAPI.PRODUCT.filename)
+        if os.path.exists(products_file):
+            for row in read_rows(products_file):
+                self.products.append((row['Form'], row['Strength'], row['DrugName'], row['ActiveIngredient']))
+                self.products_per_application[row['ApplNo']] += 1
+
+        applications_file = os.path.join(source, FDAAPI.APPLICATION.filename)
+        if os.path.exists(applications_file):
+            self.sponsors = sorted(set(row['SponsorName'] for row in read_rows(applications_file)
+                                       if row['SponsorName']))
+
+        if not self.products:
+            self.products = [('TABLET;ORAL', '10MG', 'SYNTHETIC', 'SYNTHETIC'),
+                             ('INJECTABLE;INJECTION', '5MG/ML', 'SYNTHETIC', 'SYNTHETIC')]
+            self.products_per_application = Counter({'000001': 1, '000002': 2, '000003': 3})
+        if not self.sponsors:
+            self.sponsors = ['SYNTHETIC PHARMS']
+
+        # histogram of products per application
+        fanout = Counter(self.products_per_application.values())
+        self.fanout_values = sorted(fanout)
+        self.fanout_weights = [fanout[v] for v in self.fanout_values]
+        self.application_count = len(self.products_per_application)
+
+
+def read_rows(path):
+    with open(path, 'r', encoding=ENCODING) as f:
+        for row in csv.DictReader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+            yield row
+
+
+class TsvWriter(object):
+    """Tab separated writer in the FDA file format"""
+
+    def __init__(self, path, header):
+        self.fh = open(path, 'w', encoding=ENCODING, errors='replace', newline='')
+        self.rows = -1
+        self.write(header)
+
+    def write(self, values):
+        self.fh.write("\t".join(str(v).replace("\t", " ") for v in values) + "\n")
+        self.rows += 1
+
+    def close(self):
+        self.fh.close()
+
+
+def random_date(rng, start_year=1939, end_year=2020):
+    start = datetime.date(start_year, 1, 1).toordinal()
+    end = datetime.date(end_year, 12, 31).toordinal()
+    return datetime.date.fromordinal(rng.randint(start, end))
+
+
+def generate(output, scale=1.0, seed=0, source=DEFAULT_SOURCE, delta_rows=None, delta_files=1,
+             blank_fraction=0.0, hot_alpha=1.16):
+    """Write synthetic metadata and delta files
+
+    Args:
+        output (str): folder receiving metadata/ and deltafile.csv
+        scale (float): number of applications relative to the source folder
+        seed (int): random seed
+        source (str): metadata folder the distributions are sampled from
+        delta_rows (int, optional): rows per delta file, 100 x scale by default
+        delta_files (int): number of delta files to write
+        blank_fraction (float): fraction of empty delta rows, as found in FDA exports
+        hot_alpha (float): pareto shape of submissions per application, lower is more skewed
+
+    Returns:
+        dict: paths and row counts of the generated files
+    """
+    rng = random.Random(seed)
+    vocabulary = Vocabulary(source)
+
+    metadata_dir = os.path.join(output, 'metadata')
+    os.makedirs(metadata_dir, exist_ok=True)
+
+    applications = max(int(vocabulary.application_count * scale), 1)
+    delta_rows = int(delta_rows) if delta_rows is not None else max(int(100 * scale), 1)
+    sample_size = delta_rows * max(int(delta_files), 1)
+
+    writers = dict((name, TsvWriter(os.path.join(metadata_dir, name), header))
+                   for name, header in HEADERS.items())
+
+    # weighted reservoir (A-Res) of documents for the delta files
+    reservoir = []
+    document_id = 0
+
+    try:
+        for index in range(applications):
+            appl_no = "%06d" % (index + 1)
+            appl_type = rng.choices(APPLICATION_TYPES[0], APPLICATION_TYPES[1])[0]
+            writers[FDAAPI.APPLICATION.filename].write(
+                [appl_no, appl_type, '', rng.choice(vocabulary.sponsors)])
+
+            # products, marketing status and therapeutic equivalence
+            number_of_products = rng.choices(vocabulary.fanout_values, vocabulary.fanout_weights)[0]
+            form, strength, drug_name, ingredient = rng.choice(vocabulary.products)
+            for product in range(1, number_of_products + 1):
+                product_no = "%03d" % product
+                if product > 1:
+                    _, strength, _, _ = rng.choice(vocabulary.products)
+                marketing_status = rng.choices([1, 2, 3, 4], [0.45, 0.1, 0.44, 0.01])[0]
+                writers[FDAAPI.PRODUCT.filename].write(
+                    [appl_no, product_no, form, strength, int(product == 1), drug_name, ingredient,
+                     int(product == 1 and rng.random() < 0.3)])
+                writers[FDAAPI.MARKETING_STATUS.filename].write([marketing_status, appl_no, product_no])
+                if marketing_status in (1, 2) and rng.random() < 0.8:
+                    writers[FDAAPI.TE.filename].write(
+                        [appl_no, product_no, marketing_status, rng.choice(TE_CODES)])
+
+            # heavy tailed submission history; hot applications have hundreds
+            number_of_submissions = min(int(rng.paretovariate(hot_alpha) * 2), 2000)
+            submission_date = random_date(rng)
+            for submission_no in range(1, number_of_submissions + 1):
+                submission_type = 'ORIG' if submission_no == 1 else 'SUPPL'
+                submission_date = min(submission_date + datetime.timedelta(days=rng.randint(1, 400)),
+                                      datetime.date(2020, 12, 31))
+                status_date = submission_date.strftime("%Y-%m-%d 00:00:00")
+                writers[FDAAPI.SUBMISSION.filename].write(
+                    [appl_no, rng.randint(1, 27), submission_type, submission_no, 'AP', status_date, '',
+                     rng.choice(REVIEW_PRIORITIES)])
+
+                if rng.random() < 0.05:
+                    writers[FDAAPI.SUBMISSION_PROPERTY_TYPE.filename].write(
+                        [appl_no, submission_type, submission_no, 'Orphan', 1])
+
+                for _ in range(rng.choices([0, 1, 2, 3], [0.3, 0.45, 0.2, 0.05])[0]):
+                    document_id += 1
+                    docs_type_id = rng.choices([1, 2, 3], [0.5, 0.35, 0.15])[0]
+                    url = "http://www.accessdata.fda.gov/drugsatfda_docs/synthetic/%s/%s%ss%03d_%d.pdf" % (
+                        submission_date.year, appl_no, submission_type.lower(), submission_no, document_id)
+                    writers[FDAAPI.APPLICATION_DOC.filename].write(
+                        [document_id, docs_type_id, appl_no, submission_type, submission_no, '', url,
+                         status_date])
+
+                    # documents of hot applications are more likely to appear in deltas
+                    key = rng.random() ** (1.0 / number_of_submissions)
+                    item = (key, document_id, [docs_type_id, int(appl_no), submission_type.ljust(10),
+                                               submission_no, url, drug_name])
+                    if len(reservoir) < sample_size:
+                        heapq.heappush(reservoir, item)
+                    elif key > reservoir[0][0]:
+                        heapq.heapreplace(reservoir, item)
+
+        counts = dict((name, writer.rows) for name, writer in writers.items())
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    for name in LOOKUP_FILES:
+        source_file = os.path.join(source, name)
+        if os.path.exists(source_file):
+            shutil.copyfile(source_file, os.path.join(metadata_dir, name))
+        else:
+            writer = TsvWriter(os.path.join(metadata_dir, name), DEFAULT_LOOKUPS[name][0])
+            for values in DEFAULT_LOOKUPS[name][1:]:
+                writer.write(values)
+            writer.close()
+
+    documents = [item[2] for item in sorted(reservoir, key=lambda item: item[1])]
+    rng.shuffle(documents)
+
+    delta_paths = []
+    for number in range(max(int(delta_files), 1)):
+        name = 'deltafile.csv' if delta_files == 1 else 'deltafile_%03d.csv' % (number + 1)
+        path = os.path.join(output, name)
+        with open(path, 'w', encoding=ENCODING, newline='') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(DELTA_HEADER)
+            for values in documents[number * delta_rows:(number + 1) * delta_rows]:
+                if blank_fraction and rng.random() < blank_fraction:
+                    writer.writerow([''] * len(DELTA_HEADER))
+                drug_folder = values[5].lower().replace(' ', '_')
+                s3_path = "s3://synthetic-bucket/fda/approved_drugs/%s/%d/%s/%d/" % (
+                    drug_folder, values[1], values[2].strip().lower(), values[3])
+                writer.writerow(values + [s3_path])
+        delta_paths.append(path)
+
+    return {
+        'metadata': metadata_dir,
+        'deltas': delta_paths,
+        'applications': applications,
+        'rows': counts
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic FDA metadata and delta files")
+    parser.add_argument("--output", required=True, help="output folder")
+    parser.add_argument("--scale", type=float, default=1.0, help="applications relative to the source folder")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--source", default=DEFAULT_SOURCE, help="metadata folder to sample distributions from")
+    parser.add_argument("--delta-rows", type=int, default=None, help="rows per delta file (default: 100 x scale)")
+    parser.add_argument("--delta-files", type=int, default=1, help="number of delta files")
+    parser.add_argument("--blank-fraction", type=float, default=0.0, help="fraction of empty delta rows")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = generate(args.output, scale=args.scale, seed=args.seed, source=args.source,
+                      delta_rows=args.delta_rows, delta_files=args.delta_files,
+                      blank_fraction=args.blank_fraction)
+
+    print("metadata: {}".format(result['metadata']))
+    for path in result['deltas']:
+        print("delta: {}".format(path))
+    for name, count in sorted(result['rows'].items()):
+        print("{}: {} rows".format(name, count))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,17 @@
 #!/usr/bin/env python
 
+import io
 import logging
 import os
-import boto3
-from botocore.exceptions import ClientError
+import atexit
+import functools
 import json
 import sys
 
 from datetime import datetime
 import uuid
 
+import aws_clients
 from custom_log_formatter import CustomLogFormatter
 
 
@@ -25,43 +27,151 @@ def load_osenv():
 
     return config
 
+
+## Parameter Store values under SSM_PARAMETER_PREFIX, cached across warm invocations
+SSM_PARAMETER_PREFIX_ENV = "SSM_PARAMETER_PREFIX"
+SSM_PARAMETER_TTL_ENV = "SSM_PARAMETER_TTL"
+DEFAULT_SSM_PARAMETER_TTL = 300
+
+_parameter_cache = None
+
+
+def load_ssm_parameters(prefix=None):
+    """Parameter Store values under a prefix, keyed by their name relative to it
+
+    Values come from the ssm_parameter_cache layer and are reloaded, in one
+    batched call per prefix, once they are older than SSM_PARAMETER_TTL
+    seconds. Without a prefix, or without the layer, no parameters are loaded.
+
+    Args:
+        prefix (str, optional): parameter path, SSM_PARAMETER_PREFIX by default
+
+    Returns:
+        dict: e.g. {'STATE_MACHINE_ARN': 'arn:aws:states:...'}
+    """
+    global _parameter_cache
+
+    prefix = prefix or os.environ.get(SSM_PARAMETER_PREFIX_ENV, "")
+    if not prefix:
+        return {}
+    prefix = prefix if prefix.endswith("/") else prefix + "/"
+
+    if _parameter_cache is None or _parameter_cache.prefix != prefix:
+        try:
+            from ssm_parameter_cache import ParameterCache
+        except ImportError:
+            logger.warning("ssm_parameter_cache layer not found, %s parameters not loaded", prefix)
+            return {}
+
+        ttl = float(os.environ.get(SSM_PARAMETER_TTL_ENV, "") or DEFAULT_SSM_PARAMETER_TTL)
+        _parameter_cache = ParameterCache(prefix=prefix, expires_in=ttl, client=aws_clients.ssm())
+
+    return _parameter_cache.as_dict()
+
+## logging is configured once per process, see load_log_config
+LOG_LEVEL_ENV = "LOG_LEVEL"
+LOG_QUEUE_ENV = "LOG_QUEUE"
+DEFAULT_LOG_LEVEL = "INFO"
+
+_log_pid = None
+_log_listener = None
+
+logger = logging.getLogger(__name__)
+
 # Ref: citeline
 
 
-def load_log_config():
+def load_log_config(level=None):
     """
-    Configure custom logformatter
+    Configure custom logformatter on the root logger, once per process.
+
+    The level is read from LOG_LEVEL (default INFO). With LOG_QUEUE=true,
+    records are put on a queue and formatted and written by a listener
+    thread, so JSON serialisation stays off the calling thread. Later calls
+    return the root logger unchanged.
+
+    Args:
+        level (str, optional): log level, overrides LOG_LEVEL
+
+    Returns:
+        logging.Logger: root logger
     """
-    # basic configuration
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
+    global _log_pid, _log_listener
+
+    root = logging.getLogger()
+    if _log_pid == os.getpid():
+        return root
+
+    ## a forked process does not inherit the listener thread; write directly again
+    if _log_listener is not None:
+        from logging.handlers import QueueHandler
+
+        for handler in list(root.handlers):
+            if isinstance(handler, QueueHandler):
+                root.removeHandler(handler)
+        for handler in _log_listener.handlers:
+            root.addHandler(handler)
+        _log_listener = None
 
     formatter = CustomLogFormatter(
         '[%(levelname)s]\t%(asctime)s.%(msecs)dZ\t%(levelno)s\t%(message)s\n', '%Y-%m-%dT%H:%M:%S')
 
-    if logger.hasHandlers():
-        logger.debug("using default lambda log handler")
-        log_handler = logger.handlers[0]
-        log_handler.setFormatter(formatter)
+    if root.handlers:
+        ## default lambda log handler
+        log_handler = root.handlers[0]
     else:
-        logger.debug("creating a new handler")
-
-        # initialize the handler
         log_handler = logging.StreamHandler(sys.stdout)
-        log_handler.setFormatter(formatter)
-        logger.addHandler(log_handler)
+        root.addHandler(log_handler)
+    log_handler.setFormatter(formatter)
 
     ## set log level
-    logger.setLevel(logging.DEBUG)
+    level = (level or os.environ.get(LOG_LEVEL_ENV, "") or DEFAULT_LOG_LEVEL).upper()
+    root.setLevel(level if isinstance(logging.getLevelName(level), int) else DEFAULT_LOG_LEVEL)
+
+    for name in ('boto3', 'botocore', 'urllib3', 's3transfer'):
+        logging.getLogger(name).setLevel(logging.WARNING)
 
-    ## set loglevel
-    boto3.set_stream_logger('botocore', logging.WARNING)
-    boto3.set_stream_logger('boto3', logging.WARNING)
+    if os.environ.get(LOG_QUEUE_ENV, "").lower() in ("1", "true", "yes"):
+        import queue
+        from logging.handlers import QueueHandler, QueueListener
 
-    logging.getLogger('urllib3').setLevel(logging.WARNING)
-    logging.getLogger('s3transfer').setLevel(logging.WARNING)
+        log_queue = queue.Queue(-1)
+        root.removeHandler(log_handler)
+        root.addHandler(QueueHandler(log_queue))
+        _log_listener = QueueListener(log_queue, log_handler, respect_handler_level=True)
+        _log_listener.start()
+        atexit.register(_log_listener.stop)
 
-    return logger
+    _log_pid = os.getpid()
+    return root
+
+
+def flush_logs():
+    """Wait until the LOG_QUEUE listener has written every queued record
+
+    Lambda freezes the environment once the handler returns, so records
+    still queued, the EMF metrics lines among them, would be delayed to a
+    later invocation or lost. Without LOG_QUEUE there is nothing to wait for.
+    """
+    listener = _log_listener
+    if listener is None or _log_pid != os.getpid() or getattr(listener, '_thread', None) is None:
+        return
+
+    ## the listener marks every record it has handled as done
+    listener.queue.join()
+    for handler in listener.handlers:
+        handler.flush()
+
+
+def flushing_logs(handler):
+    """Decorate a Lambda handler so queued log records are written before it returns, see flush_logs"""
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        try:
+            return handler(event, context)
+        finally:
+            flush_logs()
+    return wrapper
 
 
 def make_unique_id():
@@ -89,10 +199,6 @@ def split_s3_url(s3_object_url):
 
     """
     # remove s3://
-
-    ## Load logger
-    logger = load_log_config()
-
     s3_object_url = s3_object_url.replace(
         "s3://", "") if "s3://" in s3_object_url else s3_object_url
 
@@ -109,30 +215,173 @@ def split_s3_url(s3_object_url):
     return (bucket_name, prefix, filename)
 
 
-def read_obj_from_bucket(object_path):
+## objects larger than the threshold are fetched as byte ranges over concurrent GETs; 0 always does a single GET
+S3_RANGED_GET_THRESHOLD_ENV = "S3_RANGED_GET_THRESHOLD_BYTES"
+S3_RANGED_GET_PART_ENV = "S3_RANGED_GET_PART_BYTES"
+S3_RANGED_GET_WORKERS_ENV = "S3_RANGED_GET_WORKERS"
+S3_RANGED_GET_SPOOL_ENV = "S3_RANGED_GET_SPOOL_BYTES"
+DEFAULT_RANGED_GET_THRESHOLD = 8 * 1024 * 1024
+DEFAULT_RANGED_GET_PART = 8 * 1024 * 1024
+DEFAULT_RANGED_GET_WORKERS = 8
+
+## objects larger than this are reassembled in a /tmp file rather than in memory
+DEFAULT_RANGED_GET_SPOOL = 256 * 1024 * 1024
+
+## bytes copied from a range's stream at a time
+RANGED_GET_READ_SIZE = 1024 * 1024
+
+
+def ranged_get_setting(key, default):
+    return int(os.environ.get(key, "") or default)
+
+
+class BufferBody(io.RawIOBase):
+    """Readable body over a reassembled object, served from its buffer without copying it first"""
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer)
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), len(self.view) - self.position)
+        b[:n] = self.view[self.position:self.position + n]
+        self.position += n
+        return n
+
+    def readall(self):
+        data = bytes(self.view[self.position:])
+        self.position = len(self.view)
+        return data
+
+
+def read_ranges(s3, bucket_name, key, threshold, size=None):
+    """get_object response of a whole object, fetched as concurrent byte ranges when it is larger than threshold
+
+    An object whose `size` is known to be at most `threshold` is read with
+    one plain GET. Otherwise the first GET asks for the first `threshold`
+    bytes, so a small object is still read by that single request. The rest of a larger object is split
+    into S3_RANGED_GET_PART_BYTES ranges fetched on S3_RANGED_GET_WORKERS
+    threads, each written straight to its offset of one preallocated
+    buffer, or of a /tmp file above S3_RANGED_GET_SPOOL_BYTES. Ranges are
+    read with the ETag of the first response, so an object replaced
+    meanwhile fails the read instead of mixing versions.
+    """
+    from botocore.exceptions import ClientError
+
+    if size is not None and size <= threshold:
+        return s3.get_object(Bucket=bucket_name, Key=key)
+
+    try:
+        first = s3.get_object(Bucket=bucket_name, Key=key, Range="bytes=0-%d" % (threshold - 1))
+    except ClientError as e:
+        ## empty objects have no byte range to satisfy
+        if e.response.get('Error', {}).get('Code') != 'InvalidRange':
+            raise
+        return s3.get_object(Bucket=bucket_name, Key=key)
+
+    size = int(first['ContentRange'].rsplit("/", 1)[1])
+    if size <= threshold:
+        return first
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    part_size = max(ranged_get_setting(S3_RANGED_GET_PART_ENV, DEFAULT_RANGED_GET_PART), 1)
+    workers = max(ranged_get_setting(S3_RANGED_GET_WORKERS_ENV, DEFAULT_RANGED_GET_WORKERS), 1)
+    ranges = [(start, min(start + part_size, size) - 1) for start in range(threshold, size, part_size)]
+
+    if size > ranged_get_setting(S3_RANGED_GET_SPOOL_ENV, DEFAULT_RANGED_GET_SPOOL):
+        import tempfile
+
+        target = tempfile.TemporaryFile(prefix="s3_ranges_")
+
+        def write(offset, data):
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(target.fileno(), view, offset)
+                view, offset = view[written:], offset + written
+    else:
+        target = bytearray(size)
+        buffer = memoryview(target)
+
+        def write(offset, data):
+            buffer[offset:offset + len(data)] = data
+
+    def copy(body, start, end):
+        offset = start
+        while True:
+            data = body.read(RANGED_GET_READ_SIZE)
+            if not data:
+                break
+            write(offset, data)
+            offset += len(data)
+        if offset != end + 1:
+            raise IOError(f"s3://{bucket_name}/{key}: got bytes {start}-{offset - 1} of {start}-{end}")
+
+    def fetch(start, end):
+        response = s3.get_object(Bucket=bucket_name, Key=key, Range="bytes=%d-%d" % (start, end),
+                                 IfMatch=first['ETag'])
+        copy(response['Body'], start, end)
+
+    try:
+        with ThreadPoolExecutor(max_workers=min(workers, len(ranges) + 1), thread_name_prefix="s3-range") as executor:
+            futures = [executor.submit(copy, first['Body'], 0, threshold - 1)]
+            futures.extend(executor.submit(fetch, start, end) for start, end in ranges)
+            for future in futures:
+                future.result()
+    except Exception:
+        if not isinstance(target, bytearray):
+            target.close()
+        raise
+
+    if isinstance(target, bytearray):
+        body = BufferBody(target)
+    else:
+        target.seek(0)
+        body = target
+
+    content = dict(first, Body=body, ContentLength=size, Parts=len(ranges) + 1)
+    content.pop('ContentRange', None)
+    return content
+
+
+def read_obj_from_bucket(object_path, whole=False, size=None):
     """Method to read from the s3 object path
 
+    The response's `Body` streams the object, so callers parsing or
+    decompressing it as it arrives never hold it whole. Callers that need
+    the whole object anyway pass `whole`: objects above
+    S3_RANGED_GET_THRESHOLD_BYTES are then fetched as concurrent byte ranges
+    and assembled before they are returned (see read_ranges). The `Body`
+    reads the same either way.
+
     Args:
         object_path (str): s3 object path
+        whole (bool): the caller reads the whole object before using it
+        size (int, optional): object size when already known, e.g. from a listing
     """
+    logger.info("Reading from: %s", object_path)
 
-    ## path
-    logger = load_log_config()
-
-    logger.info(f"Reading from: {object_path}")
-
-    client = boto3.resource("s3")
+    from botocore.exceptions import ClientError
 
     bucket_name, prefix, filename = split_s3_url(object_path)
-    s3_object = client.Object(bucket_name=bucket_name, key=prefix)
+    threshold = ranged_get_setting(S3_RANGED_GET_THRESHOLD_ENV, DEFAULT_RANGED_GET_THRESHOLD)
 
     try:
-        content = s3_object.get()
-        logger.info(
-            f"{content['ContentLength']} bytes read from the s3 object: {object_path}")
+        if whole and threshold > 0:
+            content = read_ranges(aws_clients.s3(), bucket_name, prefix, threshold, size)
+        else:
+            content = aws_clients.s3().get_object(Bucket=bucket_name, Key=prefix)
+        logger.info("%s bytes read from the s3 object in %s request(s): %s", content['ContentLength'],
+                    content.get('Parts', 1), object_path)
 
     except ClientError as e:
-        logger.exception(f"failed to read contents of the file: {object_path}")
+        if e.response.get('Error', {}).get('Code') == 'NoSuchKey':
+            logger.warning("s3 object not found: %s", object_path)
+        else:
+            logger.exception("failed to read contents of the file: %s", object_path)
         raise
 
     return content
@@ -164,11 +413,11 @@ def get_s3_objects(bucket, prefix='', suffix='.csv'):
         prefix (str, optional): [description]. Defaults to ''.
     """
     kwargs = {'Bucket': bucket, 'Prefix': prefix}
-    s3 = boto3.client('s3')
+    s3 = aws_clients.s3()
 
     while True:
         response = s3.list_objects_v2(**kwargs)
-        for obj in response['Contents']:
+        for obj in response.get('Contents', []):
             key = obj['Key']
             if key.endswith(suffix):
                 yield key
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+"""
+Cache of AWS Systems Manager Parameter Store values for Python Lambda functions.
+
+Python counterpart of the `layerSsmParameters` Node layer. Parameters are
+loaded in batches with GetParametersByPath and kept in memory, so warm
+invocations of a function share them. Values expire after `expires_in`
+seconds and are reloaded when they are next read; there is no background
+refresh.
+
+    from ssm_parameter_cache import ParameterCache
+    cache = ParameterCache(prefix='/regintel/process-batch/')
+
+    def handler(event, context):
+        state_machine_arn = cache.get_value('STATE_MACHINE_ARN')
+"""
+
+import time
+import threading
+
+FIVE_MINUTES = 300
+
+## GetParametersByPath returns at most 10 parameters per page
+MAX_RESULTS = 10
+
+
+class Parameter(object):
+    """Parameter Store value, with the time it expires from the cache"""
+
+    __slots__ = ('name', 'type', 'value', 'version', 'last_modified_date', 'arn', 'expires_at')
+
+    def __init__(self, parameter, expires_at):
+        self.name = parameter['Name']
+        self.type = parameter.get('Type')
+        self.value = parameter.get('Value')
+        self.version = parameter.get('Version')
+        self.last_modified_date = parameter.get('LastModifiedDate')
+        self.arn = parameter.get('ARN')
+        self.expires_at = expires_at
+
+    def __repr__(self):
+        return "Parameter({!r}, version={!r})".format(self.name, self.version)
+
+
+def is_parameter_not_found(error):
+    return getattr(error, 'response', {}).get('Error', {}).get('Code') == 'ParameterNotFound'
+
+
+class ParameterCache(object):
+    """
+    In-memory cache of Parameter Store values.
+
+    Args:
+        prefix (str): default parameter path prefix
+        with_decryption (bool): decrypt SecureString parameters
+        region (str, optional): AWS region of the default client
+        expires_in (float): seconds a value is served from the cache
+        client (optional): boto3 ssm client, or a LocalParameterStore in tests
+        clock (callable): returns the current time in seconds
+    """
+
+    def __init__(self, prefix='/', with_decryption=True, region=None, expires_in=FIVE_MINUTES,
+                 client=None, clock=time.monotonic):
+        self.prefix = prefix
+        self.with_decryption = with_decryption
+        self.region = region
+        self.expires_in = expires_in
+        self.clock = clock
+        self._client = client
+        self.parameters = {}
+        self.loaded = {}
+        self.lock = threading.RLock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client('ssm', region_name=self.region)
+        return self._client
+
+    def load(self, prefix=None):
+        """Load every parameter under a path prefix, in batches of MAX_RESULTS
+
+        **Queries the SSM Parameter Store**
+
+        Returns:
+            int: number of parameters loaded
+        """
+        prefix = self.prefix if prefix is None else prefix
+        kwargs = {'Path': prefix, 'Recursive': True, 'WithDecryption': self.with_decryption,
+                  'MaxResults': MAX_RESULTS}
+
+        parameters = []
+        while True:
+            response = self.client.get_parameters_by_path(**kwargs)
+            parameters.extend(response.get('Parameters', []))
+            if not response.get('NextToken'):
+                break
+            kwargs['NextToken'] = response['NextToken']
+
+        with self.lock:
+            expires_at = self.clock() + self.expires_in
+            for name in [name for name in self.parameters if name.startswith(prefix)]:
+                del self.parameters[name]
+            for parameter in parameters:
+                self.parameters[parameter['Name']] = Parameter(parameter, expires_at)
+            self.loaded[prefix] = expires_at
+
+        return len(parameters)
+
+    def loaded_prefix(self, name):
+        for prefix in self.loaded:
+            if name.startswith(prefix):
+                return prefix
+        return None
+
+    def get(self, key, prefix=None):
+        """Parameter `prefix + key`, from the cache while it has not expired
+
+        An expired parameter that was loaded with its prefix is refreshed by
+        reloading the whole prefix; other parameters are read one by one.
+
+        Returns:
+            Parameter: or None when it does not exist
+        """
+        name = (self.prefix if prefix is None else prefix) + key
+        now = self.clock()
+
+        with self.lock:
+            parameter = self.parameters.get(name)
+            if parameter is not None and parameter.expires_at > now:
+                return parameter
+
+            loaded_prefix = self.loaded_prefix(name)
+            if loaded_prefix is not None:
+                if self.loaded[loaded_prefix] <= now:
+                    self.load(loaded_prefix)
+                    return self.parameters.get(name)
+                if parameter is None:
+                    return None
+
+            try:
+                response = self.client.get_parameter(Name=name, WithDecryption=self.with_decryption)
+            except Exception as e:
+                if is_parameter_not_found(e):
+                    self.parameters.pop(name, None)
+                    return None
+                raise
+
+            parameter = Parameter(response['Parameter'], self.clock() + self.expires_in)
+            self.parameters[name] = parameter
+            return parameter
+
+    def get_value(self, key, default=None, prefix=None):
+        parameter = self.get(key, prefix)
+        return default if parameter is None else parameter.value
+
+    def has(self, key, prefix=None):
+        return self.get(key, prefix) is not None
+
+    def delete(self, key, prefix=None):
+        """Remove a value from the cache; does not remove it from the Parameter Store"""
+        with self.lock:
+            return self.parameters.pop((self.prefix if prefix is None else prefix) + key, None) is not None
+
+    def refresh(self, key, prefix=None):
+        with self.lock:
+            self.delete(key, prefix)
+            name = (self.prefix if prefix is None else prefix) + key
+            loaded_prefix = self.loaded_prefix(name)
+            if loaded_prefix is not None:
+                self.loaded[loaded_prefix] = self.clock()
+            return self.get(key, prefix)
+
+    def refresh_all(self):
+        self.clear_all()
+        return self.load()
+
+    def clear_all(self):
+        with self.lock:
+            self.parameters.clear()
+            self.loaded.clear()
+
+    def as_dict(self, prefix=None):
+        """Values under a prefix keyed by their name relative to it, loading them when expired
+
+        Returns:
+            dict: e.g. {'STATE_MACHINE_ARN': 'arn:aws:states:...'}
+        """
+        prefix = self.prefix if prefix is None else prefix
+        with self.lock:
+            if self.loaded.get(prefix, 0) <= self.clock():
+                self.load(prefix)
+            return dict((name[len(prefix):], parameter.value)
+                        for name, parameter in self.parameters.items() if name.startswith(prefix))
+
+
+class LocalParameterNotFound(Exception):
+    """Raised by LocalParameterStore like the ssm client's ParameterNotFound error"""
+
+    def __init__(self, name):
+        super(LocalParameterNotFound, self).__init__(name)
+        self.response = {'Error': {'Code': 'ParameterNotFound', 'Message': name}}
+
+
+class LocalParameterStore(object):
+    """
+    In-memory stand-in for the ssm client, for tests and local runs.
+
+    Args:
+        values (dict): parameter values keyed by full name
+    """
+
+    def __init__(self, values=None):
+        self.values = dict(values or {})
+        self.calls = {'get_parameters_by_path': 0, 'get_parameter': 0}
+
+    def put(self, name, value):
+        self.values[name] = value
+
+    def parameter(self, name):
+        return {'Name': name, 'Type': 'String', 'Value': self.values[name], 'Version': 1}
+
+    def get_parameters_by_path(self, Path, Recursive=True, WithDecryption=True, MaxResults=MAX_RESULTS,
+                               NextToken=None):
+        self.calls['get_parameters_by_path'] += 1
+        names = sorted(name for name in self.values if name.startswith(Path) and
+                       (Recursive or "/" not in name[len(Path):]))
+        start = int(NextToken or 0)
+        response = {'Parameters': [self.parameter(name) for name in names[start:start + MaxResults]]}
+        if start + MaxResults < len(names):
+            response['NextToken'] = str(start + MaxResults)
+        return response
+
+    def get_parameter(self, Name, WithDecryption=True):
+        self.calls['get_parameter'] += 1
+        if Name not in self.values:
+            raise LocalParameterNotFound(Name)
+        return {'Parameter': self.parameter(Name)}
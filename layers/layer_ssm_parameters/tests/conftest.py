@@ -0,0 +1,7 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+## the layer code is mounted under /opt/python in Lambda
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'python'))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# pylint: disable=redefined-outer-name,missing-docstring
+
+import pytest
+
+from ssm_parameter_cache import ParameterCache, LocalParameterStore
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture()
+def store():
+    values = dict(('/sample/key%02d' % i, 'value%d' % i) for i in range(25))
+    values['/other/key'] = 'other'
+    return LocalParameterStore(values)
+
+
+@pytest.fixture()
+def clock():
+    return Clock()
+
+
+def test_load_reads_prefix_in_batches(store, clock):
+    cache = ParameterCache(prefix='/sample/', client=store, clock=clock)
+
+    assert cache.load() == 25
+    assert store.calls['get_parameters_by_path'] == 3
+    assert cache.get_value('key07') == 'value7'
+    assert store.calls['get_parameter'] == 0
+
+
+def test_values_are_cached_until_they_expire(store, clock):
+    cache = ParameterCache(prefix='/sample/', client=store, clock=clock, expires_in=60)
+    assert cache.as_dict()['key01'] == 'value1'
+
+    store.put('/sample/key01', 'changed')
+    clock.now += 30
+    assert cache.get_value('key01') == 'value1'
+    assert cache.get_value('missing') is None
+    assert store.calls == {'get_parameters_by_path': 3, 'get_parameter': 0}
+
+    clock.now += 31
+    assert cache.get_value('key01') == 'changed'
+    assert store.calls['get_parameters_by_path'] == 6
+
+
+def test_unknown_prefix_reads_single_parameters(store, clock):
+    cache = ParameterCache(prefix='/sample/', client=store, clock=clock)
+
+    assert cache.get_value('key', prefix='/other/') == 'other'
+    assert cache.get_value('key', prefix='/other/') == 'other'
+    assert cache.get('nope', prefix='/other/') is None
+    assert store.calls['get_parameter'] == 2
+
+
+def test_refresh_and_delete(store, clock):
+    cache = ParameterCache(prefix='/sample/', client=store, clock=clock)
+    cache.load()
+
+    store.put('/sample/key02', 'new')
+    assert cache.refresh('key02').value == 'new'
+    assert cache.delete('key02')
+    assert not cache.delete('key02')
+
+    cache.clear_all()
+    assert cache.parameters == {}